@@ -1,32 +1,49 @@
 # Copyright (c) 2025 iFLYTEK CO.,LTD.
 # SPDX-License-Identifier: Apache 2.0 License
 
+from typing import Callable, Optional
+
 from langgraph.graph import END, START, StateGraph
+
+from src.utils.metrics import timed_node
 from .message import ReportState
 from .prep import preprocess_node, rewrite_node, classify_node, generic_node, clarify_node
 from .outline import outline_search_node, outline_node
-from .learning import learning_node
+from .learning import learning_node, learning_merge_node
 from .generate import generate_node, save_local_node, save_report_local
 
 
-def build_agent():
-    """Build and return the base state graph with all nodes and edges."""
+def build_agent(wrap_node: Optional[Callable[[str, Callable], Callable]] = None):
+    """
+    Build and return the base state graph with all nodes and edges.
+
+    Args:
+        wrap_node: Optional decorator applied to every node, called with the node name and the
+            node function (e.g. to profile the nodes)
+    """
     agent = StateGraph(ReportState)
+
+    def add_node(name: str, node: Callable) -> None:
+        node = timed_node(name, node)
+        agent.add_node(name, wrap_node(name, node) if wrap_node else node)
+
     agent.add_edge(START, "preprocess")
-    agent.add_node("preprocess", preprocess_node)
-    agent.add_node("rewrite", rewrite_node)
-    agent.add_node("classify", classify_node)
-    agent.add_node("clarify", clarify_node)
-    agent.add_node("generic", generic_node)
-    agent.add_node("outline_search", outline_search_node)
-    agent.add_node("outline", outline_node)
-    agent.add_node("learning", learning_node)
-    agent.add_node("generate", generate_node)
-    agent.add_node("save_local_node", save_local_node)
+    add_node("preprocess", preprocess_node)
+    add_node("rewrite", rewrite_node)
+    add_node("classify", classify_node)
+    add_node("clarify", clarify_node)
+    add_node("generic", generic_node)
+    add_node("outline_search", outline_search_node)
+    add_node("outline", outline_node)
+    add_node("learning", learning_node)
+    add_node("learning_merge", learning_merge_node)
+    add_node("generate", generate_node)
+    add_node("save_local_node", save_local_node)
 
     agent.add_edge("rewrite", "classify")
     agent.add_edge("outline_search", "outline")
-    agent.add_edge("learning", "generate")
+    agent.add_edge("learning", "learning_merge")
+    agent.add_edge("learning_merge", "generate")
     agent.add_conditional_edges(
         "generate",
         save_report_local,
@@ -2,22 +2,36 @@
 # SPDX-License-Identifier: Apache 2.0 License
 
 from typing import *
+import asyncio
 from dataclasses import dataclass
 import re
 import json
+import time
 import traceback
 from datetime import datetime
 
 import json_repair
 
 from src.tools import search
-from src.llms.llm import llm
+from src.llms.llm import allm, allm_batch
+from src.config.workflow_config import workflow_configs
 from src.prompts.template import apply_prompt_template
 from src.utils.print_util import colored_print
+from src.utils.token_util import count_tokens, split_tokens
+from src.utils.relevance import select_relevant
+from src.utils.fingerprint import NearDuplicateIndex, simhash
+from src.utils.similarity import cluster_similar
+from src.utils.metrics import DepthRecord, elapsed_since, record
 import logging
 
 logger = logging.getLogger(__name__)
 
+def get_fingerprint(result: search.SearchResult) -> int:
+    """Return the SimHash of a search result content, computed once per result"""
+    if result.fingerprint is None:
+        result.fingerprint = simhash(result.content)
+    return result.fingerprint
+
 @dataclass(kw_only=True)
 class Judge:
     name: str
@@ -29,6 +43,15 @@ class Knowledge:
     snippets: List[str]
     references: List[search.SearchResult]
 
+@dataclass(kw_only=True)
+class ExtractDocument:
+    """A search result, or a chunk of an oversized one, prepared for knowledge extraction"""
+    result: search.SearchResult
+    content: str
+    tokens: int = 0
+    chunk: int = 0
+    chunks: int = 1
+
 @dataclass(kw_only=True)
 class EvalResult:
     """Data structure to hold evaluation result information"""
@@ -51,7 +74,7 @@ class DeepSearchResult:
 class DeepSearch:
     """Deep search workflow"""
     def __init__(self, title:str, chapter:str, sub_chapter: List[str], chapter_outline:str, max_depth:int=2, search_top_n:int=3):
-        self._search_client = search.SearchClient()
+        self._search_executor = search.SearchExecutor()
         self._title = title
         self._chapter = chapter
         self._sub_chapter = sub_chapter
@@ -59,25 +82,59 @@ class DeepSearch:
         self._max_depth = max_depth
         self._search_top_n = search_top_n
         self._search_query_re = re.compile(r'(?s)<sq>(.*?)</sq>')
-
-    def deep_search(self) -> DeepSearchResult:
+        self._judge_timeout = workflow_configs.get('learning', {}).get('judge_timeout', 120)
+        extract_options = workflow_configs.get('extract', {})
+        self._extract_token_budget = extract_options.get('token_budget', 24000)
+        self._extract_chunk_tokens = extract_options.get('chunk_tokens', 8000)
+        self._extract_chunk_overlap = extract_options.get('chunk_overlap', 200)
+        self._extract_max_chunks = extract_options.get('max_chunks_per_document', 4)
+        self._relevance_filter = extract_options.get('relevance_filter', True)
+        self._relevance_token_budget = extract_options.get('relevance_token_budget', 4000)
+        self._relevance_passage_tokens = extract_options.get('relevance_passage_tokens', 200)
+        dedup_options = workflow_configs.get('dedup', {})
+        self._dedup = dedup_options.get('enabled', True)
+        self._dedup_min_chars = dedup_options.get('min_chars', 200)
+        # Shared by all depth levels, like the URLs already seen
+        self._duplicate_index: NearDuplicateIndex[search.SearchResult] = NearDuplicateIndex(
+            dedup_options.get('max_distance', 3))
+        cluster_options = workflow_configs.get('cluster', {})
+        self._cluster = cluster_options.get('enabled', True)
+        self._cluster_threshold = cluster_options.get('similarity_threshold', 0.8)
+        self._cluster_ngram = cluster_options.get('ngram', 2)
+
+    async def deep_search(self) -> DeepSearchResult:
         """Deep search for the given query"""
         outline = self._make_outline()
-        query = self._gen_search_query(outline)
-        judge_results = self._judge_query(outline)
-        result = self._deep_search(query, 1, judge_results, outline, '', set())
+        # Judges are only needed by the first evaluation, so they are generated in the background
+        # while the search queries are generated and searched
+        if self._max_depth > 1:
+            judge_results = asyncio.create_task(self._judge_query(outline))
+        else:
+            judge_results = asyncio.get_running_loop().create_future()
+            judge_results.set_result([])
+        try:
+            query = await self._gen_search_query(outline)
+            result = await self._deep_search(query, 1, judge_results, outline, '', set())
+        finally:
+            judge_results.cancel()
         result.re_knowledge = self._get_all_used_knowledge(result)
         return result
 
-    def _deep_search(self, query:List[str], depth:int, judge_results:List[Judge], outline:str, pre_answer:str, pre_knowledge: Set[str]) -> DeepSearchResult:
-        search_results = self._search_all(query)
-        all_search:Dict[str,List[search.SearchResult]] = {}
+    async def _deep_search(self, query:List[str], depth:int, judge_results:asyncio.Future, outline:str, pre_answer:str, pre_knowledge: Set[str]) -> DeepSearchResult:
+        perf_start = time.perf_counter()
+        search_results = await self._search_all(query)
+        new_results:List[Tuple[str, search.SearchResult]] = []
         for q, search_result in search_results.items():
             for result in search_result:
                 if result.url in pre_knowledge:
                     continue
                 pre_knowledge.add(result.url)
-                all_search.setdefault(q, []).append(result)
+                new_results.append((q, result))
+        if self._dedup:
+            new_results = await asyncio.to_thread(self._drop_near_duplicates, new_results)
+        all_search:Dict[str,List[search.SearchResult]] = {}
+        for q, result in new_results:
+            all_search.setdefault(q, []).append(result)
         
         deep_search_result = DeepSearchResult(
             query=query,
@@ -91,29 +148,89 @@ class DeepSearch:
         )
 
         if all_search:
-            deep_search_result.all_knowledge = self._extract_all_knowledge(outline, all_search)
+            all_knowledge = await self._extract_all_knowledge(outline, all_search)
+            if self._cluster:
+                all_knowledge = await asyncio.to_thread(self._merge_similar_knowledge, all_knowledge)
+            deep_search_result.all_knowledge = all_knowledge
         colored_print(f'Learning above webpage', color="purple")
-        knowledge, answer = self._gen_answer(outline, deep_search_result.all_knowledge)
+        knowledge, answer = await self._gen_answer(outline, deep_search_result.all_knowledge)
         deep_search_result.answer = answer
         deep_search_result.used_knowledge = knowledge
 
         if depth >= self._max_depth:
+            self._record_depth(depth, perf_start, deep_search_result, len(new_results))
             return deep_search_result
         colored_print(f'Learning done', color="purple")
         answer = pre_answer + answer
-        eval_list = self._evaluate(outline, answer, judge_results)
+        eval_list = await self._evaluate(outline, answer, await judge_results)
         deep_search_result.eval_result = eval_list
 
         unpass_eval = [eval for eval in eval_list if not eval.pass_label]
         if not unpass_eval:
+            self._record_depth(depth, perf_start, deep_search_result, len(new_results))
             return deep_search_result
         for eval in unpass_eval:
             colored_print(eval.reason, color="orange")
-        new_query = self._gen_research_query(query, outline, answer, unpass_eval)
+        new_query = await self._gen_research_query(query, outline, answer, unpass_eval)
+        self._record_depth(depth, perf_start, deep_search_result, len(new_results))
 
-        deep_search_result.children = self._deep_search(new_query, depth+1, judge_results, outline, answer, pre_knowledge)
+        deep_search_result.children = await self._deep_search(new_query, depth+1, judge_results, outline, answer, pre_knowledge)
         return deep_search_result
 
+    def _record_depth(self, depth:int, perf_start:float, result:DeepSearchResult, new_results:int) -> None:
+        """Record a depth level in the run metrics, its wall time excludes the deeper levels"""
+        start, wall = elapsed_since(perf_start)
+        record(DepthRecord(chapter=self._chapter, depth=depth, start=start, wall=wall, queries=len(result.query),
+                           results=new_results, knowledge=len(result.all_knowledge)))
+
+    def _drop_near_duplicates(self, results:List[Tuple[str, search.SearchResult]]) -> List[Tuple[str, search.SearchResult]]:
+        """
+        Drop the results whose content is a near-duplicate of a result already found by this chapter,
+        their URLs are kept as alternate URLs of the first copy
+
+        Args:
+            results: (query, result) pairs in search order
+
+        Returns:
+            The pairs left, in the same order
+        """
+        kept = []
+        for q, result in results:
+            if len(result.content) >= self._dedup_min_chars:
+                original = self._duplicate_index.find_or_add(get_fingerprint(result), result)
+                if original is not None:
+                    logger.info(f"{result.url} is a near-duplicate of {original.url}, skipped")
+                    original.alternate_urls.append(result.url)
+                    continue
+            kept.append((q, result))
+        return kept
+
+    def _merge_similar_knowledge(self, knowledge:List[Knowledge]) -> List[Knowledge]:
+        """
+        Collapse near-identical insights, found in different pages, into one item
+
+        Args:
+            knowledge: Extracted knowledge of a depth level
+
+        Returns:
+            One item per group of similar insights, in order of first appearance. The longest
+            insight of a group is kept, with the snippets and references of the whole group.
+        """
+        groups = cluster_similar([k.insight for k in knowledge], self._cluster_threshold, self._cluster_ngram)
+        merged:List[Knowledge] = []
+        for group in groups:
+            if len(group) == 1:
+                merged.append(knowledge[group[0]])
+                continue
+            items = [knowledge[i] for i in group]
+            snippets = list(dict.fromkeys(snippet for item in items for snippet in item.snippets))
+            references = list({id(ref): ref for item in items for ref in item.references}.values())
+            merged.append(Knowledge(insight=max((item.insight for item in items), key=len),
+                                    snippets=snippets, references=references))
+        if len(merged) < len(knowledge):
+            logger.info(f"merged {len(knowledge)} insights into {len(merged)}")
+        return merged
+
     def _make_outline(self) -> str:
         outline = f'- Writing topic: {self._title}\n'
         outline += f'- Writing requirement: Please focus on the topic "{self._chapter}" of this chapter'
@@ -125,10 +242,10 @@ class DeepSearch:
         outline += f'\n{self._chapter_outline}\n'
         return outline
 
-    def _gen_search_query(self, outline:str) -> List[str]:
+    async def _gen_search_query(self, outline:str) -> List[str]:
         search_query:List[str] = []
         try:
-            text = llm(llm_type='query_generation', messages=apply_prompt_template(
+            text = await allm(llm_type='query_generation', messages=apply_prompt_template(
                 prompt_name='learning/search_query',
                 state={
                     'now': datetime.now().strftime("%a %b %d %Y"),
@@ -142,10 +259,10 @@ class DeepSearch:
         except:
             return []
 
-    def _judge_query(self, query:str) -> List[Judge]:
+    async def _judge_query(self, query:str) -> List[Judge]:
         judge_result:List[Judge] = []
         try:
-            text = llm(llm_type='evaluate', messages=apply_prompt_template(
+            text = await allm(llm_type='evaluate', messages=apply_prompt_template(
                 prompt_name='learning/judge',
                 state={
                     'now': datetime.now().strftime("%a %b %d %Y"),
@@ -165,64 +282,115 @@ class DeepSearch:
 
         return judge_result
 
-    def _search_all(self, query:List[str]) -> Dict[str, List[search.SearchResult]]:
-        search_result: Dict[str, List[search.SearchResult]] = {}
+    async def _search_all(self, query:List[str]) -> Dict[str, List[search.SearchResult]]:
         for q in query:
             colored_print(f'Searching: {q}', color="purple")
-            search_result[q] = self._search_client.search(q, self._search_top_n)
-            for result in search_result[q]:
+        search_result = await self._search_executor.asearch_all(query, self._search_top_n)
+        for results in search_result.values():
+            for result in results:
                 colored_print(f'{result.title} -- ', color="cyan", end="")
                 colored_print(result.url, color="blue", underline=True)
         return search_result
 
-    def _extract_all_knowledge(self, outline:str, search_results:Dict[str,List[search.SearchResult]]) -> List[Knowledge]:
-        extract_limit = 32000
+    async def _extract_all_knowledge(self, outline:str, search_results:Dict[str,List[search.SearchResult]]) -> List[Knowledge]:
+        prompt_tokens = sum(count_tokens(message.content) for message in apply_prompt_template(
+            prompt_name='learning/extract_knowledge',
+            state={
+                'chapter_outline': outline,
+                'search': '',
+            }))
+        budget = max(1, self._extract_token_budget - prompt_tokens)
+        results = [result for search_result in search_results.values() for result in search_result if result.content]
+        documents: List[ExtractDocument] = []
+        for result in results:
+            documents.extend(self._split_document(result, result.content, budget))
+        if self._relevance_filter:
+            # Keep only the passages relevant to the chapter outline. They are ranked within each
+            # chunk, after the split, so that every chunk of a long page is still extracted
+            contents = await asyncio.to_thread(select_relevant, outline, [document.content for document in documents],
+                                               self._relevance_token_budget, self._relevance_passage_tokens)
+            for document, content in zip(documents, contents):
+                if content is not document.content:
+                    document.content = content
+                    document.tokens = count_tokens(self._format_document(0, document))
+
+        # Batches are extracted in one LLM batch, results are concatenated in batch order so that
+        # knowledge indices stay reproducible
+        batches = self._pack_documents(documents, budget)
+        outcomes = await allm_batch('evaluate', [self._extract_prompt(outline, batch) for batch in batches])
         knowledge_results: List[Knowledge] = []
-        for search_result in search_results.values():
-            content_len = 0
-            extract_search: List[search.SearchResult] = []
-            for result in search_result:
-                if not result.content:
-                    continue
-
-                if content_len + len(result.content) > extract_limit:
-                    knowledge_results.extend(self._extract_knowledge(outline, extract_search, extract_limit))
-                    extract_search = [result]
-                    content_len = len(result.content)
-                else:
-                    extract_search.append(result)
-                    content_len += len(result.content)
-            if extract_search:
-                knowledge_results.extend(self._extract_knowledge(outline, extract_search, extract_limit))
-            
+        for batch, outcome in zip(batches, outcomes):
+            if outcome.ok:
+                knowledge_results.extend(self._parse_knowledge(outcome.value, batch))
+            else:
+                logger.error(f'extract knowledge error:{outcome.error}')
         return knowledge_results
 
-    def _extract_knowledge(self, outline:str, search_results:List[search.SearchResult], extract_limit:int) -> List[Knowledge]:
+    def _split_document(self, result:search.SearchResult, content:str, budget:int) -> List[ExtractDocument]:
+        """Split a search result that exceeds the budget into overlapping chunks, extracted independently"""
+        document = ExtractDocument(result=result, content=content)
+        document.tokens = count_tokens(self._format_document(0, document))
+        if document.tokens <= budget:
+            return [document]
+
+        header_tokens = document.tokens - count_tokens(content)
+        chunk_tokens = max(1, min(self._extract_chunk_tokens, budget - header_tokens - self._extract_chunk_overlap))
+        chunks = split_tokens(content, chunk_tokens, self._extract_chunk_overlap)
+        if len(chunks) > self._extract_max_chunks:
+            logger.warning(f'{result.url} has {document.tokens} tokens, only the first {self._extract_max_chunks} '
+                           f'of {len(chunks)} chunks are extracted')
+            chunks = chunks[:self._extract_max_chunks]
+        documents: List[ExtractDocument] = []
+        for i, chunk in enumerate(chunks):
+            document = ExtractDocument(result=result, content=chunk, chunk=i, chunks=len(chunks))
+            document.tokens = count_tokens(self._format_document(0, document))
+            documents.append(document)
+        return documents
+
+    def _pack_documents(self, documents:List[ExtractDocument], budget:int) -> List[List[ExtractDocument]]:
+        """Pack the documents of a depth level into as few batches of at most budget tokens as possible"""
+        # First fit decreasing, documents of equal size keep the search order
+        order = sorted(range(len(documents)), key=lambda i: -documents[i].tokens)
+        batches: List[List[int]] = []
+        loads: List[int] = []
+        for i in order:
+            for b in range(len(batches)):
+                if loads[b] + documents[i].tokens <= budget:
+                    batches[b].append(i)
+                    loads[b] += documents[i].tokens
+                    break
+            else:
+                batches.append([i])
+                loads.append(documents[i].tokens)
+        return [[documents[i] for i in sorted(batch)] for batch in batches]
+
+    def _format_document(self, idx:int, document:ExtractDocument) -> str:
+        result = document.result
+        title = f'{result.title} (part {document.chunk + 1}/{document.chunks})' if document.chunks > 1 else result.title
+        return f'[document index {idx}]\ntitle: {title}\ncontent: {document.content}\ndate: {result.date if result.date else "unknown"}\n\n'
+
+    def _extract_prompt(self, outline:str, documents:List[ExtractDocument]) -> List:
+        return apply_prompt_template(
+            prompt_name='learning/extract_knowledge',
+            state={
+                'chapter_outline': outline,
+                'search': ''.join(self._format_document(i, document) for i, document in enumerate(documents)),
+            })
+
+    def _parse_knowledge(self, text:str, documents:List[ExtractDocument]) -> List[Knowledge]:
         knowledge_results: List[Knowledge] = []
-        if not search_results:
+        if not text:
             return knowledge_results
 
         try:
-            search = ''
-            for i, result in enumerate(search_results):
-                search += f'[document index {i}]\ntitle: {result.title}\ncontent: {result.content}\ndate: {result.date if result.date else "unknown"}\n\n'
-            text = llm(llm_type='evaluate', messages=apply_prompt_template(
-                prompt_name='learning/extract_knowledge',
-                state={
-                    'chapter_outline': outline,
-                    'search': search[:extract_limit],
-                })
-            )
-            if not text:
-                return knowledge_results
-
             extract_result = json_repair.loads(text)
             for knowledge in extract_result.get('knowledge', []):
                 reference:List[search.SearchResult] = []
                 snippets = knowledge.get('snippets', [])
                 for id in self._load_id_array(snippets):
-                    if 0 <= id < len(search_results):
-                        reference.append(search_results[id])
+                    # Chunks of one document reference the original search result only once
+                    if 0 <= id < len(documents) and all(documents[id].result is not r for r in reference):
+                        reference.append(documents[id].result)
                 if reference:
                     knowledge_results.append(Knowledge(
                         insight=knowledge.get('insight', ''),
@@ -236,7 +404,7 @@ class DeepSearch:
         
         return knowledge_results
 
-    def _gen_answer(self, outline:str, knowledge:List[Knowledge]) -> tuple[List[Knowledge], str]:
+    async def _gen_answer(self, outline:str, knowledge:List[Knowledge]) -> tuple[List[Knowledge], str]:
         if not knowledge:
             return [], '<no knowledge>'
 
@@ -244,7 +412,7 @@ class DeepSearch:
         for idx, doc in enumerate(knowledge):
             documents += f'[document id: {idx}]\ninsight: {doc.insight}\n\n'
         try:
-            text = llm(llm_type='evaluate', messages=apply_prompt_template(
+            text = await allm(llm_type='evaluate', messages=apply_prompt_template(
                 prompt_name='learning/draft',
                 state={
                     'chapter_outline': outline,
@@ -267,24 +435,38 @@ class DeepSearch:
 
         return used_knowledge, answer
 
-    def _evaluate(self, outline:str, answer:str, judge_result:List[Judge]) -> List[EvalResult]:
+    async def _evaluate(self, outline:str, answer:str, judge_result:List[Judge]) -> List[EvalResult]:
+        prompts = {i: self._evaluate_prompt(outline, answer, judge) for i, judge in enumerate(judge_result)}
+        prompts = {i: prompt for i, prompt in prompts.items() if prompt is not None}
+        outcomes = dict(zip(prompts, await allm_batch('evaluate', list(prompts.values()),
+                                                      max_concurrency=max(1, len(prompts)),
+                                                      timeout=self._judge_timeout)))
         eval_results:List[EvalResult] = []
-        for judge in judge_result:
-            eval_results.append(self._evaluate_one(outline, answer, judge))
+        for i, judge in enumerate(judge_result):
+            outcome = outcomes.get(i)
+            try:
+                if outcome is None:
+                    raise ValueError(f'Unknown judge name: {judge.name}')
+                if not outcome.ok:
+                    raise outcome.error
+                eval_results.append(self._parse_evaluation(judge, outcome.value))
+            except Exception as e:
+                # A judge that fails or times out counts as not passed
+                logger.error(f'evaluate {judge.name} error:{e}')
+                eval_results.append(EvalResult(eval_type=judge.name, pass_label=False, reason=''))
         return eval_results
 
-    def _evaluate_one(self, outline:str, answer:str, judge:Judge) -> EvalResult:
-        prompt:List = None
+    def _evaluate_prompt(self, outline:str, answer:str, judge:Judge) -> Optional[List]:
         match judge.name:
             case 'completeness':
-                prompt = apply_prompt_template(
+                return apply_prompt_template(
                     prompt_name='learning/evaluate_completeness',
                     state={
                         'chapter_outline': outline,
                         'draft': answer
                     })
             case 'freshness':
-                prompt = apply_prompt_template(
+                return apply_prompt_template(
                     prompt_name='learning/evaluate_freshness',
                     state={
                         'now': datetime.now().strftime("%a %b %d %Y"),
@@ -292,26 +474,28 @@ class DeepSearch:
                         'draft': answer
                     })
             case 'plurality':
-                prompt = apply_prompt_template(
+                return apply_prompt_template(
                     prompt_name='learning/evaluate_plurality',
                     state={
                         'chapter_outline': outline,
                         'draft': answer
                     })
             case _:
-                raise ValueError(f'Unknown judge name: {judge.name}')
+                return None
 
-        text = llm(llm_type='evaluate', messages=prompt)
+    def _parse_evaluation(self, judge:Judge, text:str) -> EvalResult:
         if not text:
             return EvalResult(eval_type=judge.name, pass_label=False, reason='')
         evaluate_result = json_repair.loads(text)
+        if not isinstance(evaluate_result, dict):
+            raise ValueError(f'Invalid evaluate result: {text}')
         think = evaluate_result.get('analysis', {}).get('think', '')
         passed = evaluate_result.get('analysis', {}).get('pass', False)
         return EvalResult(eval_type=judge.name, pass_label=passed, reason=think)
 
-    def _gen_research_query(self, query:List[str], outline:str, answer:str, unpass_eval:List[EvalResult]) -> List[str]:
+    async def _gen_research_query(self, query:List[str], outline:str, answer:str, unpass_eval:List[EvalResult]) -> List[str]:
         try:
-            text = llm(llm_type='query_generation', messages= apply_prompt_template(
+            text = await allm(llm_type='query_generation', messages= apply_prompt_template(
                 prompt_name='learning/research_query',
                 state={
                     'now': datetime.now().strftime("%a %b %d %Y"),
@@ -381,5 +565,5 @@ if __name__ == '__main__':
         max_depth=3,
         search_top_n=10,
     )
-    result = deep_searcher.deep_search()
+    result = asyncio.run(deep_searcher.deep_search())
     print(result.re_knowledge)
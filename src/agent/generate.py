@@ -1,70 +1,126 @@
 # Copyright (c) 2025 iFLYTEK CO.,LTD.
 # SPDX-License-Identifier: Apache 2.0 License
+import asyncio
+import contextlib
 import json
 import logging
 import os
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional, Tuple
 import re
+import uuid
 
 from langchain_core.runnables import RunnableConfig
 
 from .message import ReportState
-from src.llms.llm import llm
+from src.config.workflow_config import workflow_configs
+from src.llms.llm import allm
 from datetime import datetime
 import time
 
 from src.prompts import apply_prompt_template
+from src.utils.concurrency import amap_ordered
+from src.utils.digest import RollingContext
 from src.utils.parse_model_res import extract_xml_content
 from src.utils.print_util import colored_print
 from src.tools.md2html import markdown2html
 
 logger = logging.getLogger(__name__)
 
-def generate_node(state: ReportState):
+# A run of citation marks such as "[^1] [^2]", rewritten with the reference IDs of the report
+_citations_re = re.compile(r"(\[\^[^\[\]]+\] *)+")
+_number_re = re.compile(r"\d+")
+# Stands in the stream for a chart being generated, the nonce of the processor keeps the LLM from
+# writing a comment that is taken for one
+_CHART_PLACEHOLDER = "<!-- chart-placeholder-{nonce}-{index} -->"
+# One chart of the response to the generate/chart_batch prompt
+_chart_spec_re = re.compile(r"<chart\s+id=[\"']?(\d+)[\"']?\s*>(.*?)</chart>", re.DOTALL | re.IGNORECASE)
 
-    outline = state.get("outline")
-    final_report = ""
-    colored_print(f"{'#' * outline.level} {outline.title}\n", color="green", end="")
-    final_report += f"{'#' * outline.level} {outline.title}\n"
-    for level2_chapter in outline.sub_chapter:
-        def ref_replace(s: str) -> str:
-            """
-            Replace the reference IDs in the string with the corresponding actual reference IDs
-
-            :param s: Original string
-            :param chapter: Chapter object containing the LearningKnowledge attribute
-            :return: Replaced string
-            """
-            all_id = re.findall(r'\d+', s)
-            m: List[int] = []
-            for s2 in all_id:
-                try:
-                    id = int(s2)
-                    if 0 <= id < len(level2_chapter.learning_knowledge):
-                        ref_ids = level2_chapter.learning_knowledge[id]["real_reference"]
-                        m.extend(ref_ids)
-                except ValueError:
-                    continue
-            m.sort()
-            result = []
-            prev = None
-            for num in m:
-                if num != prev:
-                    result.append(f"[^%d]" % num)
-                    prev = num
-            return ''.join(result)
-
-        chapter_title = f"{'#' * level2_chapter.level} {level2_chapter.title}"
-        colored_print(f"{chapter_title}\n", color="green", end="")
 
-        prev_report = final_report + f'\n{chapter_title}\n'
-        chapter_report = ''
+class _ChapterPrinter:
+    """
+    Console output of chapters written at the same time: the first unfinished chapter in outline
+    order is printed live, the output of the later ones is buffered until they come first
+    """
+    def __init__(self, chapters: int):
+        self._buffers: List[List[Tuple[str, str]]] = [[] for _ in range(chapters)]
+        self._done = [False] * chapters
+        self._head = 0
+
+    def print(self, index: int, text: str, color: str):
+        if index == self._head:
+            colored_print(text, color=color, end="")
+        else:
+            self._buffers[index].append((text, color))
 
-        level2_chapter.merge_knowledge()
-        knowledge = level2_chapter.merge_knowledge().get_knowledge_str()
-        content_processor = ContentProcessor(knowledge)
-        for thinking, content in llm(llm_type="report", messages=apply_prompt_template(
+    def finish(self, index: int):
+        self._done[index] = True
+        while self._head < len(self._done) and self._done[self._head]:
+            self._head += 1
+            if self._head < len(self._buffers):
+                buffer, self._buffers[self._head] = self._buffers[self._head], []
+                for text, color in buffer:
+                    colored_print(text, color=color, end="")
+
+
+async def _generate_chapter(state: ReportState, index: int, above: str, printer: _ChapterPrinter) -> str:
+    """
+    Write one chapter of the outline
+
+    Args:
+        state: State of the report
+        index: Index of the chapter in the outline
+        above: What the chapter is told about the report written before it
+        printer: Console output of the chapter
+
+    Returns:
+        Text of the chapter, with the reference IDs of the report
+    """
+    outline = state.get("outline")
+    level2_chapter = outline.sub_chapter[index]
+    cluster_options = workflow_configs.get("cluster", {})
+    similarity_threshold = None
+    if cluster_options.get("enabled", True):
+        similarity_threshold = cluster_options.get("similarity_threshold", 0.8)
+
+    def ref_replace(s: str) -> str:
+        """
+        Replace the reference IDs in the string with the corresponding actual reference IDs
+
+        :param s: Original string
+        :param chapter: Chapter object containing the LearningKnowledge attribute
+        :return: Replaced string
+        """
+        all_id = _number_re.findall(s)
+        m: List[int] = []
+        for s2 in all_id:
+            try:
+                id = int(s2)
+                if 0 <= id < len(level2_chapter.learning_knowledge):
+                    ref_ids = level2_chapter.learning_knowledge[id]["real_reference"]
+                    m.extend(ref_ids)
+            except ValueError:
+                continue
+        m.sort()
+        result = []
+        prev = None
+        for num in m:
+            if num != prev:
+                result.append(f"[^%d]" % num)
+                prev = num
+        return ''.join(result)
+
+    chapter_title = f"{'#' * level2_chapter.level} {level2_chapter.title}"
+    printer.print(index, f"{chapter_title}\n", "green")
+    chapter_report = ''
+    try:
+        knowledge = level2_chapter.merge_knowledge(similarity_threshold, cluster_options.get("ngram", 2)).get_knowledge_str()
+        generate_options = workflow_configs.get("generate", {})
+        content_processor = ContentProcessor(knowledge,
+                                             generate_options.get("chart_timeout", 120),
+                                             generate_options.get("chart_batch", False))
+        # Closing the stream on an error gives its in-flight slot back right away
+        async with contextlib.aclosing(allm(llm_type="report", messages=apply_prompt_template(
                 prompt_name="generate/generate",
                 state={
                     "domain": state.get("domain"),
@@ -73,24 +129,73 @@ def generate_node(state: ReportState):
                     "chapter_outline": level2_chapter.get_outline(),
                     "outline": outline.get_outline(),
                     "reference": knowledge,
-                    "above": prev_report
+                    "above": above
                 }
-        ), stream=True):
-            if thinking:
-                colored_print(thinking, color="orange", end="")
-            if content:
-                output_strs = content_processor.process_content(content)
-                if output_strs:
-                    for output_str in output_strs:
-                        pattern = re.compile(r"(\[\^[^\[\]]+\] *)+")
-                        output_str = pattern.sub(lambda m: ref_replace(m.group(0)), output_str)
-                        chapter_report += output_str
-                        colored_print(output_str, color="green", end="")
-        colored_print('\n', color="green")
+        ), stream=True)) as stream:
+            async for thinking, content in stream:
+                if thinking:
+                    printer.print(index, thinking, "orange")
+                if content:
+                    output_strs = await content_processor.process_content(content)
+                    if output_strs:
+                        for output_str in output_strs:
+                            if "[^" in output_str:
+                                output_str = _citations_re.sub(lambda m: ref_replace(m.group(0)), output_str)
+                            chapter_report += output_str
+                            printer.print(index, output_str, "green")
+        chapter_report = await content_processor.finalize(chapter_report)
+        printer.print(index, '\n\n', "green")
+    finally:
+        printer.finish(index)
+    return chapter_report
+
+
+async def generate_node(state: ReportState):
+
+    outline = state.get("outline")
+    final_report = ""
+    generate_options = workflow_configs.get("generate", {})
+    parallel_chapters = max(1, generate_options.get("max_parallel_chapters", 1))
+    rolling_context = None
+    if parallel_chapters == 1 and generate_options.get("context", "rolling") == "rolling":
+        rolling_context = RollingContext(generate_options.get("context_token_budget", 4000),
+                                         generate_options.get("digest_tokens", 400))
+    report_title = f"{'#' * outline.level} {outline.title}\n"
+    colored_print(report_title, color="green", end="")
+    final_report += report_title
+    chapter_titles = [f"{'#' * chapter.level} {chapter.title}" for chapter in outline.sub_chapter]
+    printer = _ChapterPrinter(len(chapter_titles))
+
+    chapter_reports: List[str] = []
+    if parallel_chapters > 1:
+        # Chapters written at the same time only know the outline of the report, they are stitched
+        # back in outline order
+        outcomes = await amap_ordered(
+            lambda i: _generate_chapter(state, i, f'{report_title}\n{chapter_titles[i]}\n', printer),
+            range(len(chapter_titles)),
+            max_concurrency=parallel_chapters)
+        for outcome in outcomes:
+            if not outcome.ok:
+                raise outcome.error
+            chapter_reports.append(outcome.value)
+
+    for i, chapter_title in enumerate(chapter_titles):
+        prev_report = final_report + f'\n{chapter_title}\n'
+        if parallel_chapters > 1:
+            chapter_report = chapter_reports[i]
+        else:
+            # The rolling context stands in for the whole report written so far, the outline is always given
+            above = prev_report
+            if rolling_context is not None:
+                above = '\n'.join(filter(None, [report_title, rolling_context.render(), chapter_title])) + '\n'
+            chapter_report = await _generate_chapter(state, i, above, printer)
         if chapter_report.count(chapter_title):
             final_report = final_report + '\n' + chapter_report
         else:
             final_report = prev_report + chapter_report
+        if rolling_context is not None:
+            rolling_context.add(chapter_report if chapter_report.count(chapter_title)
+                                else f'{chapter_title}\n{chapter_report}')
 
     return {
                 "final_report": final_report,
@@ -151,74 +256,242 @@ class OutputStatus:
     MaybeReferenceInEnd = 3
 
 
+class _TextBuffer:
+    """
+    Text accumulated piece by piece without copying it, which keeps up to date what
+    check_reference_end looks at: the last square bracket and the last character before
+    trailing spaces
+    """
+    def __init__(self):
+        self._parts: List[str] = []
+        self._length = 0
+        self._last_bracket = ""
+        self._last_char = ""
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, text: str):
+        if not text:
+            return
+        self._parts.append(text)
+        self._length += len(text)
+        bracket_open, bracket_close = text.rfind('['), text.rfind(']')
+        if bracket_open >= 0 or bracket_close >= 0:
+            self._last_bracket = '[' if bracket_open > bracket_close else ']'
+        trimmed = text.rstrip(' ')
+        if trimmed:
+            self._last_char = trimmed[-1]
+
+    def getvalue(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = [''.join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def pop(self) -> str:
+        """Return the text and empty the buffer"""
+        text = self.getvalue()
+        self._parts, self._length, self._last_bracket, self._last_char = [], 0, "", ""
+        return text
+
+    def reference_end(self) -> bool:
+        """Same as check_reference_end(self.getvalue())"""
+        return self._last_bracket == '[' or self._last_char == ']'
+
+
 class ContentProcessor:
-    def __init__(self, knowledge: str):
+    """
+    Scan the streamed chapter for tool tags, emitting the text around them as it comes and the
+    output of a tool once its closing tag is complete. Each chunk is scanned with str.find and
+    buffered as a list of pieces, so the work done is linear in the length of the stream.
+    """
+    def __init__(self, knowledge: str, chart_timeout: Optional[float] = None, chart_batch: bool = False):
         self.tools = ["table", "chart"]
-        self.buffer = ""
         self.current_tool = ""
-        self.report = ""
         self.result = []
         self.status = OutputStatus.NormalContentStatus
         self.max_tool_name_len = 0
         self.knowledge = knowledge
         for tool in self.tools:
             self.max_tool_name_len = max(self.max_tool_name_len, len(tool))
-
-    def process_content(self, content: str):
-        self.report = self.report + content
-        for char in content:
-            self._process_char(char)
+        self._end_tags = {tool: re.compile(re.escape(f"</{tool}>"), re.IGNORECASE) for tool in self.tools}
+        self._buffer = _TextBuffer()
+        # Last characters of the tool output, a closing tag can be split over chunks
+        self._tool_tail = ""
+        self._report: List[str] = []
+        # Report from its last "###", and the last two characters of the report for a "###"
+        # split over chunks
+        self._section: List[str] = []
+        self._section_tail = ""
+        # Charts generated in the background, the stream carries a placeholder for each of them
+        # until finalize puts them in place. With chart_batch, the descriptions are collected
+        # instead and all charts are generated by one call once the chapter is written
+        self.chart_timeout = chart_timeout
+        self.chart_batch = chart_batch
+        self._charts: List[asyncio.Task] = []
+        self._chart_descriptions: List[str] = []
+        self._chart_nonce = uuid.uuid4().hex[:12]
+        self._chart_placeholder_re = re.compile(rf"<!-- chart-placeholder-{self._chart_nonce}-(\d+) -->")
+
+    @property
+    def buffer(self) -> str:
+        return self._buffer.getvalue()
+
+    @property
+    def report(self) -> str:
+        if len(self._report) > 1:
+            self._report = [''.join(self._report)]
+        return self._report[0] if self._report else ""
+
+    async def process_content(self, content: str):
+        self._append_report(content)
+        self._scan(content)
         if self.status == OutputStatus.NormalContentStatus \
                 or self.status == OutputStatus.MaybeReferenceInEnd:
-            if check_reference_end(self.buffer):
+            if self._buffer.reference_end():
                 self.status = OutputStatus.MaybeReferenceInEnd
             else:
                 self.status = OutputStatus.NormalContentStatus
-        if self.status == OutputStatus.NormalContentStatus and self.buffer:
-            self.result.append(self.buffer)
-            self.buffer = ""
+        if self.status == OutputStatus.NormalContentStatus and self._buffer:
+            self.result.append(self._buffer.pop())
         if self.result:
             result, self.result = self.result, []
-            return result
+            return [item for item in result if item] or None
         return None
 
+    async def finalize(self, text: str) -> str:
+        """
+        Wait for the charts of the chapter and put them in place of their placeholders
+
+        Args:
+            text: Chapter built from the outputs of process_content
+
+        Returns:
+            The chapter with its charts, the charts that failed or timed out are dropped
+        """
+        if self._chart_descriptions:
+            specs = await self._generate_chart_batch(text)
+        elif self._charts:
+            outcomes = await asyncio.gather(*self._charts, return_exceptions=True)
+            self._charts = []
+            specs: List[Optional[str]] = []
+            for index, outcome in enumerate(outcomes):
+                if isinstance(outcome, asyncio.TimeoutError):
+                    logger.warning(f"chart {index} dropped, not generated within {self.chart_timeout}s")
+                elif isinstance(outcome, BaseException):
+                    logger.error(f"chart generation error:{outcome}")
+                specs.append(None if isinstance(outcome, BaseException) else outcome)
+        else:
+            return text
+        charts = [self._render_chart(spec, index) if spec else "" for index, spec in enumerate(specs)]
+        # A placeholder without a chart of this call, in text the processor did not emit, is left as it is
+        return self._chart_placeholder_re.sub(
+            lambda m: charts[int(m.group(1))] if int(m.group(1)) < len(charts) else m.group(0), text)
+
+    async def _generate_chart_batch(self, text: str) -> List[Optional[str]]:
+        """
+        Generate all charts of the chapter in one call, sharing the chapter and its knowledge
+
+        Args:
+            text: Chapter with the placeholders of its charts
+
+        Returns:
+            The response part of every chart, None for the charts the call did not give
+        """
+        descriptions, self._chart_descriptions = self._chart_descriptions, []
+        messages = apply_prompt_template(
+            prompt_name="generate/chart_batch",
+            state={
+                "charts": "\n".join(f'<chart id="{index}"><description>{description}</description></chart>'
+                                    for index, description in enumerate(descriptions)),
+                "chapter": self._chart_placeholder_re.sub(lambda m: f'<chart id="{m.group(1)}"/>', text),
+                "reference": self.knowledge
+            }
+        )
+        try:
+            response = await asyncio.wait_for(
+                allm(llm_type="report", messages=messages, stream=False, raise_errors=True), self.chart_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{len(descriptions)} charts dropped, not generated within {self.chart_timeout}s")
+            return [None] * len(descriptions)
+        except Exception as e:
+            logger.error(f"chart generation error:{e}")
+            return [None] * len(descriptions)
+        specs = {int(m.group(1)): m.group(2) for m in _chart_spec_re.finditer(response)}
+        missing = [index for index in range(len(descriptions)) if index not in specs]
+        if missing:
+            logger.warning(f"charts {missing} missing from the chart batch response, dropped")
+        return [specs.get(index) for index in range(len(descriptions))]
+
     def clear_buf(self):
-        if self.buffer:
-            final, self.buffer = self.buffer, ""
-            return [final]
+        if self._buffer:
+            return [self._buffer.pop()]
         return None
 
-    def _process_char(self, char: str):
-        if self.status == OutputStatus.NormalContentStatus \
-                or self.status == OutputStatus.MaybeReferenceInEnd:
-            if char == "<":
-                self.status = OutputStatus.ToolsStartMatch
-                if self.buffer:
-                    self.result.append(self.buffer)
-                self.buffer = char
-            else:
-                self.buffer += char
-        elif self.status == OutputStatus.ToolsStartMatch:
-            self.buffer += char
-            if len(self.buffer) > self.max_tool_name_len + 2:
+    def _append_report(self, content: str):
+        self._report.append(content)
+        window = self._section_tail + content
+        index = window.rfind("###")
+        if index >= 0:
+            self._section = [window[index:]]
+        else:
+            self._section.append(content)
+        self._section_tail = window[-2:]
+
+    def _above(self) -> str:
+        """The report from its last "###" heading, the whole report when it has none"""
+        if len(self._section) > 1:
+            self._section = [''.join(self._section)]
+        return self._section[0] if self._section else ""
+
+    def _scan(self, content: str):
+        i, n = 0, len(content)
+        while i < n:
+            if self.status == OutputStatus.ToolsOutput:
+                window = self._tool_tail + content[i:]
+                match = self._end_tags[self.current_tool].search(window)
+                if match is None:
+                    self._buffer.append(content[i:])
+                    self._tool_tail = window[-(len(self.current_tool) + 2):]
+                    break
+                end = i + match.end() - len(self._tool_tail)
+                self._buffer.append(content[i:end])
+                self.result.append(self._process_tool(self._buffer.pop(), self.current_tool))
                 self.status = OutputStatus.NormalContentStatus
-            elif char == ">":
-                for tool in self.tools:
-                    if f"<{tool}>" == self.buffer.lower():
-                        self.current_tool = tool
-                        self.status = OutputStatus.ToolsOutput
-                        break
-                if self.status != OutputStatus.ToolsOutput:
+                i = end
+            elif self.status == OutputStatus.ToolsStartMatch:
+                # A tag is abandoned once the buffer gets longer than the longest tool tag
+                room = self.max_tool_name_len + 3 - len(self._buffer)
+                close = content.find(">", i, i + room - 1)
+                if close >= 0:
+                    self._buffer.append(content[i:close + 1])
+                    i = close + 1
+                    tag = self._buffer.getvalue().lower()
                     self.status = OutputStatus.NormalContentStatus
-        elif self.status == OutputStatus.ToolsOutput:
-            self.buffer += char
-            if char == ">":
-                if self.buffer.lower().endswith(f"</{self.current_tool}>"):
-                    tool_result = self._process_tool(self.buffer, self.current_tool)
-                    if tool_result:
-                        self.result.append(tool_result)
-                    self.buffer = ""
+                    for tool in self.tools:
+                        if f"<{tool}>" == tag:
+                            self.current_tool = tool
+                            self.status = OutputStatus.ToolsOutput
+                            self._tool_tail = ""
+                            break
+                elif n - i >= room:
+                    self._buffer.append(content[i:i + room])
+                    i += room
                     self.status = OutputStatus.NormalContentStatus
+                else:
+                    self._buffer.append(content[i:])
+                    break
+            else:
+                start = content.find("<", i)
+                if start < 0:
+                    self._buffer.append(content[i:])
+                    break
+                self._buffer.append(content[i:start])
+                if self._buffer:
+                    self.result.append(self._buffer.pop())
+                self._buffer.append("<")
+                self.status = OutputStatus.ToolsStartMatch
+                i = start + 1
 
     def _process_tool(self, tool_content: str, tool: str) -> str:
         if tool == "table":
@@ -233,27 +506,32 @@ class ContentProcessor:
                 description = description[0]
             else:
                 description = ""
-            index = self.report.rfind("###")
-            if index > 0:
-                above = self.report[index:]
-            else:
-                above = self.report
-            chart = llm(llm_type="report", messages=apply_prompt_template(
+            if self.chart_batch:
+                self._chart_descriptions.append(description)
+                return _CHART_PLACEHOLDER.format(nonce=self._chart_nonce, index=len(self._chart_descriptions) - 1)
+            above = self._above()
+            messages = apply_prompt_template(
                 prompt_name="generate/chart",
                 state={
                     "above": above,
                     "description": description,
                     "reference": self.knowledge
                 }
-            ), stream=False)
-
-            input_schema = extract_xml_content(chart, "input_schema")
-            if not input_schema:
-                input_schema = extract_xml_content(chart, "echarts")
-            if input_schema:
-                input_schema = input_schema[0]
-                chart_id = str(int(time.time() * 1000))
-                return f"""``` custom_html
+            )
+            # The chart is generated while the chapter keeps streaming
+            self._charts.append(asyncio.create_task(asyncio.wait_for(
+                allm(llm_type="report", messages=messages, stream=False, raise_errors=True), self.chart_timeout)))
+            return _CHART_PLACEHOLDER.format(nonce=self._chart_nonce, index=len(self._charts) - 1)
+
+    def _render_chart(self, chart: str, index: int = 0) -> str:
+        input_schema = extract_xml_content(chart, "input_schema")
+        if not input_schema:
+            input_schema = extract_xml_content(chart, "echarts")
+        if input_schema:
+            input_schema = input_schema[0]
+            # Charts of a chapter are rendered in the same millisecond, the index keeps their ids apart
+            chart_id = str(int(time.time() * 1000) + index)
+            return f"""``` custom_html
                 <div id="{chart_id}" class="chart-container" style="width:800px; height:600px; "></div>
     <script>
     var chartDom = document.getElementById('{chart_id}');
@@ -267,8 +545,8 @@ class ContentProcessor:
     myChart.setOption(option);
     </script>
 ```"""
-            else:
-                return ""
+        else:
+            return ""
 
 
 
@@ -290,7 +568,7 @@ def check_reference_end(sb: str) -> bool:
     return False
 
 
-if __name__ == '__main__':
+async def _main():
     cp = ContentProcessor("")
     contents = ["This is a test case [^",
                 "1].",
@@ -305,7 +583,7 @@ if __name__ == '__main__':
                 "</Tool>is not"
                 " an effective tool"]
     for content in contents:
-        results = cp.process_content(content)
+        results = await cp.process_content(content)
         print("=" * 30)
         if results:
             for result in results:
@@ -316,3 +594,7 @@ if __name__ == '__main__':
         for result in results:
             print(result)
     print("=" * 30)
+
+
+if __name__ == '__main__':
+    asyncio.run(_main())
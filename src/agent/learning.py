@@ -1,34 +1,99 @@
 # Copyright (c) 2025 iFLYTEK CO.,LTD.
 # SPDX-License-Identifier: Apache 2.0 License
-from typing import List
+from dataclasses import dataclass
+from typing import List, TypedDict
 
 from langchain_core.runnables import RunnableConfig
+from langgraph.types import Send
 
-from .message import ReportState
-from .deepsearch import DeepSearch, DeepSearchResult
+from .message import ReportState, Chapter
+from .deepsearch import DeepSearch, DeepSearchResult, get_fingerprint
 from src.config.workflow_config import workflow_configs
 from src.tools.search import SearchResult
+from src.utils.concurrency import HybridSemaphore
+from src.utils.fingerprint import NearDuplicateIndex
 
+# Global budget of chapters researched at the same time, shared by all running reports
+_chapter_semaphore = HybridSemaphore(
+    workflow_configs.get("learning", {}).get("max_parallel_chapters", 4))
 
-def learning_node(state: ReportState, config: RunnableConfig):
+
+class ChapterTask(TypedDict):
+    """Input of one parallel learning branch"""
+    index: int
+    title: str
+    chapter: Chapter
+
+
+@dataclass(kw_only=True)
+class ChapterResearch:
+    """Result of one parallel learning branch"""
+    index: int
+    result: DeepSearchResult
+
+
+def dispatch_learning(outline: Chapter) -> List[Send]:
+    """Fan the chapters of the outline out to parallel learning branches"""
+    return [
+        Send("learning", ChapterTask(index=i, title=outline.title, chapter=chapter))
+        for i, chapter in enumerate(outline.sub_chapter)
+    ]
+
+
+async def learning_node(task: ChapterTask, config: RunnableConfig):
+    """Research a single chapter, the results are merged by learning_merge_node"""
+    chapter = task["chapter"]
+    ds = DeepSearch(task["title"],
+                    chapter.title,
+                    [sub_chapter.title for sub_chapter in chapter.sub_chapter],
+                    chapter.summary,
+                    config.get("configurable", {}).get("depth", 3),
+                    workflow_configs.get("search", {}).get("topN", 5))
+    async with _chapter_semaphore:
+        results = await ds.deep_search()
+    return {
+        "chapter_research": [ChapterResearch(index=task["index"], result=results)],
+    }
+
+
+def learning_merge_node(state: ReportState):
+    """
+    Merge the results of all learning branches in outline order, so that reference IDs
+    do not depend on which chapter finished first. A page found by several chapters, under
+    the same URL or as a near-duplicate, gets a single reference ID.
+    """
     outline = state.get("outline")
-    knowledge = state.get("knowledge", [])
+    # Entries are copied since alternate URLs may be added to them
+    knowledge = [dict(entry) for entry in state.get("knowledge", [])]
     search_id = state.get("search_id", 1)
-    for chapter in outline.sub_chapter:
-        ds = DeepSearch(outline.title,
-                        chapter.title,
-                        [title for title in chapter.sub_chapter],
-                        chapter.summary,
-                        config.get("configurable", {}).get("depth", 3),
-                        workflow_configs.get("search", {}).get("topN", 5))
-        results = ds.deep_search()
+    dedup_options = workflow_configs.get("dedup", {})
+    dedup = dedup_options.get("enabled", True)
+    min_chars = dedup_options.get("min_chars", 200)
+    duplicate_index: NearDuplicateIndex[dict] = NearDuplicateIndex(dedup_options.get("max_distance", 3))
+    url_to_entry = {entry["url"]: entry for entry in knowledge}
+
+    research = sorted(state.get("chapter_research", []), key=lambda r: r.index)
+    for chapter_research in research:
+        chapter = outline.sub_chapter[chapter_research.index]
+        results = chapter_research.result
         search_results = get_all_search_results(results)
         for key, value in search_results.items():
-            knowledge += [
-                {"id": search_id + i, "content": result.content, "url": result.url}
-                for i, result in enumerate(value)
-            ]
-            search_id += len(value)
+            for result in value:
+                entry = url_to_entry.get(result.url)
+                use_fingerprint = dedup and len(result.content) >= min_chars
+                if entry is None and use_fingerprint:
+                    entry = duplicate_index.find(get_fingerprint(result))
+                if entry is None:
+                    entry = {"id": search_id, "content": result.content, "url": result.url}
+                    search_id += 1
+                    knowledge.append(entry)
+                    if use_fingerprint:
+                        duplicate_index.add(get_fingerprint(result), entry)
+                elif entry["url"] != result.url:
+                    entry.setdefault("alternate_urls", []).append(result.url)
+                url_to_entry.setdefault(result.url, entry)
+                for url in result.alternate_urls:
+                    url_to_entry.setdefault(url, entry)
 
         chapter.learning_knowledge = [
             {"insight": re_knowledge.insight,
@@ -52,6 +117,9 @@ def get_all_search_results(result: DeepSearchResult) -> List[SearchResult]:
 
 def get_real_reference_ids(search_results: List, references: List[SearchResult]) -> List[int]:
     url_to_id = {search["url"]: search["id"] for search in search_results}
+    for search in search_results:
+        for url in search.get("alternate_urls", []):
+            url_to_id.setdefault(url, search["id"])
 
     reference_ids = []
     seen = set()
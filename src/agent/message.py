@@ -1,10 +1,13 @@
 # Copyright (c) 2025 iFLYTEK CO.,LTD.
 # SPDX-License-Identifier: Apache 2.0 License
 import json
+import operator
 from dataclasses import dataclass, field
 
 from langgraph.graph import MessagesState
-from typing import List, Optional, Any, Dict
+from typing import Annotated, List, Optional, Any, Dict
+
+from src.utils.similarity import cluster_similar
 
 
 class Reference:
@@ -66,16 +69,30 @@ class Chapter:
 
         return "\n\n".join(markdown_parts)
 
-    def merge_knowledge(self):
+    def merge_knowledge(self, similarity_threshold: Optional[float] = None, ngram: int = 2):
         """
-        Convert chapters and their sub chapters to Markdown text
+        Merge the learning knowledge of the chapter: near-identical insights are collapsed into
+        one carrying the references of all of them, then insights with the same references are joined
+
+        Args:
+            similarity_threshold: Minimum n-gram cosine similarity of collapsed insights, None disables it
+            ngram: Number of characters of the compared n-grams
 
         Returns:
-            Generated Markdown string
+            The chapter itself
         """
+        knowledge_list = self.learning_knowledge
+        if similarity_threshold is not None and len(knowledge_list) > 1:
+            clusters = cluster_similar([k["insight"] for k in knowledge_list], similarity_threshold, ngram)
+            knowledge_list = [
+                {"insight": max((knowledge_list[i]["insight"] for i in cluster), key=len),
+                 "real_reference": sorted({ref for i in cluster for ref in knowledge_list[i]["real_reference"]})}
+                for cluster in clusters
+            ]
+
         groups = {}
 
-        for knowledge in self.learning_knowledge:
+        for knowledge in knowledge_list:
             ref_tuple = tuple(sorted(knowledge["real_reference"]))
 
             if ref_tuple in groups:
@@ -111,6 +128,8 @@ class ReportState(MessagesState):
     details: str
     output: dict
     knowledge: list
+    # Results of the parallel learning branches, merged by learning_merge
+    chapter_research: Annotated[list, operator.add]
     # Final report
     final_report: str
     # Do you want to save the final report as a html
@@ -1,14 +1,16 @@
 # Copyright (c) 2025 iFLYTEK CO.,LTD.
 # SPDX-License-Identifier: Apache 2.0 License
+import contextlib
 import json
 from typing import List
 
 from .message import ReportState, Chapter
-from src.llms.llm import llm
+from .learning import dispatch_learning
+from src.llms.llm import allm
 from src.prompts.template import apply_prompt_template
 from src.utils.print_util import colored_print
 from langgraph.types import Command
-from src.tools.search import SearchClient
+from src.tools.search import SearchExecutor
 from src.config.workflow_config import workflow_configs
 import logging
 from datetime import datetime
@@ -18,9 +20,9 @@ from src.utils.parse_model_res import extract_xml_content
 logger = logging.getLogger(__name__)
 
 
-def outline_search_node(state: ReportState):
+async def outline_search_node(state: ReportState):
     """Search some knowledge for outline."""
-    sq = llm(llm_type="query_generation", messages=apply_prompt_template(
+    sq = await allm(llm_type="query_generation", messages=apply_prompt_template(
         prompt_name="outline/outline_sq",
         state={
             "now": datetime.now().strftime("%a %b %d %Y"),
@@ -28,36 +30,34 @@ def outline_search_node(state: ReportState):
             "reasoning": state.get("logic")
         }
     ), stream=False)
-    search_queries = extract_xml_content(sq, "search")
-    search_client = SearchClient()
+    search_queries = extract_xml_content(sq, "search") or []
+    search_executor = SearchExecutor()
     search_id = state.get("search_id", 1)
-    outline_knowledge = state.get("knowledge", [])
+    outline_knowledge = list(state.get("knowledge", []))
     for search_query in search_queries:
-        try:
-            colored_print(f'Searching: {search_query}', color="purple")
-            results = search_client.search(search_query,
-                                                 workflow_configs.
-                                                 get("search", {}).
-                                                 get("topN", 5))
-            outline_knowledge += [
-                {"id": search_id + i, "content": result.content, "url": result.url}
-                for i, result in enumerate(results)
-            ]
-            search_id += len(results)
-            for result in results:
-                colored_print(f'{result.title} -- ', color="cyan", end="")
-                colored_print(result.url, color="blue", underline=True)
-        except Exception as e:
-            logger.error(f"search {search_query} error: {e}")
+        colored_print(f'Searching: {search_query}', color="purple")
+    search_results = await search_executor.asearch_all(search_queries,
+                                                       workflow_configs.
+                                                       get("search", {}).
+                                                       get("topN", 5))
+    for results in search_results.values():
+        outline_knowledge += [
+            {"id": search_id + i, "content": result.content, "url": result.url}
+            for i, result in enumerate(results)
+        ]
+        search_id += len(results)
+        for result in results:
+            colored_print(f'{result.title} -- ', color="cyan", end="")
+            colored_print(result.url, color="blue", underline=True)
     return {
         "search_id": search_id,
         "knowledge": outline_knowledge,
     }
 
-def outline_node(state: ReportState):
+async def outline_node(state: ReportState):
     """Generate outline for this report"""
     outline = ""
-    for think, content in llm(llm_type="planner", messages=apply_prompt_template(
+    async with contextlib.aclosing(allm(llm_type="planner", messages=apply_prompt_template(
             prompt_name="outline/outline",
             state={
                 "domain": state.get("domain"),
@@ -67,11 +67,12 @@ def outline_node(state: ReportState):
                 "thinking": state.get("details"),
                 "reference": outline_knowledge_2_str(state.get("outline_knowledge", ""))
             }
-    ), stream=True):
-        if think:
-            colored_print(think, color="orange", end="")
-        if content:
-            outline += content
+    ), stream=True)) as stream:
+        async for think, content in stream:
+            if think:
+                colored_print(think, color="orange", end="")
+            if content:
+                outline += content
     try:
         chapter = parse_outline(outline)
     except ValueError as e:
@@ -82,7 +83,7 @@ def outline_node(state: ReportState):
                               "message": outline
                           }})
     colored_print("\n\n" + chapter.get_outline(), color="green", end="")
-    return Command(goto="learning", update={
+    return Command(goto=dispatch_learning(chapter) or "learning_merge", update={
         "outline": chapter
     })
 
@@ -3,20 +3,21 @@
 from langchain_core.runnables import RunnableConfig
 
 from .message import ReportState
-from src.llms.llm import llm
+from src.llms.llm import allm
 from src.prompts.template import apply_prompt_template
 from src.utils import parse_model_res
 from src.utils.print_util import colored_print
 from langgraph.types import Command
 from langchain_core.messages import AIMessage, HumanMessage
 from src.data.category import get_analysis_data
+import contextlib
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 
-def preprocess_node(state: ReportState):
+async def preprocess_node(state: ReportState):
     """preprocess data"""
     messages = state.get("messages")
     converted_messages = []
@@ -71,9 +72,9 @@ def preprocess_node(state: ReportState):
         return Command(update={"messages": converted_messages}, goto="generic")
 
 
-def rewrite_node(state: ReportState):
+async def rewrite_node(state: ReportState):
     """Rewrite user requirements based on interaction history to obtain report topics"""
-    rewrite = llm(llm_type="basic", messages=apply_prompt_template(
+    rewrite = await allm(llm_type="basic", messages=apply_prompt_template(
         prompt_name="prep/rewrite",
         state={
             "now": datetime.now().strftime("%a %b %d %Y"),
@@ -98,9 +99,9 @@ def rewrite_node(state: ReportState):
         )
 
 
-def classify_node(state: ReportState):
+async def classify_node(state: ReportState):
     """Classify user questions to write reports on different topics"""
-    classify = llm(llm_type="basic", messages=apply_prompt_template(
+    classify = await allm(llm_type="basic", messages=apply_prompt_template(
         prompt_name="prep/classify",
         state={
             "query": state.get("topic")
@@ -143,9 +144,9 @@ def classify_node(state: ReportState):
         )
 
 
-def clarify_node(state: ReportState):
+async def clarify_node(state: ReportState):
     """Clarify user issues, only clarify once"""
-    clarify = llm(llm_type="clarify", messages=apply_prompt_template(
+    clarify = await allm(llm_type="clarify", messages=apply_prompt_template(
         prompt_name="prep/clarify",
         state={
             "query": state.get("topic"),
@@ -172,15 +173,16 @@ def clarify_node(state: ReportState):
     )
 
 
-def generic_node(state: ReportState):
+async def generic_node(state: ReportState):
     try:
         response = ""
-        for think, content in llm(llm_type="basic", messages=state.get("messages"), stream=True):
-            if think:
-                colored_print(think, color="orange", end="")
-            if content:
-                colored_print(content, color="green", end="")
-                response += content
+        async with contextlib.aclosing(allm(llm_type="basic", messages=state.get("messages"), stream=True)) as stream:
+            async for think, content in stream:
+                if think:
+                    colored_print(think, color="orange", end="")
+                if content:
+                    colored_print(content, color="green", end="")
+                    response += content
         return {"output": {"message": response}}
     except Exception as e:
         logger.error(f"An exception occurred during the call to the LLM: {e}")
\ No newline at end of file
@@ -1,6 +1,8 @@
 # Copyright (c) 2025 iFLYTEK CO.,LTD.
 # SPDX-License-Identifier: Apache 2.0 License
 
+import asyncio
+import time
 import pytest
 from datetime import datetime
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
@@ -75,7 +77,7 @@ def mock_outline_state():
 def test_generic_node_response(
     mock_state
 ):
-    result = generic_node(mock_state)
+    result = asyncio.run(generic_node(mock_state))
     assert isinstance(result, dict)
     assert isinstance(result["output"], dict)
     assert isinstance(result["output"]["stream_message"], Generator)
@@ -84,7 +86,7 @@ def test_generic_node_response(
 def test_classify_node_response(
     mock_classify_state
 ):
-    result = classify_node(mock_classify_state)
+    result = asyncio.run(classify_node(mock_classify_state))
     assert isinstance(result, Command)
     assert result.goto == "clarify"
     assert isinstance(result.update, dict)
@@ -96,7 +98,7 @@ def test_classify_node_response(
 def test_clarify_node_response(
     mock_clarify_state
 ):
-    result = clarify_node(mock_clarify_state)
+    result = asyncio.run(clarify_node(mock_clarify_state))
     assert isinstance(result, Command)
     assert result.goto == "__end__"
     assert isinstance(result.update, dict)
@@ -107,7 +109,7 @@ def test_clarify_node_response(
 def test_rewrite_node_response(
     mock_rewrite_state
 ):
-    result = rewrite_node(mock_rewrite_state)
+    result = asyncio.run(rewrite_node(mock_rewrite_state))
     assert isinstance(result, Command)
     assert isinstance(result.update, dict)
     assert isinstance(result.update["topic"], str)
@@ -117,7 +119,7 @@ def test_outline_search_node_response(
 ):
     results = []
     required_keys = {"id", "content", "url", "title"}
-    for updated_state in outline_search_node(mock_outline_search_state):
+    for updated_state in asyncio.run(outline_search_node(mock_outline_search_state)):
         results.append(updated_state)
         assert isinstance(updated_state, dict)
         assert isinstance(updated_state["knowledge"], list)
@@ -167,7 +169,7 @@ def test_outline_node_response(mock_outline_state):
         mock_llm.return_value = llm_generator()
         mock_prompt.return_value = [SystemMessage(content="mock system message")]
 
-        outputs = list(outline_node(mock_outline_state))
+        outputs = list(asyncio.run(outline_node(mock_outline_state)))
 
         mock_llm.assert_called_once_with(
             llm_type="planner",
@@ -203,3 +205,200 @@ def test_outline_node_response(mock_outline_state):
         final_output = outputs[2]
         assert "outline" in final_output
         assert final_output["outline"] == mock_chapter
+
+
+def test_learning_merge_node_is_order_independent():
+    from .deepsearch import DeepSearchResult, Knowledge
+    from .learning import ChapterResearch, learning_merge_node
+    from .message import Chapter
+
+    def research(index):
+        results = [SearchResult(url=f"https://c{index}/{i}", title="", summary="", content="") for i in range(2)]
+        return ChapterResearch(index=index, result=DeepSearchResult(
+            query=[], all_knowledge=[], used_knowledge=[], answer="", eval_result=[], children=None,
+            re_knowledge=[Knowledge(insight=f"c{index}", snippets=[], references=results[1:])],
+            search_result={f"q{index}": results}))
+
+    def merge(order):
+        outline = Chapter(id=0, level=1, title="report",
+                          sub_chapter=[Chapter(id=i + 1, level=2, title=f"c{i}") for i in range(3)])
+        state = {"outline": outline, "knowledge": [], "search_id": 1,
+                 "chapter_research": [research(i) for i in order]}
+        return learning_merge_node(state)
+
+    first, second = merge([2, 0, 1]), merge([0, 1, 2])
+    assert first["knowledge"] == second["knowledge"]
+    assert [k["url"] for k in first["knowledge"]][:2] == ["https://c0/0", "https://c0/1"]
+    assert first["search_id"] == 7
+    assert [c.learning_knowledge for c in first["outline"].sub_chapter] == \
+           [[{"insight": f"c{i}", "real_reference": [2 * i + 2]}] for i in range(3)]
+
+
+def test_learning_merge_node_shares_ids_of_duplicate_pages():
+    from .deepsearch import DeepSearchResult, Knowledge
+    from .learning import ChapterResearch, learning_merge_node
+    from .message import Chapter
+
+    article = " ".join(f"sentence {i} about renewable energy storage and grid prices." for i in range(100))
+    chapter_results = [
+        [SearchResult(url="https://a/1", title="", summary="", content=article),
+         SearchResult(url="https://shared", title="", summary="", content="short")],
+        [SearchResult(url="https://mirror/1", title="", summary="", content=article + " Share this article"),
+         SearchResult(url="https://shared", title="", summary="", content="short")],
+    ]
+    research = [
+        ChapterResearch(index=i, result=DeepSearchResult(
+            query=[], all_knowledge=[], used_knowledge=[], answer="", eval_result=[], children=None,
+            re_knowledge=[Knowledge(insight=f"c{i}", snippets=[], references=results)],
+            search_result={f"q{i}": results}))
+        for i, results in enumerate(chapter_results)
+    ]
+    outline = Chapter(id=0, level=1, title="report",
+                      sub_chapter=[Chapter(id=i + 1, level=2, title=f"c{i}") for i in range(2)])
+    merged = learning_merge_node({"outline": outline, "knowledge": [], "search_id": 1,
+                                  "chapter_research": research})
+    assert [k["url"] for k in merged["knowledge"]] == ["https://a/1", "https://shared"]
+    assert merged["knowledge"][0]["alternate_urls"] == ["https://mirror/1"]
+    assert merged["search_id"] == 3
+    assert [c.learning_knowledge[0]["real_reference"] for c in merged["outline"].sub_chapter] == [[1, 2], [1, 2]]
+
+
+
+def test_merge_knowledge_collapses_similar_insights():
+    from .message import Chapter
+    chapter = Chapter(id=1, level=2, title="c", learning_knowledge=[
+        {"insight": "Global EV sales grew 35% in 2024.", "real_reference": [3]},
+        {"insight": "Battery prices fell in 2023.", "real_reference": [1]},
+        {"insight": "Global EV sales grew by 35% in 2024.", "real_reference": [1, 2]},
+    ])
+    chapter.merge_knowledge(similarity_threshold=0.8)
+    assert chapter.learning_knowledge == [
+        {"insight": "Global EV sales grew by 35% in 2024.", "real_reference": [1, 2, 3]},
+        {"insight": "Battery prices fell in 2023.", "real_reference": [1]},
+    ]
+
+
+def test_generate_node_writes_chapters_in_parallel_and_stitches_them_in_order():
+    from .generate import generate_node
+    from .message import Chapter
+
+    outline = Chapter(id=0, level=1, title="report",
+                      sub_chapter=[Chapter(id=i + 1, level=2, title=f"c{i}") for i in range(3)])
+    prompts, printed = {}, []
+
+    async def fake_allm(llm_type, messages, stream=False):
+        title = messages["chapter_outline"].split()[-1]
+        prompts[title] = messages["above"]
+        yield "", f"{title} starts. "
+        # Later chapters finish first
+        await asyncio.sleep(0.1 * (3 - int(title[1:])))
+        yield "", f"{title} ends."
+
+    start = time.monotonic()
+    with patch.dict("src.agent.generate.workflow_configs", {"generate": {"max_parallel_chapters": 3}}), \
+            patch("src.agent.generate.allm", fake_allm), \
+            patch("src.agent.generate.apply_prompt_template", side_effect=lambda prompt_name, state: state), \
+            patch("src.agent.generate.colored_print",
+                  side_effect=lambda text, **kwargs: printed.append((text, time.monotonic() - start))):
+        result = asyncio.run(generate_node({"outline": outline, "topic": "t", "domain": "d"}))
+    assert time.monotonic() - start < 0.5
+    assert prompts["c1"] == "# report\n\n## c1\n"
+    assert result["final_report"] == "# report\n" + "".join(f"\n## c{i}\nc{i} starts. c{i} ends." for i in range(3))
+    text = "".join(piece for piece, _ in printed)
+    assert text.index("c0 ends") < text.index("c1 starts") < text.index("c2 starts")
+    # The first chapter streams live, the others are printed once it is done
+    assert next(at for piece, at in printed if piece == "c0 starts. ") < 0.1
+
+
+def test_charts_are_generated_in_the_background_and_dropped_after_timeout():
+    from .generate import ContentProcessor
+
+    async def fake_allm(llm_type, messages, **kwargs):
+        await asyncio.sleep(0.2 if messages["description"] == "slow" else 0.05)
+        return f"<echarts>{{'title': '{messages['description']}'}}</echarts>"
+
+    async def write(processor):
+        start, outputs = time.monotonic(), []
+        for chunk in ["Intro <chart><description>fast</description></chart> then ",
+                      "<chart><description>slow</description></chart> end."]:
+            outputs.extend(await processor.process_content(chunk) or [])
+        streamed = time.monotonic() - start
+        return streamed, await processor.finalize("".join(outputs))
+
+    with patch("src.agent.generate.allm", fake_allm), \
+            patch("src.agent.generate.apply_prompt_template", side_effect=lambda prompt_name, state: state):
+        streamed, chapter = asyncio.run(write(ContentProcessor("", chart_timeout=0.1)))
+    assert streamed < 0.05
+    assert chapter.startswith("Intro ``` custom_html") and "'title': 'fast'" in chapter
+    assert chapter.endswith(" then  end.") and "slow" not in chapter
+
+
+def test_chart_batch_generates_the_charts_of_a_chapter_in_one_call():
+    from .generate import ContentProcessor
+    calls = []
+
+    async def fake_allm(llm_type, messages, **kwargs):
+        calls.append(messages)
+        return "".join(f'<chart id="{i}"><echarts><input_schema>{{"id": {i}}}</input_schema></echarts></chart>'
+                       for i in (0, 2))
+
+    async def write(processor):
+        outputs = []
+        for chunk in ["### A\n<chart><description>first</description></chart> text ",
+                      "<chart><description>second</description></chart> more ",
+                      "<chart><description>third</description></chart>"]:
+            outputs.extend(await processor.process_content(chunk) or [])
+        return await processor.finalize("".join(outputs))
+
+    with patch("src.agent.generate.allm", fake_allm), \
+            patch("src.agent.generate.apply_prompt_template", side_effect=lambda prompt_name, state: state):
+        chapter = asyncio.run(write(ContentProcessor("knowledge", chart_batch=True)))
+    call, = calls
+    assert call["reference"] == "knowledge"
+    assert call["chapter"] == '### A\n<chart id="0"/> text <chart id="1"/> more <chart id="2"/>'
+    assert call["charts"].splitlines()[1] == '<chart id="1"><description>second</description></chart>'
+    # The second chart is missing from the response and dropped
+    assert chapter.count("custom_html") == 2 and " text  more " in chapter
+    assert 'option = {"id": 0};' in chapter and 'option = {"id": 2};' in chapter
+
+
+def test_finalize_leaves_comments_shaped_like_chart_placeholders():
+    from .generate import ContentProcessor
+
+    async def fake_allm(llm_type, messages, **kwargs):
+        return "<echarts>{'title': 'chart'}</echarts>"
+
+    async def write(processor):
+        outputs = []
+        for chunk in ["<!-- chart-placeholder-7 --> then ", "<chart><description>one</description></chart> end."]:
+            outputs.extend(await processor.process_content(chunk) or [])
+        placeholder = outputs[-2]
+        # A placeholder index the processor did not give out
+        stray = placeholder.replace("-0 -->", "-3 -->")
+        return await processor.finalize("".join(outputs) + stray)
+
+    with patch("src.agent.generate.allm", fake_allm), \
+            patch("src.agent.generate.apply_prompt_template", side_effect=lambda prompt_name, state: state):
+        chapter = asyncio.run(write(ContentProcessor("")))
+    assert chapter.startswith("<!-- chart-placeholder-7 --> then ``` custom_html")
+    assert chapter.count("custom_html") == 1 and chapter.endswith("-3 -->")
+
+
+def test_stream_is_closed_when_its_consumer_fails(mock_state):
+    closed = []
+
+    async def fake_stream():
+        try:
+            yield "", "partial"
+            yield "", "never read"
+        finally:
+            closed.append(True)
+
+    async def run():
+        await generic_node(mock_state)
+        # Without closing, the stream is only finalized by the event loop after the node returns
+        return list(closed)
+
+    with patch("src.agent.prep.allm", lambda **kwargs: fake_stream()), \
+            patch("src.agent.prep.colored_print", side_effect=RuntimeError("console closed")):
+        assert asyncio.run(run()) == [True]
@@ -0,0 +1,150 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import asyncio
+import json
+import random
+import re
+import time
+from unittest.mock import patch
+
+import pytest
+
+from .deepsearch import DeepSearch, DeepSearchResult, Judge
+from src.tools.search import SearchResult
+from src.utils.token_util import count_tokens
+
+
+@pytest.fixture
+def deep_search():
+    with patch("src.tools.search.SearchClient"):
+        yield DeepSearch(title="report", chapter="chapter", sub_chapter=[], chapter_outline="outline")
+
+
+def make_results(query: str, n: int, words: int):
+    return [SearchResult(url=f"https://{query}/{i}", title=f"{query}-{i}", summary="", content="word " * words)
+            for i in range(n)]
+
+
+async def fake_extract_llm(llm_type, messages, stream=False, **kwargs):
+    prompt = messages[-1].content
+    titles = [line[len("title: "):] for line in prompt.splitlines() if line.startswith("title: ")]
+    await asyncio.sleep(random.random() * 0.05)
+    return json.dumps({"knowledge": [{"insight": title, "snippets": [str(i)]} for i, title in enumerate(titles)]})
+
+
+def test_extract_all_knowledge_packs_documents_by_tokens(deep_search):
+    deep_search._extract_token_budget = 5000
+    search_results = {q: make_results(q, 3, 1000) for q in ["a", "b", "c"]}
+    with patch("src.llms.llm.allm", side_effect=fake_extract_llm) as mock_llm:
+        knowledge = asyncio.run(deep_search._extract_all_knowledge("outline", search_results))
+    assert mock_llm.call_count == 3
+    for call in mock_llm.call_args_list:
+        assert sum(count_tokens(m.content) for m in call.kwargs["messages"]) <= 5000
+    assert [k.insight for k in knowledge] == [f"{q}-{i}" for q in ["a", "b", "c"] for i in range(3)]
+    assert all(k.references[0].title == k.insight for k in knowledge)
+
+
+def test_extract_all_knowledge_splits_oversized_documents(deep_search):
+    deep_search._extract_token_budget = 5000
+    deep_search._extract_chunk_tokens = 3000
+    deep_search._extract_max_chunks = 3
+    deep_search._relevance_filter = False
+    long_result = SearchResult(url="https://long", title="long", summary="",
+                               content=" ".join(f"w{i}" for i in range(20000)))
+    search_results = {"a": [long_result] + make_results("b", 1, 100)}
+    with patch("src.llms.llm.allm", side_effect=fake_extract_llm) as mock_llm:
+        knowledge = asyncio.run(deep_search._extract_all_knowledge("outline", search_results))
+    prompts = [call.kwargs["messages"][-1].content for call in mock_llm.call_args_list]
+    assert all(sum(count_tokens(m.content) for m in call.kwargs["messages"]) <= 5000
+               for call in mock_llm.call_args_list)
+    assert sum(prompt.count("title: long (part ") for prompt in prompts) == 3
+    assert any("w2990 w2991" in prompt and "w3000 " in prompt for prompt in prompts)
+    assert sorted(k.insight for k in knowledge) == ["b-0"] + [f"long (part {i}/3)" for i in range(1, 4)]
+    assert all(k.references == [long_result] for k in knowledge if k.insight.startswith("long"))
+
+
+def test_evaluate_runs_judges_concurrently_and_tolerates_failures(deep_search):
+    deep_search._judge_timeout = 0.5
+
+    async def fake_judge_llm(llm_type, messages, stream=False, **kwargs):
+        await asyncio.sleep(0.2)
+        if messages == "learning/evaluate_plurality":
+            return ""
+        if messages == "learning/evaluate_freshness":
+            await asyncio.sleep(2)
+        return json.dumps({"analysis": {"think": "ok", "pass": True}})
+
+    judges = [Judge(name="completeness"), Judge(name="freshness"), Judge(name="plurality")]
+    start = time.monotonic()
+    with patch("src.llms.llm.allm", side_effect=fake_judge_llm), \
+            patch("src.agent.deepsearch.apply_prompt_template", side_effect=lambda prompt_name, state: prompt_name):
+        results = asyncio.run(deep_search._evaluate("outline", "draft", judges))
+    assert time.monotonic() - start < 1.5
+    assert [r.eval_type for r in results] == ["completeness", "freshness", "plurality"]
+    assert [r.pass_label for r in results] == [True, False, False]
+
+
+def test_deep_search_overlaps_query_generation_and_judges(deep_search):
+    def slow(value):
+        async def _call(outline):
+            await asyncio.sleep(0.3)
+            return value
+        return _call
+
+    async def fake_deep_search(query, depth, judge_results, outline, pre_answer, pre_knowledge):
+        assert query == ["q1"]
+        assert await judge_results == [Judge(name="completeness")]
+        return DeepSearchResult(query=query, all_knowledge=[], used_knowledge=[], re_knowledge=[], answer="",
+                                search_result={}, eval_result=[], children=None)
+
+    with patch.object(deep_search, "_gen_search_query", side_effect=slow(["q1"])), \
+            patch.object(deep_search, "_judge_query", side_effect=slow([Judge(name="completeness")])), \
+            patch.object(deep_search, "_deep_search", side_effect=fake_deep_search):
+        start = time.monotonic()
+        asyncio.run(deep_search.deep_search())
+    assert time.monotonic() - start < 0.5
+
+
+def test_drop_near_duplicates_across_depth_levels(deep_search):
+    article = " ".join(f"sentence {i} about renewable energy storage and grid prices." for i in range(100))
+    original = SearchResult(url="https://a/1", title="", summary="", content=article)
+    mirror = SearchResult(url="https://b/1", title="", summary="", content=article + " Share this article")
+    other = SearchResult(url="https://c/1", title="", summary="", content=article[::-1])
+    short = SearchResult(url="https://d/1", title="", summary="", content="")
+    short_copy = SearchResult(url="https://e/1", title="", summary="", content="")
+
+    first = deep_search._drop_near_duplicates([("q1", original), ("q1", other)])
+    second = deep_search._drop_near_duplicates([("q2", mirror), ("q2", short), ("q2", short_copy)])
+    assert [r.url for _, r in first] == ["https://a/1", "https://c/1"]
+    assert [r.url for _, r in second] == ["https://d/1", "https://e/1"]
+    assert original.alternate_urls == ["https://b/1"]
+
+
+
+def test_merge_similar_knowledge_unions_references(deep_search):
+    from .deepsearch import Knowledge
+    pages = make_results("q", 3, 10)
+    knowledge = [
+        Knowledge(insight="Global EV sales grew 35% in 2024.", snippets=["a"], references=[pages[0]]),
+        Knowledge(insight="Battery prices fell in 2023.", snippets=["b"], references=[pages[1]]),
+        Knowledge(insight="Global EV sales grew by 35% in 2024.", snippets=["a", "c"],
+                  references=[pages[2], pages[0]]),
+    ]
+    merged = deep_search._merge_similar_knowledge(knowledge)
+    assert [k.insight for k in merged] == ["Global EV sales grew by 35% in 2024.", "Battery prices fell in 2023."]
+    assert merged[0].snippets == ["a", "c"]
+    assert merged[0].references == [pages[0], pages[2]]
+
+
+def test_relevance_filter_keeps_every_chunk_of_long_documents(deep_search):
+    # Default chunking and relevance settings
+    long_result = SearchResult(url="https://long", title="long", summary="",
+                               content="\n".join(f"line {i} about the outline topic " * 20 for i in range(2000)))
+    with patch("src.llms.llm.allm", side_effect=fake_extract_llm) as mock_llm:
+        asyncio.run(deep_search._extract_all_knowledge("outline topic", {"a": [long_result]}))
+    prompts = [call.kwargs["messages"][-1].content for call in mock_llm.call_args_list]
+    assert sum(prompt.count("title: long (part ") for prompt in prompts) == deep_search._extract_max_chunks > 1
+    # The tail of the page beyond the first relevance budget is extracted too
+    assert max(int(n) for n in re.findall(r"line (\d+) ", "".join(prompts))) > 100
+    assert all(sum(count_tokens(m.content) for m in call.kwargs["messages"]) <= deep_search._extract_token_budget
+               for call in mock_llm.call_args_list)
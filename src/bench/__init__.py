@@ -0,0 +1,2 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
@@ -0,0 +1,181 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+"""
+Microbenchmark of the ContentProcessor scanner on long synthetic report streams, against the
+character by character scanner it replaced
+
+    python -m src.bench.content --chars 200000 --chunk-size 8 --repeat 3
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from typing import List, Optional, Tuple, Type
+
+from src.agent.generate import ContentProcessor, OutputStatus, check_reference_end
+
+_PIECES = [
+    "The market grew **30%** in 2024 [^12]. ",
+    "Prices fell [^3][^4] while demand held. ",
+    "Several sources agree [^1] [^2] on this. ",
+    "\n\n### Supply side\n",
+    "\n#### Detail\n",
+    "<table><title>Sales</title><markdown>| year | sales |\n|---|---|\n| 2024 | 30 |</markdown></table>",
+    "<TABLE><markdown>| a |\n|---|\n| 1 |</markdown></Table>",
+    "<b>bold</b> text. ",
+    "a < b and c > d. ",
+    "see [the note ",
+    "here] and [^7",
+    "] continues. ",
+    "<tablex> is not a tool. ",
+    "<<table> neither. ",
+    "<chartsx>",
+]
+_CHART = "<chart><description>Sales by year</description></chart>"
+
+
+class CharContentProcessor(ContentProcessor):
+    """
+    The character by character scanner ContentProcessor used before, kept as the reference the
+    chunk-level scanner is checked and timed against
+    """
+    def __init__(self, knowledge: str):
+        super().__init__(knowledge)
+        self._text = ""
+        self._pending = ""
+
+    async def process_content(self, content: str):
+        self._text = self._text + content
+        for char in content:
+            self._process_char(char)
+        if self.status == OutputStatus.NormalContentStatus \
+                or self.status == OutputStatus.MaybeReferenceInEnd:
+            if check_reference_end(self._pending):
+                self.status = OutputStatus.MaybeReferenceInEnd
+            else:
+                self.status = OutputStatus.NormalContentStatus
+        if self.status == OutputStatus.NormalContentStatus and self._pending:
+            self.result.append(self._pending)
+            self._pending = ""
+        if self.result:
+            result, self.result = self.result, []
+            return [item for item in result if item] or None
+        return None
+
+    def clear_buf(self):
+        if self._pending:
+            final, self._pending = self._pending, ""
+            return [final]
+        return None
+
+    def _above(self) -> str:
+        index = self._text.rfind("###")
+        return self._text[index:] if index > 0 else self._text
+
+    def _process_char(self, char: str):
+        if self.status == OutputStatus.NormalContentStatus \
+                or self.status == OutputStatus.MaybeReferenceInEnd:
+            if char == "<":
+                self.status = OutputStatus.ToolsStartMatch
+                if self._pending:
+                    self.result.append(self._pending)
+                self._pending = char
+            else:
+                self._pending += char
+        elif self.status == OutputStatus.ToolsStartMatch:
+            self._pending += char
+            if len(self._pending) > self.max_tool_name_len + 2:
+                self.status = OutputStatus.NormalContentStatus
+            elif char == ">":
+                for tool in self.tools:
+                    if f"<{tool}>" == self._pending.lower():
+                        self.current_tool = tool
+                        self.status = OutputStatus.ToolsOutput
+                        break
+                if self.status != OutputStatus.ToolsOutput:
+                    self.status = OutputStatus.NormalContentStatus
+        elif self.status == OutputStatus.ToolsOutput:
+            self._pending += char
+            if char == ">":
+                if self._pending.lower().endswith(f"</{self.current_tool}>"):
+                    self.result.append(self._process_tool(self._pending, self.current_tool))
+                    self._pending = ""
+                    self.status = OutputStatus.NormalContentStatus
+
+
+def synthetic_stream(chars: int, chunk_size: int, seed: int = 0, charts: bool = False) -> List[str]:
+    """
+    A report of about chars characters mixing text, citations, headings, tables, brackets and
+    angle brackets that are not tools, cut into chunks of 1 to chunk_size characters
+
+    Args:
+        chars: Length of the report
+        chunk_size: Largest chunk, streamed LLM chunks are a few characters long
+        seed: Seed of the random pieces and cuts
+        charts: Also put chart tags in the report, their generation calls the LLM
+
+    Returns:
+        Chunks of the report in stream order
+    """
+    rng = random.Random(seed)
+    pieces = _PIECES + [_CHART] if charts else _PIECES
+    parts, length = [], 0
+    while length < chars:
+        piece = rng.choice(pieces)
+        parts.append(piece)
+        length += len(piece)
+    text = "".join(parts)
+    chunks, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, chunk_size)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+async def process_stream(processor_class: Type[ContentProcessor], chunks: List[str]) -> Tuple[List[str], str, float]:
+    """
+    Returns:
+        Everything the processor emitted, the final buffer included, the chapter with its charts
+        in place, and the time it took
+    """
+    processor = processor_class("")
+    outputs: List[str] = []
+    start = time.perf_counter()
+    for chunk in chunks:
+        outputs.extend(await processor.process_content(chunk) or [])
+    outputs.extend(processor.clear_buf() or [])
+    chapter = await processor.finalize("".join(outputs))
+    return outputs, chapter, time.perf_counter() - start
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time the ContentProcessor scanner on a synthetic stream")
+    parser.add_argument("--chars", type=int, default=200000, help="length of the synthetic report")
+    parser.add_argument("--chunk-size", type=int, default=8, help="largest streamed chunk, in characters")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, medians are reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    chunks = synthetic_stream(args.chars, args.chunk_size, args.seed)
+    timings = {}
+    for processor_class in (CharContentProcessor, ContentProcessor):
+        runs = [await process_stream(processor_class, chunks) for _ in range(max(1, args.repeat))]
+        timings[processor_class.__name__] = statistics.median(seconds for _, _, seconds in runs)
+        outputs = runs[0][0]
+        if processor_class is CharContentProcessor:
+            expected = outputs
+        elif outputs != expected:
+            print("error: the chunk-level scanner emits a different output", file=sys.stderr)
+            return 1
+    print(f"{len(chunks)} chunks, {args.chars} characters")
+    for name, seconds in timings.items():
+        print(f"{name:<24}{seconds * 1000:>10.1f} ms")
+    print(f"speedup {timings['CharContentProcessor'] / timings['ContentProcessor']:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
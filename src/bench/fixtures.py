@@ -0,0 +1,406 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import asyncio
+import contextlib
+import dataclasses
+import gzip
+import json
+import logging
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from src.config.search_config import search_config
+from src.llms import llm as llm_module
+from src.tools import search as search_module
+from src.tools._search import SearchClient, SearchResult
+from src.utils.token_util import count_tokens
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+
+
+@dataclass(kw_only=True)
+class LLMCall:
+    """A recorded LLM call"""
+    key: str
+    llm_type: str
+    stream: bool
+    # (reasoning_content, content) chunks, a single chunk for non-streaming calls
+    chunks: List[Tuple[str, str]]
+    # Seconds from the start of the call to every chunk
+    offsets: List[float]
+
+
+@dataclass(kw_only=True)
+class SearchCall:
+    """A recorded search call"""
+    key: str
+    query: str
+    top_n: int
+    results: List[Dict[str, Any]]
+    latency: float
+
+
+@dataclass(kw_only=True)
+class FixtureBundle:
+    """Every LLM and search call of a run, with the input and the clock of the run"""
+    now: str = ""
+    input: Dict[str, Any] = field(default_factory=dict)
+    llm_calls: List[LLMCall] = field(default_factory=list)
+    search_calls: List[SearchCall] = field(default_factory=list)
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Write the bundle as JSON, gzip-compressed when the path ends with .gz"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({"version": BUNDLE_VERSION, **dataclasses.asdict(self)}, ensure_ascii=False)
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "wt", encoding="utf-8") as f:
+            f.write(data)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "FixtureBundle":
+        path = Path(path)
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != BUNDLE_VERSION:
+            raise ValueError(f"Unsupported fixture bundle version: {data.get('version')}")
+        return cls(
+            now=data.get("now", ""),
+            input=data.get("input", {}),
+            llm_calls=[LLMCall(key=c["key"], llm_type=c["llm_type"], stream=c["stream"],
+                               chunks=[tuple(chunk) for chunk in c["chunks"]], offsets=c["offsets"])
+                       for c in data.get("llm_calls", [])],
+            search_calls=[SearchCall(**c) for c in data.get("search_calls", [])],
+        )
+
+
+def _result_to_dict(result: SearchResult) -> Dict[str, Any]:
+    return {name: getattr(result, name) for name in search_module._CACHED_FIELDS}
+
+
+class _RecordingChatModel:
+    """Proxy of a chat model recording the responses of its calls"""
+    def __init__(self, model: Any, llm_type: str, streaming: bool, bundle: FixtureBundle, lock: threading.Lock):
+        self._model = model
+        self._llm_type = llm_type
+        self._streaming = streaming
+        self._bundle = bundle
+        self._lock = lock
+
+    def _record(self, messages, chunks, offsets) -> None:
+        call = LLMCall(key=llm_module.request_key(self._llm_type, messages, self._streaming),
+                       llm_type=self._llm_type, stream=self._streaming, chunks=chunks, offsets=offsets)
+        with self._lock:
+            self._bundle.llm_calls.append(call)
+
+    @staticmethod
+    def _parts(message) -> Tuple[str, str]:
+        return message.additional_kwargs.get("reasoning_content", ""), message.content
+
+    def stream(self, messages):
+        start = time.monotonic()
+        chunks, offsets = [], []
+        for chunk in self._model.stream(messages):
+            chunks.append(self._parts(chunk))
+            offsets.append(time.monotonic() - start)
+            yield chunk
+        self._record(messages, chunks, offsets)
+
+    async def astream(self, messages):
+        start = time.monotonic()
+        chunks, offsets = [], []
+        async for chunk in self._model.astream(messages):
+            chunks.append(self._parts(chunk))
+            offsets.append(time.monotonic() - start)
+            yield chunk
+        self._record(messages, chunks, offsets)
+
+    def invoke(self, messages):
+        start = time.monotonic()
+        response = self._model.invoke(messages)
+        self._record(messages, [self._parts(response)], [time.monotonic() - start])
+        return response
+
+    async def ainvoke(self, messages):
+        start = time.monotonic()
+        response = await self._model.ainvoke(messages)
+        self._record(messages, [self._parts(response)], [time.monotonic() - start])
+        return response
+
+
+class _RecordingSearchClient(SearchClient):
+    """Search client recording the results of the wrapped engine client"""
+    def __init__(self, client: SearchClient, bundle: FixtureBundle, lock: threading.Lock):
+        self._client = client
+        self._bundle = bundle
+        self._lock = lock
+
+    def search(self, query: str, top_n: int) -> List[SearchResult]:
+        start = time.monotonic()
+        results = self._client.search(query, top_n)
+        call = SearchCall(key=search_module.SearchClient.cache_key(query, top_n), query=query, top_n=top_n,
+                          results=[_result_to_dict(r) for r in results], latency=time.monotonic() - start)
+        with self._lock:
+            self._bundle.search_calls.append(call)
+        return results
+
+
+@dataclass(kw_only=True)
+class LatencyModel:
+    """
+    How long replayed calls take
+
+    mode "none" replays instantly, "recorded" waits as long as the recorded call (divided by speed)
+    and "synthetic" waits first_token seconds then chunk_interval seconds per chunk, or per token
+    of a non-streaming response, and search seconds per search.
+    """
+    mode: str = "none"
+    speed: float = 1.0
+    first_token: float = 1.0
+    chunk_interval: float = 0.02
+    search: float = 1.5
+
+    def __post_init__(self):
+        if self.mode not in ("none", "recorded", "synthetic"):
+            raise ValueError(f"Unknown latency mode: {self.mode}")
+
+    def llm_offsets(self, call: LLMCall) -> List[float]:
+        if self.mode == "none":
+            return [0.0] * len(call.chunks)
+        if self.mode == "recorded":
+            return [offset / self.speed for offset in call.offsets]
+        if not call.stream:
+            tokens = sum(count_tokens(reasoning) + count_tokens(content) for reasoning, content in call.chunks)
+            return [self.first_token + self.chunk_interval * tokens]
+        return [self.first_token + self.chunk_interval * i for i in range(len(call.chunks))]
+
+    def search_delay(self, call: SearchCall) -> float:
+        if self.mode == "none":
+            return 0.0
+        if self.mode == "recorded":
+            return call.latency / self.speed
+        return self.search
+
+
+@dataclass(kw_only=True)
+class ReplayStats:
+    """Calls served by a replay, misses are calls that were not recorded"""
+    llm_hits: int = 0
+    llm_misses: int = 0
+    search_hits: int = 0
+    search_misses: int = 0
+
+
+class Replayer:
+    """Serve recorded calls back by content key, identical calls are served in recorded order"""
+    def __init__(self, bundle: FixtureBundle, latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel()
+        self.stats = ReplayStats()
+        self._lock = threading.Lock()
+        self._llm_calls: Dict[str, List[LLMCall]] = {}
+        for call in bundle.llm_calls:
+            self._llm_calls.setdefault(call.key, []).append(call)
+        self._search_calls: Dict[str, List[SearchCall]] = {}
+        for call in bundle.search_calls:
+            self._search_calls.setdefault(call.key, []).append(call)
+        self._llm_served: Dict[str, int] = {}
+        self._search_served: Dict[str, int] = {}
+
+    @staticmethod
+    def _next(calls: Dict[str, list], served: Dict[str, int], key: str):
+        recorded = calls.get(key)
+        if not recorded:
+            return None
+        index = served.get(key, 0)
+        served[key] = index + 1
+        # Once all recorded copies are served the last one is repeated
+        return recorded[min(index, len(recorded) - 1)]
+
+    def llm_call(self, llm_type: str, messages, stream: bool) -> LLMCall:
+        key = llm_module.request_key(llm_type, messages, stream)
+        with self._lock:
+            call = self._next(self._llm_calls, self._llm_served, key)
+            if call is None:
+                self.stats.llm_misses += 1
+            else:
+                self.stats.llm_hits += 1
+        if call is None:
+            logger.warning(f"No recorded {llm_type} call matches the request, the orchestration changed its prompts")
+            raise LookupError(f"LLM call {key} was not recorded")
+        return call
+
+    def search_call(self, query: str, top_n: int) -> Optional[SearchCall]:
+        key = search_module.SearchClient.cache_key(query, top_n)
+        with self._lock:
+            call = self._next(self._search_calls, self._search_served, key)
+            if call is None:
+                self.stats.search_misses += 1
+            else:
+                self.stats.search_hits += 1
+        if call is None:
+            logger.warning(f"No recorded search matches '{query}'")
+        return call
+
+
+class _ReplayChatModel:
+    """Chat model answering with the recorded responses"""
+    def __init__(self, replayer: Replayer, llm_type: str, streaming: bool):
+        self._replayer = replayer
+        self._llm_type = llm_type
+        self._streaming = streaming
+
+    @staticmethod
+    def _chunk(message_type, reasoning: str, content: str):
+        return message_type(content=content, additional_kwargs={"reasoning_content": reasoning} if reasoning else {})
+
+    def stream(self, messages):
+        call = self._replayer.llm_call(self._llm_type, messages, self._streaming)
+        start = time.monotonic()
+        for (reasoning, content), offset in zip(call.chunks, self._replayer.latency.llm_offsets(call)):
+            time.sleep(max(0.0, start + offset - time.monotonic()))
+            yield self._chunk(AIMessageChunk, reasoning, content)
+
+    async def astream(self, messages):
+        call = self._replayer.llm_call(self._llm_type, messages, self._streaming)
+        start = time.monotonic()
+        for (reasoning, content), offset in zip(call.chunks, self._replayer.latency.llm_offsets(call)):
+            await asyncio.sleep(max(0.0, start + offset - time.monotonic()))
+            yield self._chunk(AIMessageChunk, reasoning, content)
+
+    def invoke(self, messages):
+        call = self._replayer.llm_call(self._llm_type, messages, self._streaming)
+        time.sleep(self._replayer.latency.llm_offsets(call)[-1])
+        return self._chunk(AIMessage, *call.chunks[0])
+
+    async def ainvoke(self, messages):
+        call = self._replayer.llm_call(self._llm_type, messages, self._streaming)
+        await asyncio.sleep(self._replayer.latency.llm_offsets(call)[-1])
+        return self._chunk(AIMessage, *call.chunks[0])
+
+
+class _ReplaySearchClient(SearchClient):
+    """Search client answering with the recorded results"""
+    def __init__(self, replayer: Replayer):
+        self._replayer = replayer
+
+    def search(self, query: str, top_n: int) -> List[SearchResult]:
+        call = self._replayer.search_call(query, top_n)
+        if call is None:
+            return []
+        time.sleep(self._replayer.latency.search_delay(call))
+        return [SearchResult(**result) for result in call.results]
+
+
+class _FrozenDatetime(datetime):
+    """datetime whose now() is the clock of the recorded run, so that dated prompts match"""
+    frozen: datetime
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.frozen if tz is None else cls.frozen.astimezone(tz)
+
+
+class _FrozenTime:
+    """
+    Stand-in of the time module whose time() starts at the clock of the recorded run and advances
+    by one millisecond per call, so that ids derived from it (e.g. chart ids) are reproducible
+    """
+    def __init__(self, start: float):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        with self._lock:
+            self._now += 0.001
+            return self._now
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(time, name)
+
+
+@contextlib.contextmanager
+def _patch_clock(now: str) -> Iterator[None]:
+    if not now:
+        yield
+        return
+    start = datetime.fromisoformat(now)
+    frozen = type("FrozenDatetime", (_FrozenDatetime,), {"frozen": start})
+    frozen_time = _FrozenTime(start.timestamp())
+    with contextlib.ExitStack() as stack:
+        for name, module in list(sys.modules.items()):
+            # The metrics measure the run itself, they keep the real clock
+            if not name.startswith("src.") or name.startswith("src.bench.") or name == "src.utils.metrics":
+                continue
+            if getattr(module, "datetime", None) is datetime:
+                stack.enter_context(patch.object(module, "datetime", frozen))
+            if getattr(module, "time", None) is time:
+                stack.enter_context(patch.object(module, "time", frozen_time))
+        yield
+
+
+@contextlib.contextmanager
+def _isolate_caches() -> Iterator[None]:
+    """Disable the search and LLM response caches, recorded and replayed calls must reach the clients"""
+    with patch.object(search_config, "cache", dataclasses.replace(search_config.cache, enabled=False)), \
+            patch.object(llm_module, "_get_response_cache", lambda: None):
+        yield
+
+
+@contextlib.contextmanager
+def record(input: Optional[Dict[str, Any]] = None) -> Iterator[FixtureBundle]:
+    """
+    Record every LLM and search call made inside the context
+
+    Args:
+        input: Input of the run, stored in the bundle so that the replay runs the same request
+
+    Yields:
+        The bundle the calls are appended to, to be saved once the run is finished
+    """
+    bundle = FixtureBundle(now=datetime.now().isoformat(), input=input or {})
+    lock = threading.Lock()
+    get_llm_instance = llm_module._get_llm_instance
+    tavily, jina = search_module.TavilySearchClient, search_module.JinaSearchClient
+
+    def _recording_llm(llm_type, streaming=False, *args, **kwargs):
+        return _RecordingChatModel(get_llm_instance(llm_type, streaming, *args, **kwargs),
+                                   llm_type, streaming, bundle, lock)
+
+    with _isolate_caches(), _patch_clock(bundle.now), \
+            patch.object(llm_module, "_get_llm_instance", _recording_llm), \
+            patch.object(search_module, "TavilySearchClient", lambda: _RecordingSearchClient(tavily(), bundle, lock)), \
+            patch.object(search_module, "JinaSearchClient", lambda: _RecordingSearchClient(jina(), bundle, lock)):
+        yield bundle
+
+
+@contextlib.contextmanager
+def replay(bundle: FixtureBundle, latency: Optional[LatencyModel] = None) -> Iterator[Replayer]:
+    """
+    Serve the LLM and search calls made inside the context from a recorded bundle, no request
+    leaves the process
+
+    Args:
+        bundle: Recorded calls
+        latency: How long replayed calls take, instantaneous by default
+
+    Yields:
+        The replayer, whose stats count the served and missing calls
+    """
+    replayer = Replayer(bundle, latency)
+    with _isolate_caches(), _patch_clock(bundle.now), \
+            patch.object(llm_module, "_get_llm_instance",
+                         lambda llm_type, streaming=False, *args, **kwargs: _ReplayChatModel(replayer, llm_type, streaming)), \
+            patch.object(search_module, "TavilySearchClient", lambda: _ReplaySearchClient(replayer)), \
+            patch.object(search_module, "JinaSearchClient", lambda: _ReplaySearchClient(replayer)):
+        yield replayer
@@ -0,0 +1,110 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import functools
+import inspect
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+
+@dataclass(kw_only=True)
+class NodeStats:
+    """Resources used by all runs of a graph node"""
+    calls: int = 0
+    wall: float = 0.0
+    max_wall: float = 0.0
+    cpu: float = 0.0
+    # Largest growth of traced memory above its level at the start of a run, in bytes
+    peak_memory: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "wall": self.wall, "max_wall": self.max_wall, "cpu": self.cpu,
+                "peak_memory": self.peak_memory}
+
+
+@dataclass(kw_only=True)
+class _Span:
+    name: str
+    wall_start: float
+    cpu_start: float
+    memory_start: int
+    memory_peak: int = 0
+
+
+@dataclass(kw_only=True)
+class NodeProfiler:
+    """
+    Measure wall time, CPU time and peak memory of every node of a graph, through the
+    wrap_node hook of build_agent.
+
+    CPU time is the process CPU time elapsed during a node run, and memory is traced by
+    tracemalloc when trace_memory is set. Nodes running at the same time (e.g. the parallel
+    learning branches) therefore share the CPU time and memory used while they overlap.
+    """
+    trace_memory: bool = True
+    nodes: Dict[str, NodeStats] = field(default_factory=dict)
+    _active: List[_Span] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def wrap(self, name: str, node: Callable) -> Callable:
+        """Return the node measured by the profiler, with the same signature and kind (sync or async)"""
+        if inspect.iscoroutinefunction(node):
+            @functools.wraps(node)
+            async def _async_node(*args, **kwargs):
+                span = self._start(name)
+                try:
+                    return await node(*args, **kwargs)
+                finally:
+                    self._stop(span)
+            return _async_node
+
+        @functools.wraps(node)
+        def _node(*args, **kwargs):
+            span = self._start(name)
+            try:
+                return node(*args, **kwargs)
+            finally:
+                self._stop(span)
+        return _node
+
+    def start(self) -> None:
+        """Start tracing memory, to be called before the graph runs"""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self) -> None:
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _fold_peak(self) -> int:
+        # tracemalloc has a single peak, it is folded into every running span before being reset
+        if not tracemalloc.is_tracing():
+            return 0
+        current, peak = tracemalloc.get_traced_memory()
+        for span in self._active:
+            span.memory_peak = max(span.memory_peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def _start(self, name: str) -> _Span:
+        with self._lock:
+            current = self._fold_peak()
+            span = _Span(name=name, wall_start=time.perf_counter(), cpu_start=time.process_time(),
+                         memory_start=current, memory_peak=current)
+            self._active.append(span)
+        return span
+
+    def _stop(self, span: _Span) -> None:
+        wall = time.perf_counter() - span.wall_start
+        cpu = time.process_time() - span.cpu_start
+        with self._lock:
+            self._fold_peak()
+            self._active.remove(span)
+            stats = self.nodes.setdefault(span.name, NodeStats())
+            stats.calls += 1
+            stats.wall += wall
+            stats.max_wall = max(stats.max_wall, wall)
+            stats.cpu += cpu
+            stats.peak_memory = max(stats.peak_memory, span.memory_peak - span.memory_start)
@@ -0,0 +1,150 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+"""
+Record a report run into a fixture bundle, then replay it offline to profile the graph nodes
+
+    python -m src.bench.run record --bundle bench/report.json.gz --depth 2 -m "first message" -m "answer"
+    python -m src.bench.run replay --bundle bench/report.json.gz --repeat 3 --output bench/result.json
+    python -m src.bench.run replay --bundle bench/report.json.gz --baseline bench/result.json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+from langchain.schema import AIMessage, HumanMessage
+
+from src.agent.agent import build_agent
+from src.bench.fixtures import FixtureBundle, LatencyModel, record, replay
+from src.bench.profiler import NodeProfiler
+from src.utils import metrics
+
+# Node slowdowns below this many seconds are noise and never reported as regressions
+MIN_REGRESSION_DELTA = 0.05
+
+
+async def run_graph(bundle_input: Dict[str, Any], profiler: NodeProfiler) -> Dict[str, Any]:
+    """
+    Run the report graph once on a recorded input
+
+    Args:
+        bundle_input: Messages and depth of the run
+        profiler: Profiler wrapped around every node
+
+    Returns:
+        Total wall and CPU time of the run, with the stats of every node and the run metrics
+        (LLM, search and depth level timings)
+    """
+    messages = [AIMessage(content=m["content"]) if m["type"] == "ai" else HumanMessage(content=m["content"])
+                for m in bundle_input.get("messages", [])]
+    config = {"configurable": {"depth": bundle_input.get("depth", 2), "save_as_html": False}}
+    graph = build_agent(wrap_node=profiler.wrap)
+    profiler.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        with metrics.collect() as run_metrics:
+            async for _ in graph.astream(input={"messages": messages}, config=config, stream_mode="values"):
+                pass
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        profiler.stop()
+    summary = run_metrics.summary()
+    return {"wall": wall, "cpu": cpu, "nodes": {name: stats.to_dict() for name, stats in profiler.nodes.items()},
+            "llm": summary["llm"], "search": summary["search"]}
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Median of every measure over the runs"""
+    nodes = sorted({name for run in runs for name in run["nodes"]})
+    return {
+        "wall": statistics.median(run["wall"] for run in runs),
+        "cpu": statistics.median(run["cpu"] for run in runs),
+        "nodes": {
+            name: {measure: statistics.median(run["nodes"].get(name, {}).get(measure, 0) for run in runs)
+                   for measure in ("calls", "wall", "max_wall", "cpu", "peak_memory")}
+            for name in nodes
+        },
+    }
+
+
+def find_regressions(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compare the node wall times of two summaries
+
+    Returns:
+        One line per node slower than the baseline by more than tolerance (a fraction)
+    """
+    regressions = []
+    for name, stats in current["nodes"].items():
+        before = baseline["nodes"].get(name, {}).get("wall")
+        if before is None:
+            continue
+        if stats["wall"] > before * (1 + tolerance) and stats["wall"] - before > MIN_REGRESSION_DELTA:
+            regressions.append(f"{name}: {before:.3f}s -> {stats['wall']:.3f}s")
+    return regressions
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    print(f"{'node':<20}{'calls':>7}{'wall s':>10}{'max s':>10}{'cpu s':>10}{'peak MB':>10}")
+    for name, stats in summary["nodes"].items():
+        print(f"{name:<20}{stats['calls']:>7g}{stats['wall']:>10.3f}{stats['max_wall']:>10.3f}"
+              f"{stats['cpu']:>10.3f}{stats['peak_memory'] / 1024 / 1024:>10.1f}")
+    print(f"{'total':<20}{'':>7}{summary['wall']:>10.3f}{'':>10}{summary['cpu']:>10.3f}")
+
+
+async def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Record and replay report runs for offline benchmarking")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="run a report against the live endpoints and record it")
+    record_parser.add_argument("--bundle", required=True, help="fixture bundle to write (.json or .json.gz)")
+    record_parser.add_argument("-m", "--message", action="append", required=True,
+                               help="user message, repeat it for a conversation")
+    record_parser.add_argument("--depth", type=int, default=2, help="deep search depth")
+    replay_parser = commands.add_parser("replay", help="rerun a recorded report offline and profile its nodes")
+    replay_parser.add_argument("--bundle", required=True, help="fixture bundle to replay")
+    replay_parser.add_argument("--latency", choices=["none", "recorded", "synthetic"], default="none")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="divides the recorded latencies")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="number of runs, medians are reported")
+    replay_parser.add_argument("--no-memory", action="store_true", help="do not trace memory, it slows runs down")
+    replay_parser.add_argument("--output", help="file the summary is written to")
+    replay_parser.add_argument("--baseline", help="summary of a previous replay to compare the node times to")
+    replay_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown per node")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        bundle_input = {"messages": [{"type": "human", "content": m} for m in args.message], "depth": args.depth}
+        with record(bundle_input) as bundle:
+            result = await run_graph(bundle_input, NodeProfiler(trace_memory=False))
+        bundle.save(args.bundle)
+        print(f"recorded {len(bundle.llm_calls)} LLM calls and {len(bundle.search_calls)} searches "
+              f"in {result['wall']:.1f}s to {args.bundle}")
+        return 0
+
+    bundle = FixtureBundle.load(args.bundle)
+    runs = []
+    for _ in range(max(1, args.repeat)):
+        with replay(bundle, LatencyModel(mode=args.latency, speed=args.speed)) as replayer:
+            runs.append(await run_graph(bundle.input, NodeProfiler(trace_memory=not args.no_memory)))
+        if replayer.stats.llm_misses or replayer.stats.search_misses:
+            print(f"warning: {replayer.stats.llm_misses} LLM calls and {replayer.stats.search_misses} searches "
+                  f"were not recorded, the run differs from the recorded one", file=sys.stderr)
+    summary = summarize(runs)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "runs": runs}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["summary"]
+        regressions = find_regressions(baseline, summary, args.tolerance)
+        for line in regressions:
+            print(f"regression {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,95 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import asyncio
+import inspect
+import time
+from types import SimpleNamespace
+from typing import List
+from unittest.mock import patch
+
+from langchain.schema import HumanMessage
+from langchain_core.runnables import RunnableConfig
+
+from src.agent import generate as generate_module
+from src.llms import llm as llm_module
+from src.tools import search as search_module
+from src.tools._search import SearchClient, SearchResult
+from .content import CharContentProcessor, process_stream, synthetic_stream
+from .fixtures import FixtureBundle, LatencyModel, record, replay
+from .profiler import NodeProfiler
+
+
+class FakeChatModel:
+    def stream(self, messages):
+        for r, c in [("think", ""), ("", "Hel"), ("", "lo")]:
+            time.sleep(0.05)
+            yield SimpleNamespace(content=c, additional_kwargs={"reasoning_content": r})
+
+    async def ainvoke(self, messages):
+        return SimpleNamespace(content=f"answer to {messages[-1].content}", additional_kwargs={})
+
+
+class FakeEngine(SearchClient):
+    def search(self, query: str, top_n: int) -> List[SearchResult]:
+        return [SearchResult(url=f"https://{query}/{i}", title=query, summary="", content="page") for i in range(top_n)]
+
+
+def test_record_then_replay_serves_the_same_calls(tmp_path):
+    with patch.object(llm_module, "_get_llm_instance", lambda *args, **kwargs: FakeChatModel()), \
+            patch.object(search_module, "TavilySearchClient", FakeEngine), \
+            patch.object(search_module, "JinaSearchClient", FakeEngine):
+        with record({"messages": [{"type": "human", "content": "hi"}]}) as bundle:
+            streamed = list(llm_module.llm("basic", [HumanMessage(content="a")], stream=True))
+            answer = asyncio.run(llm_module.allm("basic", [HumanMessage(content="b")]))
+            results = search_module.SearchClient().search("q", 2)
+    bundle.save(tmp_path / "bundle.json.gz")
+    bundle = FixtureBundle.load(tmp_path / "bundle.json.gz")
+    assert bundle.input["messages"][0]["content"] == "hi"
+
+    with replay(bundle, LatencyModel(mode="recorded", speed=2)) as replayer:
+        start = time.monotonic()
+        assert list(llm_module.llm("basic", [HumanMessage(content="a")], stream=True)) == streamed
+        assert time.monotonic() - start > 0.06
+        assert asyncio.run(llm_module.allm("basic", [HumanMessage(content="b")])) == answer
+        assert [r.url for r in search_module.SearchClient().search("q", 2)] == [r.url for r in results]
+        assert asyncio.run(llm_module.allm("basic", [HumanMessage(content="unknown")])) == ""
+    assert (replayer.stats.llm_hits, replayer.stats.llm_misses, replayer.stats.search_hits) == (2, 1, 1)
+
+
+def test_profiler_keeps_node_signatures():
+    async def async_node(state, config: RunnableConfig):
+        await asyncio.sleep(0.05)
+        return {"value": [0] * 100000}
+
+    def sync_node(state):
+        return {}
+
+    profiler = NodeProfiler()
+    wrapped_async, wrapped_sync = profiler.wrap("a", async_node), profiler.wrap("s", sync_node)
+    assert inspect.iscoroutinefunction(wrapped_async) and not inspect.iscoroutinefunction(wrapped_sync)
+    assert inspect.signature(wrapped_async) == inspect.signature(async_node)
+
+    profiler.start()
+    asyncio.run(wrapped_async({}, {}))
+    wrapped_sync({})
+    wrapped_sync({})
+    profiler.stop()
+    assert profiler.nodes["a"].calls == 1 and profiler.nodes["a"].wall >= 0.05
+    assert profiler.nodes["a"].peak_memory > 100000 * 8 // 2
+    assert profiler.nodes["s"].calls == 2
+
+
+def test_chunk_scanner_matches_the_character_scanner():
+    async def fake_allm(llm_type, messages, **kwargs):
+        return f"<echarts>{messages['above']!r} {messages['description']}</echarts>"
+
+    with patch.object(generate_module, "allm", fake_allm), \
+            patch.object(generate_module, "apply_prompt_template", lambda prompt_name, state: state), \
+            patch.object(generate_module, "time", SimpleNamespace(time=lambda: 0)), \
+            patch.object(generate_module, "uuid", SimpleNamespace(uuid4=lambda: SimpleNamespace(hex="0" * 32))):
+        for seed, chunk_size in [(0, 1), (1, 3), (2, 8), (3, 40), (4, 500)]:
+            chunks = synthetic_stream(20000, chunk_size, seed, charts=True)
+            expected, expected_chapter, _ = asyncio.run(process_stream(CharContentProcessor, chunks))
+            outputs, chapter, _ = asyncio.run(process_stream(generate_module.ContentProcessor, chunks))
+            assert outputs == expected and chapter == expected_chapter
+            assert "<div id=" in chapter and "chart-placeholder" not in chapter
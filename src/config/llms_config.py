@@ -2,15 +2,31 @@
 # SPDX-License-Identifier: Apache 2.0 License
 
 import toml
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Type, TypeVar, Literal
+from typing import Any, Dict, List, Type, TypeVar, Literal
 
 
 # Define generic type variable for type hinting
 T = TypeVar('T', bound='BaseLLMConfig')
 
 
+# Routing policies among the endpoints of an LLM type
+ROUTING_POLICIES = ("least_outstanding", "weighted_round_robin")
+
+
+@dataclass(kw_only=True)
+class EndpointConfig:
+    """One endpoint (gateway replica or API key) serving an LLM type"""
+    base_url: str
+    api_base: str
+    model: str
+    api_key: str
+    weight: float = 1.0  # Share of the calls relative to the other endpoints of the type
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
+
+
 @dataclass(kw_only=True)
 class BaseLLMConfig:
     """Base LLM configuration class containing common configuration items for all LLMs"""
@@ -18,6 +34,12 @@ class BaseLLMConfig:
     api_base: str
     model: str
     api_key: str
+    max_concurrency: int = 8  # Maximum number of in-flight requests of this LLM type
+    requests_per_minute: int = 0  # Rate limit of the endpoint, 0 for unlimited
+    tokens_per_minute: int = 0  # Prompt and completion tokens limit of the endpoint, 0 for unlimited
+    # Endpoints the calls are spread over, the type itself is the only endpoint when none are listed
+    endpoints: List[EndpointConfig] = field(default_factory=list)
+    routing: str = "least_outstanding"
 
     @classmethod
     def from_dict(cls: Type[T], config_dict: Dict[str, str]) -> T:
@@ -34,14 +56,36 @@ class BaseLLMConfig:
             ValueError: If required fields are missing in the configuration
         """
         try:
-            return cls(
+            config = cls(
                 base_url=config_dict.get('base_url'),
                 api_base=config_dict.get('api_base'),
                 model=config_dict['model'],
-                api_key=config_dict['api_key']
+                api_key=config_dict['api_key'],
+                max_concurrency=int(config_dict.get('max_concurrency', 8)),
+                requests_per_minute=int(config_dict.get('requests_per_minute', 0)),
+                tokens_per_minute=int(config_dict.get('tokens_per_minute', 0)),
+                routing=config_dict.get('routing', "least_outstanding")
             )
         except KeyError as e:
             raise ValueError(f"Configuration missing required field: {e}") from e
+        if config.routing not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown routing policy '{config.routing}', expected one of {ROUTING_POLICIES}")
+        config.endpoints = [config._endpoint(endpoint) for endpoint in config_dict.get('endpoints', [{}])]
+        if any(endpoint.weight <= 0 for endpoint in config.endpoints):
+            raise ValueError("Endpoint weights must be positive")
+        return config
+
+    def _endpoint(self, endpoint_dict: Dict[str, Any]) -> EndpointConfig:
+        """Endpoint settings, the ones left out are taken from the LLM type"""
+        return EndpointConfig(
+            base_url=endpoint_dict.get('base_url', self.base_url),
+            api_base=endpoint_dict.get('api_base', self.api_base),
+            model=endpoint_dict.get('model', self.model),
+            api_key=endpoint_dict.get('api_key', self.api_key),
+            weight=float(endpoint_dict.get('weight', 1.0)),
+            requests_per_minute=int(endpoint_dict.get('requests_per_minute', self.requests_per_minute)),
+            tokens_per_minute=int(endpoint_dict.get('tokens_per_minute', self.tokens_per_minute))
+        )
 
 
 def load_llm_configs(config_path: Path = None) -> Dict[str, BaseLLMConfig]:
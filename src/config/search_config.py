@@ -3,7 +3,7 @@
 
 
 import toml
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, Type, TypeVar
 
@@ -12,6 +12,44 @@ from typing import Dict, Type, TypeVar
 T = TypeVar('T', bound='SearchConfig')
 
 
+@dataclass(kw_only=True)
+class SearchCacheConfig:
+    """Search result cache configuration"""
+    enabled: bool = False
+    path: str = "cache/search.sqlite"
+    ttl: int = 86400  # Default time to live of one day
+    max_size_mb: int = 512
+
+    @classmethod
+    def from_dict(cls, config_dict: Dict[str, str]) -> 'SearchCacheConfig':
+        """
+        Create an instance from a dictionary with validation
+
+        Args:
+            config_dict: Dictionary containing cache configuration parameters
+
+        Returns:
+            Instance of SearchCacheConfig
+
+        Raises:
+            ValueError: If a field is invalid
+        """
+        try:
+            ttl = int(config_dict.get('ttl', 86400))
+            max_size_mb = int(config_dict.get('max_size_mb', 512))
+        except (ValueError, TypeError):
+            raise ValueError("Cache ttl and max_size_mb must be valid integers")
+        if ttl < 0 or max_size_mb < 1:
+            raise ValueError("Cache ttl must not be negative and max_size_mb must be positive")
+
+        return cls(
+            enabled=bool(config_dict.get('enabled', False)),
+            path=str(config_dict.get('path', "cache/search.sqlite")),
+            ttl=ttl,
+            max_size_mb=max_size_mb
+        )
+
+
 @dataclass(kw_only=True)
 class SearchConfig:
     """Search engine configuration class containing search service parameters"""
@@ -19,6 +57,7 @@ class SearchConfig:
     jina_api_key: str
     tavily_api_key: str
     timeout: int = 30  # Default timeout of 30 seconds
+    cache: SearchCacheConfig = field(default_factory=SearchCacheConfig)
 
     @classmethod
     def from_dict(cls: Type[T], config_dict: Dict[str, str]) -> T:
@@ -82,7 +121,9 @@ def load_search_config(config_path: Path = None) -> SearchConfig:
         raise ValueError("Invalid configuration file format. Expected [search] section.")
 
     # Create configuration instance from the [search] section
-    return SearchConfig.from_dict(raw_config['search'])
+    config = SearchConfig.from_dict(raw_config['search'])
+    config.cache = SearchCacheConfig.from_dict(raw_config.get('cache', {}))
+    return config
 
 
 # Initialize configurations for import by other modules
@@ -1,18 +1,115 @@
 # Copyright (c) 2025 IFLYTEK Ltd.
 # SPDX-License-Identifier: Apache 2.0 License
 
-from typing import Generator, Union, Dict, List
+import contextlib
+import hashlib
+import importlib.util
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Deque, Generator, Iterator, Optional, Sequence, Union, Dict, List, Tuple
+
+import asyncio
+import httpx
+import numpy as np
+import openai
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
 from langchain_deepseek import ChatDeepSeek
 
-from src.config.llms_config import LLMType, llm_configs
-# Cache storage for LLM instances - key includes both type and streaming mode
-_llm_cache: Dict[tuple[LLMType, bool, int], ChatDeepSeek] = {}
+from src.config.llms_config import EndpointConfig, LLMType, llm_configs
+from src.config.workflow_config import workflow_configs
+from src.llms.router import Endpoint, EndpointRouter, endpoint_key, endpoint_name
+from src.utils.concurrency import HybridSemaphore, RateLimiter, TaskResult, amap_ordered, map_ordered
+from src.utils.disk_cache import DiskCache
+from src.utils.metrics import LLMRecord, current_metrics, elapsed_since, record
+from src.utils.token_util import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_TEMPERATURE = 0.6
+_MAX_TOKENS = 8192
+# Cache storage for LLM instances - key includes type, streaming mode, max tokens and endpoint.
+# Instances created inside an event loop are cached with the loop (_LoopState), since their async
+# HTTP client is bound to it
+_llm_cache: Dict[tuple[LLMType, bool, int, int], ChatDeepSeek] = {}
+_loop_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+_loop_states_lock = threading.Lock()
+# Times a call rejected with 429 Too Many Requests is queued again before it fails
+_RATE_LIMIT_REQUEUES = 3
+# Seconds the calls of an endpoint are held back after a 429 without a Retry-After header
+_RATE_LIMIT_PAUSE = 10.0
+# Per LLM type admission control, shared by all sync and async callers of the process
+_llm_admissions: Dict[LLMType, "_Admission"] = {}
+# Endpoint states (rate limiter, outstanding requests, health, latencies) shared by the LLM types
+# sending to the same endpoint
+_endpoints: Dict[Tuple[str, str, str], Endpoint] = {}
+_llm_admissions_lock = threading.Lock()
+
+
+def _http_options() -> Dict[str, Any]:
+    """Connection pool options of the [llm.http] section of workflow.toml, as httpx client arguments"""
+    options = workflow_configs.get("llm", {}).get("http", {})
+    http2 = options.get("http2", True)
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.info("HTTP/2 needs the h2 package (pip install 'httpx[http2]'), LLM calls use HTTP/1.1")
+        http2 = False
+    limits = httpx.Limits(max_connections=options.get("max_connections", 64),
+                          max_keepalive_connections=options.get("max_keepalive_connections", 32),
+                          keepalive_expiry=options.get("keepalive_expiry", 120))
+    timeout = httpx.Timeout(options.get("timeout", 600),
+                            connect=options.get("connect_timeout", 10),
+                            pool=options.get("pool_timeout", 600))
+    return {"http2": http2, "limits": limits, "timeout": timeout}
+
+
+@lru_cache(maxsize=1)
+def _get_http_client() -> httpx.Client:
+    """
+    Return the sync HTTP client shared by all LLM instances
+
+    Each instance would otherwise open a connection pool of its own, although the LLM types
+    usually point at the same API base. Sharing the pools lets concurrent calls reuse warm
+    keep-alive connections instead of opening new TLS sessions.
+    """
+    return httpx.Client(**_http_options())
+
+
+@dataclass(kw_only=True)
+class _LoopState:
+    """Async HTTP client of an event loop, and the LLM instances using it"""
+    http_client: httpx.AsyncClient
+    instances: Dict[tuple[LLMType, bool, int, int], ChatDeepSeek]
+
+
+def _get_loop_state(loop: asyncio.AbstractEventLoop) -> _LoopState:
+    """
+    Return the async HTTP client shared by the LLM instances used in an event loop, with these
+    instances
+
+    The connections of an async client belong to the loop that opened them and fail in any other
+    one (a later asyncio.run, or a worker thread running its own loop), so every loop gets its own
+    client. The states of closed loops are dropped.
+    """
+    with _loop_states_lock:
+        for closed in [other for other in _loop_states if other.is_closed()]:
+            del _loop_states[closed]
+        state = _loop_states.get(loop)
+        if state is None:
+            state = _loop_states[loop] = _LoopState(http_client=httpx.AsyncClient(**_http_options()), instances={})
+        return state
 
 
 def _get_llm_instance(llm_type: LLMType,
                       streaming: bool = False,
-                      max_tokens: int = 8192) -> ChatDeepSeek:
+                      max_tokens: int = _MAX_TOKENS,
+                      endpoint: int = 0) -> ChatDeepSeek:
     """
     Retrieves a cached ChatOpenAI instance or creates a new one with specified parameters.
 
@@ -20,6 +117,7 @@ def _get_llm_instance(llm_type: LLMType,
         llm_type: Type of LLM to retrieve (must be defined in LLMType)
         streaming: Whether to enable streaming mode
         max_tokens: Maximum number of tokens to generate, defaults to 8192 (8K)
+        endpoint: Index of the endpoint of the type the instance sends to
 
     Returns:
         Configured ChatOpenAI instance
@@ -27,34 +125,482 @@ def _get_llm_instance(llm_type: LLMType,
     Raises:
         KeyError: If specified LLMType has no configuration
     """
-    # Create composite cache key using both type and streaming mode
-    cache_key = (llm_type, streaming, max_tokens)
+    # Create composite cache key using type, streaming mode, max tokens and endpoint
+    cache_key = (llm_type, streaming, max_tokens, endpoint)
+    try:
+        loop_state = _get_loop_state(asyncio.get_running_loop())
+    except RuntimeError:
+        loop_state = None
+    instances = _llm_cache if loop_state is None else loop_state.instances
 
-    if cache_key in _llm_cache:
-        return _llm_cache[cache_key]
+    if cache_key in instances:
+        return instances[cache_key]
 
     try:
         llm_config = llm_configs[llm_type]
     except KeyError as e:
         raise KeyError(f"LLM configuration for '{llm_type}' not found") from e
 
-    # Create configuration dictionary from base config
-    config_dict = llm_config.__dict__.copy()
+    endpoint_config = llm_config.endpoints[endpoint]
+    config_dict = {
+        "base_url": endpoint_config.base_url,
+        "api_base": endpoint_config.api_base,
+        "model": endpoint_config.model,
+        "api_key": endpoint_config.api_key,
+    }
 
     # Explicitly set streaming mode based on parameter (overrides config if present)
     config_dict["streaming"] = streaming
     config_dict["max_tokens"] = max_tokens
-    config_dict["temperature"] = 0.6
+    config_dict["temperature"] = _TEMPERATURE
+
+    config_dict["http_client"] = _get_http_client()
+    if loop_state is not None:
+        config_dict["http_async_client"] = loop_state.http_client
+    # Failed calls are retried by the retry policy of the [llm.retry] section, not by the client
+    config_dict["max_retries"] = 0
 
     llm_instance = ChatDeepSeek(**config_dict)
-    _llm_cache[cache_key] = llm_instance
+    instances[cache_key] = llm_instance
     return llm_instance
 
 
+def get_max_concurrency(llm_type: LLMType) -> int:
+    """Return the maximum number of in-flight requests allowed for an LLM type"""
+    return max(1, llm_configs[llm_type].max_concurrency)
+
+
+def _lowest_limit(limits: List[int]) -> int:
+    return min((limit for limit in limits if limit > 0), default=0)
+
+
+@dataclass(kw_only=True)
+class _RetryPolicy:
+    """Retries of the calls that failed with a transient error, configured in the [llm.retry] section"""
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter before the retry following the given failed attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+@dataclass(kw_only=True)
+class _HedgePolicy:
+    """Hedging of the non-streaming calls, configured in the [llm.hedge] section"""
+    enabled: bool = False
+    quantile: float = 0.95
+    min_samples: int = 20
+    window: int = 200
+
+
+@lru_cache(maxsize=1)
+def _get_call_policies() -> Tuple[_RetryPolicy, _HedgePolicy]:
+    options = workflow_configs.get("llm", {})
+    retry, hedge = options.get("retry", {}), options.get("hedge", {})
+    return (_RetryPolicy(max_attempts=max(1, retry.get("max_attempts", 3)),
+                         base_delay=retry.get("base_delay", 1.0),
+                         max_delay=retry.get("max_delay", 30.0)),
+            _HedgePolicy(enabled=hedge.get("enabled", False),
+                         quantile=hedge.get("quantile", 0.95),
+                         min_samples=hedge.get("min_samples", 20),
+                         window=hedge.get("window", 200)))
+
+
+def _is_transient(error: Exception) -> bool:
+    """Connection errors, timeouts and server errors, which a new attempt may not meet"""
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code in (408, 409) or error.status_code >= 500)
+
+
+def _is_endpoint_failure(error: Exception) -> bool:
+    """Errors that count against the health of the endpoint, unlike e.g. invalid requests"""
+    return isinstance(error, openai.RateLimitError) or _is_transient(error)
+
+
+class _Admission:
+    """
+    Admission control of the calls of an LLM type: the choice of an endpoint, the rate limits of
+    that endpoint, then the in-flight limit of the type. It also decides on retries and keeps the
+    latencies the hedging relies on.
+    """
+    def __init__(self, semaphore: HybridSemaphore, router: EndpointRouter,
+                 retry: Optional[_RetryPolicy] = None, hedge: Optional[_HedgePolicy] = None):
+        self.semaphore = semaphore
+        self.router = router
+        self.retry = retry or _RetryPolicy()
+        self.hedge = hedge or _HedgePolicy()
+        self._latencies: Deque[float] = deque(maxlen=self.hedge.window)
+
+    @staticmethod
+    def _prompt_tokens(endpoint: Endpoint, messages: List[Union[HumanMessage, AIMessage, SystemMessage]]) -> int:
+        if not endpoint.limiter.limits_tokens:
+            return 0
+        return sum(count_tokens(str(message.content)) for message in messages)
+
+    @contextlib.contextmanager
+    def _request(self, index: int) -> Iterator[None]:
+        """Report the end of a request sent to an endpoint, with its latency when it succeeded"""
+        endpoint = self.router.endpoints[index]
+        perf_start, latency, failed = time.perf_counter(), None, False
+        try:
+            yield
+            latency = time.perf_counter() - perf_start
+        except Exception as e:
+            failed = _is_endpoint_failure(e)
+            raise
+        finally:
+            endpoint.end(latency, failed)
+
+    @contextlib.contextmanager
+    def enter(self, messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+              metrics: "_CallMetrics", tried: List[int]) -> Iterator[int]:
+        """
+        Wait for the limits of a call, then hold its in-flight slot
+
+        Args:
+            messages: Messages of the call, their tokens count against the tokens per minute limit
+            metrics: Accounting of the call in the run metrics
+            tried: Endpoints tried by the previous attempts of the call, avoided when others are
+                available. The chosen endpoint is appended.
+
+        Yields:
+            Index of the endpoint to send the request to
+        """
+        index = self.router.pick(tried)
+        tried.append(index)
+        endpoint = self.router.endpoints[index]
+        dispatched = False
+        try:
+            endpoint.limiter.acquire(self._prompt_tokens(endpoint, messages))
+            with self.semaphore:
+                metrics.dispatched(endpoint.name)
+                dispatched = True
+                with self._request(index):
+                    yield index
+        finally:
+            if not dispatched:
+                endpoint.cancel()
+
+    @contextlib.asynccontextmanager
+    async def aenter(self, messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                     metrics: "_CallMetrics", tried: List[int]) -> AsyncIterator[int]:
+        index = self.router.pick(tried)
+        tried.append(index)
+        endpoint = self.router.endpoints[index]
+        dispatched = False
+        try:
+            await endpoint.limiter.aacquire(self._prompt_tokens(endpoint, messages))
+            async with self.semaphore:
+                metrics.dispatched(endpoint.name)
+                dispatched = True
+                with self._request(index):
+                    yield index
+        finally:
+            if not dispatched:
+                endpoint.cancel()
+
+    def charge(self, tried: List[int], completion: str) -> None:
+        """Charge the completion tokens of a call to the tokens per minute limit of its last endpoint"""
+        if tried and self.router.endpoints[tried[-1]].limiter.limits_tokens:
+            self.router.endpoints[tried[-1]].limiter.consume(count_tokens(completion))
+
+    def retry_delay(self, error: Exception, attempt: int, tried: List[int]) -> Optional[float]:
+        """
+        Decide whether a failed call is tried again
+
+        Calls rejected with 429 Too Many Requests are queued again, a limited number of times, after
+        holding back the endpoint for the time the server asks. Calls failed with a transient error
+        are retried after a jittered exponential backoff, up to the attempts of the retry policy.
+        Both go to another endpoint of the type when there is one.
+
+        Args:
+            error: Error of the failed attempt
+            attempt: Number of attempts failed before this one
+            tried: Endpoints tried so far, the last one failed
+
+        Returns:
+            Seconds to wait before trying again, None when the error must be reported
+        """
+        if isinstance(error, openai.RateLimitError):
+            if attempt >= _RATE_LIMIT_REQUEUES:
+                return None
+            retry_after = _RATE_LIMIT_PAUSE
+            try:
+                retry_after = float(error.response.headers.get("retry-after", retry_after))
+            except (AttributeError, TypeError, ValueError):
+                pass
+            endpoint = self.router.endpoints[tried[-1]]
+            logger.warning(f"LLM endpoint {endpoint.name} is rate limited for {retry_after:.1f}s, call queued again: {error}")
+            # The wait happens in the rate limiter, which holds back the other calls as well
+            endpoint.limiter.pause(retry_after)
+            return 0.0
+        if not _is_transient(error) or attempt + 1 >= self.retry.max_attempts:
+            return None
+        delay = self.retry.delay(attempt)
+        logger.warning(f"LLM call failed ({error!r}), retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    def observe(self, latency: float) -> None:
+        """Keep the latency of a successful non-streaming call for the hedging threshold"""
+        self._latencies.append(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency beyond which a non-streaming call is hedged, None when hedging is off or not warmed up"""
+        if not self.hedge.enabled or len(self._latencies) < self.hedge.min_samples:
+            return None
+        return float(np.quantile(np.fromiter(self._latencies, dtype=np.float64), self.hedge.quantile))
+
+    def _try_hedge(self, primary: int) -> Optional[int]:
+        """
+        Take capacity for a hedge request, preferably on another endpoint than the primary one,
+        only when an in-flight slot and the rate limits are free right away
+
+        Returns:
+            Endpoint of the hedge request, None when there is no spare capacity
+        """
+        if not self.semaphore.try_acquire():
+            return None
+        index = self.router.pick([primary])
+        limiter = self.router.endpoints[index].limiter
+        if limiter.reserve() > 0:
+            limiter.refund()
+            self.router.endpoints[index].cancel()
+            self.semaphore.release()
+            return None
+        return index
+
+    async def _ainvoke_hedge(self, llm_type: LLMType, index: int,
+                             messages: List[Union[HumanMessage, AIMessage, SystemMessage]]) -> Any:
+        try:
+            with self._request(index):
+                return await _get_llm_instance(llm_type, False, endpoint=index).ainvoke(messages)
+        finally:
+            self.semaphore.release()
+
+    async def ainvoke(self, llm_type: LLMType, index: int,
+                      messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                      metrics: "_CallMetrics") -> Any:
+        """
+        Invoke the LLM, sending a duplicate request when the call runs longer than the hedging
+        threshold, and return the first successful response
+
+        Args:
+            llm_type: Type of LLM to use
+            index: Endpoint of the primary request
+            messages: List of messages representing the conversation history
+            metrics: Accounting of the call in the run metrics
+
+        Raises:
+            Exception: Error of the primary request when every request failed
+        """
+        perf_start = time.perf_counter()
+        tasks = [asyncio.ensure_future(_get_llm_instance(llm_type, False, endpoint=index).ainvoke(messages))]
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                hedge = None if done else self._try_hedge(index)
+                if hedge is not None:
+                    metrics.hedged()
+                    logger.info(f"LLM call running for more than {delay:.1f}s, hedged on "
+                                f"{self.router.endpoints[hedge].name}")
+                    tasks.append(asyncio.ensure_future(self._ainvoke_hedge(llm_type, hedge, messages)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.observe(time.perf_counter() - perf_start)
+                        return task.result()
+            raise tasks[0].exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def _get_endpoint(config: EndpointConfig) -> Endpoint:
+    """Return the state of an endpoint, created with the lowest rate limits configured for it"""
+    key = endpoint_key(config)
+    if key not in _endpoints:
+        configs = [endpoint for llm_config in llm_configs.values() for endpoint in llm_config.endpoints
+                   if endpoint_key(endpoint) == key]
+        name = endpoint_name(config)
+        names = {endpoint.name for endpoint in _endpoints.values()}
+        if name in names:
+            # Another key of the same model and API base
+            name = f"{name}#{sum(n == name or n.startswith(f'{name}#') for n in names) + 1}"
+        _endpoints[key] = Endpoint(name, RateLimiter(
+            _lowest_limit([endpoint.requests_per_minute for endpoint in configs]),
+            _lowest_limit([endpoint.tokens_per_minute for endpoint in configs])))
+    return _endpoints[key]
+
+
+def _get_admission(llm_type: LLMType) -> _Admission:
+    with _llm_admissions_lock:
+        if llm_type not in _llm_admissions:
+            llm_config = llm_configs[llm_type]
+            router = EndpointRouter([(_get_endpoint(endpoint), endpoint.weight) for endpoint in llm_config.endpoints],
+                                    llm_config.routing)
+            _llm_admissions[llm_type] = _Admission(HybridSemaphore(get_max_concurrency(llm_type)), router,
+                                                   *_get_call_policies())
+        return _llm_admissions[llm_type]
+
+
+def endpoint_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Return the state of every LLM endpoint used so far: outstanding requests, calls, failures,
+    whether it is ejected, and the p50 and p95 latencies of its recent successful requests
+    """
+    with _llm_admissions_lock:
+        return {endpoint.name: endpoint.stats() for endpoint in _endpoints.values()}
+
+
+@lru_cache(maxsize=1)
+def _get_response_cache() -> Optional[DiskCache]:
+    """Return the response cache configured in the [llm.cache] section of workflow.toml, None when disabled"""
+    options = workflow_configs.get("llm", {}).get("cache", {})
+    if not options.get("enabled", False):
+        return None
+    path = options.get("path", "cache/llm.sqlite")
+    try:
+        return DiskCache(path, ttl=options.get("ttl", 604800), max_bytes=options.get("max_size_mb", 1024) * 1024 * 1024)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Failed to open LLM response cache {path}, calling without cache: {e}")
+        return None
+
+
+def request_key(llm_type: LLMType,
+                messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                stream: bool) -> str:
+    """
+    Content address of a request: hash of the model, LLM type, parameters and messages
+
+    Args:
+        llm_type: Type of LLM the request is sent to
+        messages: List of messages of the request
+        stream: Whether the response is streamed
+
+    Returns:
+        Hex digest identifying the request
+    """
+    llm_config = llm_configs[llm_type]
+    payload = {
+        "model": llm_config.model,
+        "api_base": llm_config.api_base or llm_config.base_url,
+        "llm_type": llm_type,
+        "params": {"stream": stream, "max_tokens": _MAX_TOKENS, "temperature": _TEMPERATURE},
+        "messages": [{"type": message.type, "content": message.content} for message in messages],
+    }
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _response_cache_key(llm_type: LLMType,
+                        messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                        stream: bool) -> Optional[str]:
+    """Key of a request in the response cache, None when the cache is disabled"""
+    if _get_response_cache() is None:
+        return None
+    return request_key(llm_type, messages, stream)
+
+
+def _load_response(cache_key: Optional[str]) -> Optional[Any]:
+    cache = _get_response_cache()
+    if cache is None or cache_key is None:
+        return None
+    try:
+        value = cache.get(cache_key)
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to read LLM response cache: {e}")
+        return None
+    return json.loads(value) if value is not None else None
+
+
+def _store_response(cache_key: Optional[str], response: Any) -> None:
+    cache = _get_response_cache()
+    # Empty responses are what failed calls return, they must be retried next time
+    if cache is None or cache_key is None or not response:
+        return
+    try:
+        cache.set(cache_key, json.dumps(response, ensure_ascii=False).encode("utf-8"))
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to write LLM response cache: {e}")
+
+
+class _CallMetrics:
+    """Timing and token accounting of one LLM call, recorded in the run metrics if they are collected"""
+    def __init__(self, llm_type: LLMType, messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                 stream: bool):
+        self._enabled = current_metrics() is not None
+        self._llm_type = llm_type
+        self._messages = messages
+        self._stream = stream
+        self._perf_start = time.perf_counter()
+        self._perf_dispatch: Optional[float] = None
+        self._ttft: Optional[float] = None
+        self._reasoning: List[str] = []
+        self._content: List[str] = []
+        self._usage: Optional[Dict[str, Any]] = None
+        self._endpoint = ""
+        self._retries = 0
+        self._hedged = False
+
+    def retried(self) -> None:
+        self._retries += 1
+
+    def hedged(self) -> None:
+        self._hedged = True
+
+    def dispatched(self, endpoint: str = "") -> None:
+        """Mark the end of the wait in the rate limit and concurrency queues"""
+        self._perf_dispatch = time.perf_counter()
+        self._endpoint = endpoint
+
+    def add(self, reasoning_content: str, content: str, usage: Optional[Dict[str, Any]] = None) -> None:
+        """Account for a streamed chunk or a complete response"""
+        if not self._enabled:
+            return
+        if self._ttft is None and self._stream:
+            self._ttft = time.perf_counter() - (self._perf_dispatch or self._perf_start)
+        self._reasoning.append(reasoning_content or "")
+        self._content.append(content if isinstance(content, str) else str(content))
+        self._usage = usage or self._usage
+
+    def finish(self, ok: bool = True, cached: bool = False) -> None:
+        if not self._enabled:
+            return
+        start, total = elapsed_since(self._perf_start)
+        queue_wait = (self._perf_dispatch or self._perf_start) - self._perf_start
+        call = LLMRecord(llm_type=self._llm_type, endpoint=self._endpoint, stream=self._stream, start=start, queue_wait=queue_wait,
+                         latency=total - queue_wait, ttft=self._ttft, retries=self._retries, hedged=self._hedged,
+                         cached=cached, ok=ok)
+        reasoning = "".join(self._reasoning)
+        if self._usage:
+            call.prompt_tokens = self._usage.get("input_tokens", 0)
+            call.completion_tokens = self._usage.get("output_tokens", 0)
+            call.reasoning_tokens = (self._usage.get("output_token_details") or {}).get("reasoning", count_tokens(reasoning))
+            call.estimated_tokens = False
+        else:
+            call.prompt_tokens = sum(count_tokens(str(message.content)) for message in self._messages)
+            call.completion_tokens = count_tokens("".join(self._content))
+            call.reasoning_tokens = count_tokens(reasoning)
+        record(call)
+
+
+def _replay_cached(metrics: _CallMetrics, chunks: List[Tuple[str, str]]) -> None:
+    for reasoning_content, content in chunks:
+        metrics.add(reasoning_content, content)
+    metrics.finish(cached=True)
+
+
 def llm(
         llm_type: LLMType,
         messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
-        stream: bool = False
+        stream: bool = False,
+        raise_errors: bool = False
 ) -> Union[Generator[str, None, None], str]:
     """
     Generates responses from LLM with support for streaming and non-streaming modes.
@@ -63,58 +609,318 @@ def llm(
         llm_type: Type of LLM to use
         messages: List of messages representing the conversation history
         stream: If True, returns response chunks via generator
+        raise_errors: If True, a non-streaming call that fails after its retries raises its error
+            instead of returning an empty string
 
     Returns:
-        - Generator yielding string chunks if stream=True
+        - Generator yielding string chunks if stream=True. It holds an in-flight slot until it is
+          exhausted or closed, consume it inside contextlib.closing when it may be left early
         - Complete response string if stream=False
     """
-    llm = _get_llm_instance(llm_type, stream)
+    admission = _get_admission(llm_type)
+    cache_key = _response_cache_key(llm_type, messages, stream)
     if stream:
-        return _stream_llm_response(llm, messages)
-    else:
-        return _non_stream_llm_response(llm, messages)
+        return _stream_llm_response(llm_type, messages, admission, cache_key)
+    metrics = _CallMetrics(llm_type, messages, stream)
+    cached = _load_response(cache_key)
+    if cached is not None:
+        _replay_cached(metrics, [("", cached)])
+        return cached
+    response = _non_stream_llm_response(llm_type, messages, admission, metrics, raise_errors)
+    _store_response(cache_key, response)
+    return response
 
 
-def _stream_llm_response(llm: ChatDeepSeek, messages: List[Union[HumanMessage, AIMessage, SystemMessage]]) -> Generator[str, None, None]:
+def _stream_llm_response(llm_type: LLMType,
+                         messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                         admission: _Admission,
+                         cache_key: Optional[str] = None) -> Generator[str, None, None]:
     """
     Handles streaming responses from LLM.
 
     Args:
-        llm: ChatOpenAI instance with streaming enabled
+        llm_type: Type of LLM to use
         messages: List of messages representing the conversation history
+        admission: Rate and concurrency limits, the in-flight slot is held while the response is being streamed
+        cache_key: Key of the request in the response cache, the recorded chunks are replayed on a hit
 
     Yields:
         Tuples containing (reasoning_content, content) for each response chunk
     """
+    metrics = _CallMetrics(llm_type, messages, True)
+    cached = _load_response(cache_key)
+    if cached is not None:
+        _replay_cached(metrics, cached)
+        for reasoning_content, content in cached:
+            yield reasoning_content, content
+        return
+
     # Stream responses and process chunks
+    chunks = []
+    tried = []
+    ok = False
     try:
-        for chunk in llm.stream(messages):
-            reasoning_content = chunk.additional_kwargs.get("reasoning_content", "")
-            content = chunk.content
-            yield reasoning_content, content
+        attempt = 0
+        while True:
+            try:
+                with admission.enter(messages, metrics, tried) as endpoint:
+                    for chunk in _get_llm_instance(llm_type, True, endpoint=endpoint).stream(messages):
+                        reasoning_content = chunk.additional_kwargs.get("reasoning_content", "")
+                        content = chunk.content
+                        chunks.append((reasoning_content, content))
+                        metrics.add(reasoning_content, content, getattr(chunk, "usage_metadata", None))
+                        yield reasoning_content, content
+                break
+            except Exception as e:
+                # A stream can only be tried again while nothing was yielded
+                delay = None if chunks else admission.retry_delay(e, attempt, tried)
+                if delay is None:
+                    raise
+            attempt += 1
+            metrics.retried()
+            time.sleep(delay)
+        ok = True
     except Exception as e:
         print(f"call sparkapi error:{e}")
+        return
+    finally:
+        admission.charge(tried, "".join(f"{r}{c}" for r, c in chunks))
+        metrics.finish(ok=ok)
+    # Only complete responses are recorded, a consumer that stops early never gets here
+    _store_response(cache_key, chunks)
 
 
-def _non_stream_llm_response(llm: ChatDeepSeek, messages: List[Union[HumanMessage, AIMessage, SystemMessage]]) -> str:
+def _non_stream_llm_response(llm_type: LLMType, messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                             admission: _Admission, metrics: _CallMetrics, raise_errors: bool = False) -> str:
     """
     Handles non-streaming responses from LLM.
 
     Args:
-        llm: ChatOpenAI instance with streaming disabled
+        llm_type: Type of LLM to use
         messages: List of messages representing the conversation history
+        admission: Rate and concurrency limits the call waits for
+        metrics: Accounting of the call in the run metrics
+        raise_errors: Raise the error of a failed call instead of returning an empty string
 
     Returns:
         Complete response string
     """
+    tried = []
+    attempt = 0
+    while True:
+        try:
+            with admission.enter(messages, metrics, tried) as endpoint:
+                perf_start = time.perf_counter()
+                response = _get_llm_instance(llm_type, False, endpoint=endpoint).invoke(messages)
+                admission.observe(time.perf_counter() - perf_start)
+            break
+        except Exception as e:
+            delay = admission.retry_delay(e, attempt, tried)
+            if delay is None:
+                metrics.finish(ok=False)
+                if raise_errors:
+                    raise
+                print(f"call sparkapi error:{e}")
+                return ""
+        attempt += 1
+        metrics.retried()
+        time.sleep(delay)
+    reasoning_content = response.additional_kwargs.get("reasoning_content","")
+    content = response.content
+    admission.charge(tried, f"{reasoning_content}{content}")
+    metrics.add(reasoning_content, content, getattr(response, "usage_metadata", None))
+    metrics.finish()
+    return f"<thinking>{reasoning_content}</thinking>\n{content}" if reasoning_content else f"{content}"
+
+
+def allm(
+        llm_type: LLMType,
+        messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+        stream: bool = False,
+        raise_errors: bool = False
+) -> Union[AsyncGenerator[Tuple[str, str], None], Awaitable[str]]:
+    """
+    Asynchronous counterpart of llm(), sharing its concurrency and rate limits.
+
+    Args:
+        llm_type: Type of LLM to use
+        messages: List of messages representing the conversation history
+        stream: If True, returns response chunks via async generator
+        raise_errors: If True, a non-streaming call that fails after its retries raises its error
+            instead of returning an empty string
+
+    Returns:
+        - Async generator yielding (reasoning_content, content) tuples if stream=True. It holds an
+          in-flight slot until it is exhausted or closed, consume it inside contextlib.aclosing
+          when it may be left early
+        - Awaitable resolving to the complete response string if stream=False
+    """
+    admission = _get_admission(llm_type)
+    cache_key = _response_cache_key(llm_type, messages, stream)
+    if stream:
+        return _astream_llm_response(llm_type, messages, admission, cache_key)
+    else:
+        return _anon_stream_llm_response(llm_type, messages, admission, cache_key, raise_errors)
+
+
+async def _astream_llm_response(llm_type: LLMType,
+                                messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                                admission: _Admission,
+                                cache_key: Optional[str] = None) -> AsyncGenerator[Tuple[str, str], None]:
+    """
+    Handles asynchronous streaming responses from LLM.
+
+    Args:
+        llm_type: Type of LLM to use
+        messages: List of messages representing the conversation history
+        admission: Rate and concurrency limits, the in-flight slot is held while the response is being streamed
+        cache_key: Key of the request in the response cache, the recorded chunks are replayed on a hit
+
+    Yields:
+        Tuples containing (reasoning_content, content) for each response chunk
+    """
+    metrics = _CallMetrics(llm_type, messages, True)
+    cached = _load_response(cache_key)
+    if cached is not None:
+        _replay_cached(metrics, cached)
+        for reasoning_content, content in cached:
+            yield reasoning_content, content
+        return
+
+    chunks = []
+    tried = []
+    ok = False
     try:
-        response = llm.invoke(messages)
+        attempt = 0
+        while True:
+            try:
+                async with admission.aenter(messages, metrics, tried) as endpoint:
+                    async for chunk in _get_llm_instance(llm_type, True, endpoint=endpoint).astream(messages):
+                        reasoning_content = chunk.additional_kwargs.get("reasoning_content", "")
+                        content = chunk.content
+                        chunks.append((reasoning_content, content))
+                        metrics.add(reasoning_content, content, getattr(chunk, "usage_metadata", None))
+                        yield reasoning_content, content
+                break
+            except Exception as e:
+                # A stream can only be tried again while nothing was yielded
+                delay = None if chunks else admission.retry_delay(e, attempt, tried)
+                if delay is None:
+                    raise
+            attempt += 1
+            metrics.retried()
+            await asyncio.sleep(delay)
+        ok = True
     except Exception as e:
         print(f"call sparkapi error:{e}")
-        return ""
+        return
+    finally:
+        admission.charge(tried, "".join(f"{r}{c}" for r, c in chunks))
+        metrics.finish(ok=ok)
+    _store_response(cache_key, chunks)
+
+
+async def _anon_stream_llm_response(llm_type: LLMType,
+                                    messages: List[Union[HumanMessage, AIMessage, SystemMessage]],
+                                    admission: _Admission,
+                                    cache_key: Optional[str] = None,
+                                    raise_errors: bool = False) -> str:
+    """
+    Handles asynchronous non-streaming responses from LLM.
+
+    Args:
+        llm_type: Type of LLM to use
+        messages: List of messages representing the conversation history
+        admission: Rate and concurrency limits the call waits for
+        cache_key: Key of the request in the response cache
+        raise_errors: Raise the error of a failed call instead of returning an empty string
+
+    Returns:
+        Complete response string
+    """
+    metrics = _CallMetrics(llm_type, messages, False)
+    cached = _load_response(cache_key)
+    if cached is not None:
+        _replay_cached(metrics, [("", cached)])
+        return cached
+    tried = []
+    attempt = 0
+    while True:
+        try:
+            async with admission.aenter(messages, metrics, tried) as endpoint:
+                response = await admission.ainvoke(llm_type, endpoint, messages, metrics)
+            break
+        except Exception as e:
+            delay = admission.retry_delay(e, attempt, tried)
+            if delay is None:
+                metrics.finish(ok=False)
+                if raise_errors:
+                    raise
+                print(f"call sparkapi error:{e}")
+                return ""
+        attempt += 1
+        metrics.retried()
+        await asyncio.sleep(delay)
     reasoning_content = response.additional_kwargs.get("reasoning_content","")
     content = response.content
-    return f"<thinking>{reasoning_content}</thinking>\n{content}" if reasoning_content else f"{content}"
+    admission.charge(tried, f"{reasoning_content}{content}")
+    metrics.add(reasoning_content, content, getattr(response, "usage_metadata", None))
+    metrics.finish()
+    result = f"<thinking>{reasoning_content}</thinking>\n{content}" if reasoning_content else f"{content}"
+    _store_response(cache_key, result)
+    return result
+
+
+def llm_batch(
+        llm_type: LLMType,
+        messages_list: Sequence[List[Union[HumanMessage, AIMessage, SystemMessage]]],
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None
+) -> List[TaskResult[str]]:
+    """
+    Generates the responses of independent prompts, concurrently within the limits of the LLM type.
+
+    Args:
+        llm_type: Type of LLM to use
+        messages_list: Conversations to complete, one call each
+        max_concurrency: Maximum number of calls of the batch in flight, defaults to the in-flight
+            limit of the LLM type (which also bounds the calls made outside the batch)
+        timeout: Per-call time limit in seconds, retries included
+
+    Returns:
+        One TaskResult per conversation, in the same order. Calls failed after their retries and
+        timeouts are reported through TaskResult.error instead of being raised.
+    """
+    return map_ordered(lambda messages: llm(llm_type, messages, raise_errors=True),
+                       messages_list,
+                       max_workers=max_concurrency or get_max_concurrency(llm_type),
+                       timeout=timeout)
+
+
+async def allm_batch(
+        llm_type: LLMType,
+        messages_list: Sequence[List[Union[HumanMessage, AIMessage, SystemMessage]]],
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None
+) -> List[TaskResult[str]]:
+    """
+    Asynchronous counterpart of llm_batch().
+
+    Args:
+        llm_type: Type of LLM to use
+        messages_list: Conversations to complete, one call each
+        max_concurrency: Maximum number of calls of the batch in flight, defaults to the in-flight
+            limit of the LLM type (which also bounds the calls made outside the batch)
+        timeout: Per-call time limit in seconds, retries included
+
+    Returns:
+        One TaskResult per conversation, in the same order. Calls failed after their retries and
+        timeouts are reported through TaskResult.error instead of being raised.
+    """
+    return await amap_ordered(lambda messages: allm(llm_type=llm_type, messages=messages, raise_errors=True),
+                              messages_list,
+                              max_concurrency=max_concurrency or get_max_concurrency(llm_type),
+                              timeout=timeout)
 
 
 if __name__ == "__main__":
@@ -139,13 +945,14 @@ if __name__ == "__main__":
 
         # Demonstrate streaming response
         print("\n=== Streaming Response ===")
-        for reasoning_content, content in llm(
+        with contextlib.closing(llm(
                 "basic",
                 [*conversation, HumanMessage(content="What is quantum entanglement then?")],
                 stream=True
-        ):
-            print(reasoning_content, end="", flush=True)
-            print(content, end="", flush=True)
+        )) as stream:
+            for reasoning_content, content in stream:
+                print(reasoning_content, end="", flush=True)
+                print(content, end="", flush=True)
 
     except Exception as e:
         print(f"Error with LLM response: {e}")
@@ -0,0 +1,156 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Collection, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+from src.config.llms_config import EndpointConfig
+from src.utils.concurrency import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def endpoint_key(config: EndpointConfig) -> Tuple[str, str, str]:
+    """Identity of an endpoint: the LLM types with the same API base, model and key share it"""
+    return config.api_base or config.base_url, config.model, config.api_key
+
+
+class Endpoint:
+    """
+    Live state of an endpoint, shared by the LLM types sending to it: outstanding requests,
+    latencies, and health. An endpoint failing EJECTION_FAILURES times in a row is ejected for
+    EJECTION_SECONDS, doubled at every new ejection up to MAX_EJECTION_SECONDS, and taken back
+    after its first success.
+    """
+    EJECTION_FAILURES = 3
+    EJECTION_SECONDS = 30.0
+    MAX_EJECTION_SECONDS = 300.0
+    # Number of recent latencies the quantiles are computed from
+    WINDOW = 200
+
+    def __init__(self, name: str, limiter: RateLimiter):
+        self.name = name
+        self.limiter = limiter
+        self.outstanding = 0
+        self.calls = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self._consecutive_failures = 0
+        self._ejections = 0
+        self._latencies: Deque[float] = deque(maxlen=self.WINDOW)
+        self._lock = threading.Lock()
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def begin(self) -> None:
+        with self._lock:
+            self.outstanding += 1
+
+    def cancel(self) -> None:
+        """Take back a request that was never sent, it is not counted as a call"""
+        with self._lock:
+            self.outstanding -= 1
+
+    def end(self, latency: Optional[float], failed: bool) -> None:
+        """
+        Account for the end of a request
+
+        Args:
+            latency: Duration of a successful request, None when it did not succeed
+            failed: Whether the request failed because of the endpoint (connection errors,
+                timeouts, 429 and 5xx), which counts against its health
+        """
+        with self._lock:
+            self.outstanding -= 1
+            self.calls += 1
+            if latency is not None:
+                self._latencies.append(latency)
+                self._consecutive_failures = 0
+                self._ejections = 0
+                return
+            if not failed:
+                return
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self._consecutive_failures < self.EJECTION_FAILURES:
+                return
+            seconds = min(self.MAX_EJECTION_SECONDS, self.EJECTION_SECONDS * 2 ** self._ejections)
+            self.ejected_until = time.monotonic() + seconds
+            self._ejections += 1
+            self._consecutive_failures = 0
+        logger.warning(f"LLM endpoint {self.name} failed {self.EJECTION_FAILURES} times in a row, "
+                       f"ejected for {seconds:.0f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = np.fromiter(self._latencies, dtype=np.float64)
+            stats = {"outstanding": self.outstanding, "calls": self.calls, "failures": self.failures,
+                     "ejected": not self.available(time.monotonic())}
+        stats["p50"] = float(np.percentile(latencies, 50)) if latencies.size else 0.0
+        stats["p95"] = float(np.percentile(latencies, 95)) if latencies.size else 0.0
+        return stats
+
+
+class EndpointRouter:
+    """
+    Spread the calls of an LLM type over its endpoints, skipping the ejected ones
+
+    least_outstanding sends a call to the endpoint with the fewest requests in flight relative
+    to its weight, ties going round robin. weighted_round_robin interleaves the endpoints in
+    proportion to their weights (smooth weighted round robin).
+    """
+    def __init__(self, endpoints: List[Tuple[Endpoint, float]], policy: str = "least_outstanding"):
+        self.endpoints = [endpoint for endpoint, _ in endpoints]
+        self._weights = [weight for _, weight in endpoints]
+        self._policy = policy
+        self._current = [0.0] * len(endpoints)
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def pick(self, exclude: Collection[int] = ()) -> int:
+        """
+        Choose the endpoint of a request and count it as outstanding there
+
+        Args:
+            exclude: Endpoints to avoid (e.g. the ones a failed call already tried), used anyway
+                when no other endpoint is left
+
+        Returns:
+            Index of the endpoint in endpoints, the caller must report the end of the request
+            with Endpoint.end, or Endpoint.cancel when it is not sent
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [i for i in range(len(self.endpoints)) if i not in exclude] or list(range(len(self.endpoints)))
+            healthy = [i for i in candidates if self.endpoints[i].available(now)]
+            if not healthy:
+                # Every endpoint is ejected, the one coming back first is tried
+                index = min(candidates, key=lambda i: self.endpoints[i].ejected_until)
+            elif self._policy == "weighted_round_robin":
+                for i in healthy:
+                    self._current[i] += self._weights[i]
+                index = max(healthy, key=lambda i: self._current[i])
+                self._current[index] -= sum(self._weights[i] for i in healthy)
+            else:
+                count = len(self.endpoints)
+                index = min(healthy, key=lambda i: (self.endpoints[i].outstanding / self._weights[i],
+                                                    (i - self._turn) % count))
+                self._turn = (index + 1) % count
+            self.endpoints[index].begin()
+            return index
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Outstanding requests, calls, failures, health and latency quantiles of every endpoint"""
+        return {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
+
+
+def endpoint_name(config: EndpointConfig) -> str:
+    """Name of an endpoint in logs and metrics, its API key is left out"""
+    url = urlparse(config.api_base or config.base_url or "")
+    return f"{url.netloc or url.path}/{config.model}"
@@ -0,0 +1,305 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import asyncio
+import contextlib
+import dataclasses
+import http.server
+import json
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+import openai
+import pytest
+from langchain.schema import HumanMessage
+
+from src.utils.disk_cache import DiskCache
+from src.utils.metrics import collect
+from . import llm as llm_module
+from .router import Endpoint, EndpointRouter
+
+
+class FakeChatModel:
+    def __init__(self):
+        self.calls = 0
+
+    def _chunks(self):
+        self.calls += 1
+        return [SimpleNamespace(content=c, additional_kwargs={"reasoning_content": r})
+                for r, c in [("think", ""), ("", "Hel"), ("", "lo")]]
+
+    def stream(self, messages):
+        yield from self._chunks()
+
+    async def astream(self, messages):
+        for chunk in self._chunks():
+            yield chunk
+
+    def invoke(self, messages):
+        self.calls += 1
+        return SimpleNamespace(content="Hello", additional_kwargs={})
+
+    async def ainvoke(self, messages):
+        return self.invoke(messages)
+
+
+def make_admission(endpoints=1, **policies):
+    router = EndpointRouter([(Endpoint(f"e{i}", llm_module.RateLimiter()), 1) for i in range(endpoints)])
+    return llm_module._Admission(llm_module.HybridSemaphore(2), router, **policies)
+
+
+@pytest.fixture
+def fake_model(tmp_path):
+    model = FakeChatModel()
+    cache = DiskCache(tmp_path / "llm.sqlite")
+    with patch.object(llm_module, "_get_llm_instance", return_value=model), \
+            patch.object(llm_module, "_get_response_cache", return_value=cache):
+        yield model
+
+
+def test_response_cache_replays_stream_chunks(fake_model):
+    messages = [HumanMessage(content="hi")]
+    first = list(llm_module.llm("basic", messages, stream=True))
+    second = list(llm_module.llm("basic", messages, stream=True))
+
+    async def collect():
+        return [chunk async for chunk in llm_module.allm("basic", messages, stream=True)]
+
+    assert first == second == asyncio.run(collect()) == [("think", ""), ("", "Hel"), ("", "lo")]
+    assert fake_model.calls == 1
+
+
+def test_response_cache_keys_on_messages_and_mode(fake_model):
+    assert llm_module.llm("basic", [HumanMessage(content="a")]) == "Hello"
+    assert asyncio.run(llm_module.allm("basic", [HumanMessage(content="a")])) == "Hello"
+    assert fake_model.calls == 1
+    llm_module.llm("basic", [HumanMessage(content="b")])
+    list(llm_module.llm("basic", [HumanMessage(content="a")], stream=True))
+    assert fake_model.calls == 3
+
+
+def test_calls_are_recorded_in_run_metrics(fake_model):
+    with collect() as metrics:
+        list(llm_module.llm("basic", [HumanMessage(content="a")], stream=True))
+        list(llm_module.llm("basic", [HumanMessage(content="a")], stream=True))
+        assert asyncio.run(llm_module.allm("report", [HumanMessage(content="b")])) == "Hello"
+    first, second, third = metrics.llm_calls
+    assert first.stream and first.ttft is not None and first.ttft <= first.latency and not first.cached
+    assert first.completion_tokens > 0 and first.reasoning_tokens > 0 and first.estimated_tokens
+    assert second.cached
+    assert (third.llm_type, third.stream, third.ttft) == ("report", False, None)
+    assert metrics.summary()["llm"]["basic"]["cached"] == 1
+
+
+def test_llm_instances_share_http_clients():
+    async def instances():
+        return (llm_module._get_llm_instance("basic", streaming=True),
+                llm_module._get_llm_instance("report", max_tokens=1024))
+
+    with patch.dict(llm_module._llm_cache, clear=True):
+        basic = llm_module._get_llm_instance("basic", streaming=True)
+        report = llm_module._get_llm_instance("report", max_tokens=1024)
+    assert basic.root_client._client is report.root_client._client is llm_module._get_http_client()
+    async_basic, async_report = asyncio.run(instances())
+    assert async_basic.root_async_client._client is async_report.root_async_client._client
+    assert async_basic.root_client._client is llm_module._get_http_client()
+
+
+class _CompletionHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive connections, the ones a pooled client reuses
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"id": "1", "object": "chat.completion", "created": 0, "model": "m",
+                           "choices": [{"index": 0, "finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": "Hello"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_async_calls_work_across_event_loops():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _CompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1"
+    config = llm_module.llm_configs["basic"]
+    endpoint = dataclasses.replace(config.endpoints[0], base_url=url, api_base=url, api_key="key")
+    try:
+        with patch.dict(llm_module.llm_configs, {"basic": dataclasses.replace(config, endpoints=[endpoint])}), \
+                patch.dict(llm_module._llm_admissions, clear=True), patch.dict(llm_module._endpoints, clear=True), \
+                patch.object(llm_module, "_get_response_cache", return_value=None), collect() as metrics:
+            # Every asyncio.run is a new loop, the connections of the previous one are unusable
+            answers = [asyncio.run(llm_module.allm("basic", [HumanMessage(content=f"q{i}")], raise_errors=True))
+                       for i in range(3)]
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert answers == ["Hello"] * 3
+    # Not even a retried failure
+    assert [call.retries for call in metrics.llm_calls] == [0, 0, 0]
+
+
+def test_rate_limited_calls_are_queued_again(fake_model):
+    error = openai.RateLimitError("Too Many Requests", body=None, response=httpx.Response(
+        429, headers={"retry-after": "0.05"}, request=httpx.Request("POST", "https://llm.test/v1")))
+    invoke, rejected = fake_model.invoke, []
+
+    def flaky_invoke(messages):
+        if not rejected:
+            rejected.append(error)
+            raise error
+        return invoke(messages)
+
+    fake_model.invoke = flaky_invoke
+    with patch.dict(llm_module._llm_admissions, clear=True), \
+            patch.dict(llm_module._endpoints, clear=True), collect() as metrics:
+        assert asyncio.run(llm_module.allm("basic", [HumanMessage(content="c")])) == "Hello"
+    call, = metrics.llm_calls
+    assert call.ok and call.queue_wait >= 0.05
+
+
+def test_transient_errors_are_retried_before_the_stream_starts(fake_model):
+    chunks, failures = fake_model._chunks, []
+
+    def flaky_chunks():
+        if len(failures) < 2:
+            failures.append(1)
+            raise openai.APIConnectionError(request=httpx.Request("POST", "https://llm.test/v1"))
+        return chunks()
+
+    fake_model._chunks = flaky_chunks
+    admission = make_admission(retry=llm_module._RetryPolicy(max_attempts=3, base_delay=0.01))
+
+    async def stream(text):
+        return [chunk async for chunk in llm_module.allm("basic", [HumanMessage(content=text)], stream=True)]
+
+    with patch.dict(llm_module._llm_admissions, {"basic": admission}), collect() as metrics:
+        assert asyncio.run(stream("d")) == [("think", ""), ("", "Hel"), ("", "lo")]
+        failures.clear()
+        admission.retry.max_attempts = 2
+        assert asyncio.run(stream("f")) == []
+    assert [(call.retries, call.ok) for call in metrics.llm_calls] == [(2, True), (1, False)]
+
+
+def test_stragglers_are_hedged(fake_model):
+    calls = []
+
+    async def ainvoke(messages):
+        calls.append(messages)
+        # The first request is a straggler, its duplicate answers right away
+        await asyncio.sleep(1 if len(calls) == 1 else 0)
+        return SimpleNamespace(content=f"answer {len(calls)}", additional_kwargs={})
+
+    fake_model.ainvoke = ainvoke
+    admission = make_admission(hedge=llm_module._HedgePolicy(enabled=True, min_samples=3))
+    for latency in (0.01, 0.02, 0.03):
+        admission.observe(latency)
+
+    with patch.dict(llm_module._llm_admissions, {"basic": admission}), collect() as metrics:
+        start = time.monotonic()
+        assert asyncio.run(llm_module.allm("basic", [HumanMessage(content="e")])) == "answer 2"
+        assert time.monotonic() - start < 0.5
+    assert metrics.llm_calls[0].hedged and admission.semaphore.try_acquire() and admission.semaphore.try_acquire()
+
+
+def test_router_spreads_calls_by_policy():
+    endpoints = [(Endpoint(name, llm_module.RateLimiter()), weight) for name, weight in (("a", 3), ("b", 1))]
+    router = EndpointRouter(endpoints, "weighted_round_robin")
+    picks = [router.pick() for _ in range(8)]
+    assert picks.count(0) == 6 and picks.count(1) == 2 and picks[:4] != [0, 0, 0, 1]
+
+    router = EndpointRouter(endpoints, "least_outstanding")
+    a, b = router.endpoints
+    a.outstanding = b.outstanding = 0
+    # Requests in flight count relative to the weights: three on a weigh as much as one on b
+    assert [router.pick() for _ in range(4)] == [0, 1, 0, 0]
+    a.end(0.1, False)
+    assert router.pick() == 0
+    b.end(0.1, False)
+    assert router.pick() == 1
+
+
+def test_closing_a_stream_left_early_releases_its_slot(fake_model):
+    admission = make_admission()
+
+    def released():
+        free = [admission.semaphore.try_acquire() for _ in range(2)]
+        for acquired in free:
+            if acquired:
+                admission.semaphore.release()
+        return admission.router.endpoints[0].outstanding == 0 and all(free)
+
+    async def consume():
+        async with contextlib.aclosing(llm_module.allm("basic", [HumanMessage(content="s")], stream=True)) as stream:
+            async for _ in stream:
+                break
+        return released()
+
+    with patch.dict(llm_module._llm_admissions, {"basic": admission}):
+        assert asyncio.run(consume())
+        with contextlib.closing(llm_module.llm("basic", [HumanMessage(content="t")], stream=True)) as stream:
+            next(stream)
+        assert released()
+
+
+def test_requests_never_sent_are_not_counted_as_calls():
+    admission = make_admission(endpoints=2)
+    primary, other = admission.router.endpoints
+    other.limiter = llm_module.RateLimiter(requests_per_minute=1)
+    other.limiter.acquire()
+    # No rate budget is left on the other endpoint, the hedge is refused
+    assert admission._try_hedge(0) is None
+
+    primary.limiter = llm_module.RateLimiter(requests_per_minute=1)
+    primary.limiter.acquire()
+
+    async def cancelled_acquire():
+        async with admission.aenter([HumanMessage(content="a")], llm_module._CallMetrics("basic", [], False), [1]):
+            pass
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(cancelled_acquire(), 0.05))
+    for endpoint in (primary, other):
+        assert (endpoint.stats()["calls"], endpoint.outstanding) == (0, 0)
+
+
+def test_failing_endpoint_is_ejected_and_calls_fail_over(fake_model):
+    class Broken:
+        async def ainvoke(self, messages):
+            raise openai.APIConnectionError(request=httpx.Request("POST", "https://broken.test/v1"))
+
+    admission = make_admission(endpoints=2, retry=llm_module._RetryPolicy(max_attempts=2, base_delay=0))
+    broken, healthy = admission.router.endpoints
+    with patch.dict(llm_module._llm_admissions, {"basic": admission}), \
+            patch.object(llm_module, "_get_llm_instance",
+                         lambda llm_type, streaming=False, *args, endpoint=0, **kwargs: Broken() if endpoint == 0 else fake_model):
+        answers = [asyncio.run(llm_module.allm("basic", [HumanMessage(content=f"q{i}")])) for i in range(6)]
+    assert answers == ["Hello"] * 6
+    assert broken.failures == Endpoint.EJECTION_FAILURES and not broken.available(time.monotonic())
+    assert healthy.stats()["calls"] == 6 and healthy.stats()["p95"] >= 0
+
+
+def test_batch_keeps_order_and_reports_errors_per_item(fake_model):
+    def invoke(messages):
+        text = messages[-1].content
+        if text == "bad":
+            raise ValueError("bad prompt")
+        time.sleep(0.05 if text == "slow" else 0)
+        return SimpleNamespace(content=text.upper(), additional_kwargs={})
+
+    fake_model.invoke = invoke
+    batch = [[HumanMessage(content=text)] for text in ("slow", "bad", "fast")]
+    with patch.dict(llm_module._llm_admissions, {"basic": make_admission()}):
+        results = llm_module.llm_batch("basic", batch)
+        aresults = asyncio.run(llm_module.allm_batch("basic", batch, max_concurrency=3))
+    for outcomes in (results, aresults):
+        assert [outcome.value for outcome in outcomes] == ["SLOW", None, "FAST"]
+        assert isinstance(outcomes[1].error, ValueError)
@@ -0,0 +1,39 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+
+"""
+Explanation of Included Variables:
+- chapter: The chapter, with a <chart id="..."/> mark where each chart goes
+- charts: The charts to generate, each with its id and description
+- reference: Reference knowledge
+"""
+
+SYSTEM_PROMPT = '''Read the following reference materials carefully and generate one ECharts graph for each of the requested charts, based on its description and on the part of the chapter where it is placed:
+**Automatically detect the user's primary language and ensure all responses are in that language.**
+
+## Output Content
+### Statistical Charts
+- For every requested chart, generate the JSON configuration required for drawing an ECharts graph based on its description. Ensure that the data in each chart is strictly derived from the reference materials; do not fabricate data. You may attempt to correctly label key nodes in the graph.
+- Each chart is generated independently, do not merge charts or leave one out.
+- You will use the following tool, once per chart, inside a <chart> element carrying the id of the requested chart
+**Tool**
+<chart id="chart id">
+<echarts> Generate an HTML chart page based on the ECharts JSON configuration
+	<input_schema>ECharts JSON configuration object</input_schema>
+</echarts>
+</chart>
+
+**Tool Call Details**
+	1. Please use the above tool to generate an ECharts graph for every requested chart, in the order of their ids. Write its name and parameters in the XML format specified above.
+	2. All parameters are mandatory unless otherwise stated.
+	3. You only need to call the above tool.
+	4. You only need to provide the parameters required for the tool calls; no explanatory notes are needed.'''
+
+PROMPT = '''## Requested Charts
+{charts}
+
+## Chapter
+{chapter}
+
+## Reference Materials
+{reference}'''
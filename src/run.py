@@ -13,10 +13,15 @@
 #     print(chunk, end="", flush=True)
 # print()
 import asyncio
+import contextlib
+import os
+from datetime import datetime
 from typing import List, Union
 from langgraph.types import Command
 
 from src.agent.agent import build_agent
+from src.config.workflow_config import workflow_configs
+from src.utils import metrics
 from langchain.schema import HumanMessage, AIMessage
 
 graph = build_agent()
@@ -54,16 +59,25 @@ async def call_agent(
             "save_path": "./example/report"
         }
     }
+    metrics_options = workflow_configs.get("metrics", {})
     output = ""
-    for message in graph.stream(
-        input=state, config=config, stream_mode="values"
-    ):
-        if isinstance(message, Command):
-            message = message.update
-        if isinstance(message, dict) and "messages" in message:
-            if "output" in message and isinstance(message["output"], dict):
-                if "message" in message["output"]:
-                    output = message["output"]["message"]
+    with metrics.collect() if metrics_options.get("enabled", True) else contextlib.nullcontext() as run_metrics:
+        try:
+            async for message in graph.astream(
+                input=state, config=config, stream_mode="values"
+            ):
+                if isinstance(message, Command):
+                    message = message.update
+                if isinstance(message, dict) and "messages" in message:
+                    if "output" in message and isinstance(message["output"], dict):
+                        if "message" in message["output"]:
+                            output = message["output"]["message"]
+        finally:
+            if run_metrics is not None:
+                path = os.path.join(metrics_options.get("output_dir", "./example/metrics"),
+                                    f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+                run_metrics.save(path, prometheus=metrics_options.get("prometheus", False))
+                print(f"Run metrics saved to {path}")
     messages.append(AIMessage(content=output))
     return messages
 
@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: Apache 2.0 License
 
 from typing import *
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 @dataclass(kw_only=True)
 class SearchResult:
@@ -13,6 +13,10 @@ class SearchResult:
     content: str
     date: str = ""
     id: int = 0
+    # URLs of near-duplicate pages that were merged into this result
+    alternate_urls: List[str] = field(default_factory=list)
+    # SimHash of the content, computed on first use
+    fingerprint: Optional[int] = None
 
 class SearchClient:
     """Base class for search clients"""
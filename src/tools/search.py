@@ -3,25 +3,70 @@
 
 from typing import *
 import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from functools import lru_cache
 
 from src.config.search_config import search_config
+from src.config.workflow_config import workflow_configs
 from src.tools import _search
 from src.tools._jina import JinaSearchClient
 from src.tools._tavily import TavilySearchClient
+from src.utils.concurrency import TaskResult, amap_ordered, map_ordered
+from src.utils.disk_cache import CacheStats, DiskCache
+from src.utils.metrics import SearchRecord, elapsed_since, record
 
 SearchResult = _search.SearchResult
 
+logger = logging.getLogger(__name__)
+
+
+# Fields of SearchResult stored in the cache, the other ones are derived during a run
+_CACHED_FIELDS = ("url", "title", "summary", "content", "date", "id")
+
+
+@lru_cache(maxsize=None)
+def _open_cache(path: str, ttl: int, max_bytes: int) -> Optional[DiskCache]:
+    try:
+        return DiskCache(path, ttl=ttl, max_bytes=max_bytes)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Failed to open search cache {path}, searching without cache: {e}")
+        return None
+
 
 class SearchClient:
-    """Search client factory"""
+    """Search client factory, results are cached on disk unless the cache is disabled"""
     _client: _search.SearchClient
-    def __init__(self) -> None:
+    def __init__(self, use_cache: Optional[bool] = None) -> None:
+        """
+        Args:
+            use_cache: Read and write the search cache, defaults to the [cache] section of search.toml.
+                False bypasses the cache.
+        """
         if search_config.engine == "jina":
             self._client = JinaSearchClient()
         elif search_config.engine == "tavily":
             self._client = TavilySearchClient()
         else:
             raise ValueError(f"Unknown search engine: {search_config.engine}")
+        cache_config = search_config.cache
+        self._cache: Optional[DiskCache] = None
+        if cache_config.enabled if use_cache is None else use_cache:
+            self._cache = _open_cache(cache_config.path, cache_config.ttl, cache_config.max_size_mb * 1024 * 1024)
+
+    @property
+    def cache_stats(self) -> Optional[CacheStats]:
+        """Hit and miss counters of the search cache, None when it is bypassed"""
+        return self._cache.stats if self._cache is not None else None
+
+    @staticmethod
+    def cache_key(query: str, top_n: int) -> str:
+        """Cache key of a search, queries differing only by case or whitespace share it"""
+        normalized = " ".join(query.split()).casefold()
+        return hashlib.sha256(f"{search_config.engine}\x00{normalized}\x00{top_n}".encode("utf-8")).hexdigest()
 
     def search(self, query: str, top_n: int) -> List[SearchResult]:
         """
@@ -34,7 +79,100 @@ class SearchClient:
         Returns:
             List of SearchResult objects containing search information
         """
-        return self._client.search(query, top_n)
+        perf_start, outcome = time.perf_counter(), SearchRecord(query=query, start=0.0, latency=0.0, ok=False)
+        try:
+            results = self._search(query, top_n, outcome)
+            outcome.results, outcome.ok = len(results), True
+            return results
+        finally:
+            outcome.start, outcome.latency = elapsed_since(perf_start)
+            record(outcome)
+
+    def _search(self, query: str, top_n: int, outcome: SearchRecord) -> List[SearchResult]:
+        if self._cache is None:
+            return self._client.search(query, top_n)
+
+        key = self.cache_key(query, top_n)
+        try:
+            cached = self._cache.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read search cache: {e}")
+            cached = None
+        if cached is not None:
+            logger.debug(f"search cache hit for '{query}'")
+            outcome.cached = True
+            return [SearchResult(**item) for item in json.loads(cached)]
+
+        results = self._client.search(query, top_n)
+        # Empty results are usually transient failures of the engine and are not cached
+        if results:
+            value = [{name: getattr(result, name) for name in _CACHED_FIELDS} for result in results]
+            try:
+                self._cache.set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write search cache: {e}")
+        return results
+
+
+class SearchExecutor:
+    """Run a group of search queries concurrently with bounded parallelism"""
+    def __init__(self, client: Optional[SearchClient] = None,
+                 max_concurrency: Optional[int] = None,
+                 timeout: Optional[float] = None) -> None:
+        search_options = workflow_configs.get("search", {})
+        self._client = client or SearchClient()
+        self._max_concurrency = max_concurrency or search_options.get("max_concurrency", 5)
+        self._timeout = timeout or search_options.get("query_timeout", 60)
+
+    def search_all(self, queries: List[str], top_n: int) -> Dict[str, List[SearchResult]]:
+        """
+        Search all queries at once
+
+        Args:
+            queries: Search query strings, duplicates are searched only once
+            top_n: Number of results to retrieve for each query
+
+        Returns:
+            Dictionary mapping every query to its results, in the order of queries.
+            A query that fails or times out maps to an empty list.
+        """
+        queries = list(dict.fromkeys(queries))
+        outcomes = map_ordered(lambda q: self._client.search(q, top_n),
+                               queries,
+                               max_workers=self._max_concurrency,
+                               timeout=self._timeout)
+        return self._collect(queries, outcomes)
+
+    async def asearch_all(self, queries: List[str], top_n: int) -> Dict[str, List[SearchResult]]:
+        """
+        Asynchronous counterpart of search_all, the blocking search clients run in worker threads
+
+        Args:
+            queries: Search query strings, duplicates are searched only once
+            top_n: Number of results to retrieve for each query
+
+        Returns:
+            Dictionary mapping every query to its results, in the order of queries.
+            A query that fails or times out maps to an empty list.
+        """
+        queries = list(dict.fromkeys(queries))
+        outcomes = await amap_ordered(lambda q: asyncio.to_thread(self._client.search, q, top_n),
+                                      queries,
+                                      max_concurrency=self._max_concurrency,
+                                      timeout=self._timeout)
+        return self._collect(queries, outcomes)
+
+    @staticmethod
+    def _collect(queries: List[str], outcomes: List[TaskResult]) -> Dict[str, List[SearchResult]]:
+        search_results: Dict[str, List[SearchResult]] = {}
+        for query, outcome in zip(queries, outcomes):
+            if outcome.ok:
+                search_results[query] = outcome.value or []
+                logger.info(f"search '{query}' took {outcome.elapsed:.2f}s, {len(search_results[query])} results")
+            else:
+                search_results[query] = []
+                logger.warning(f"search '{query}' failed after {outcome.elapsed:.2f}s: {outcome.error}")
+        return search_results
 
 if __name__ == "__main__":
     # Example usage
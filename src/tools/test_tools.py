@@ -0,0 +1,92 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import asyncio
+import time
+from typing import List
+from unittest.mock import patch
+
+from src.config.search_config import SearchCacheConfig, search_config
+from . import search
+from .search import SearchExecutor, SearchResult
+from ._search import SearchClient
+
+
+class FakeSearchClient(SearchClient):
+    def __init__(self, delays=None, failures=()):
+        self.delays = delays or {}
+        self.failures = set(failures)
+        self.calls: List[str] = []
+
+    def search(self, query: str, top_n: int) -> List[SearchResult]:
+        self.calls.append(query)
+        time.sleep(self.delays.get(query, 0))
+        if query in self.failures:
+            raise RuntimeError("search backend down")
+        return [SearchResult(url=f"https://{query}/{i}", title=query, summary="", content=f"{query} {i}")
+                for i in range(top_n)]
+
+
+def test_search_executor_runs_queries_concurrently_in_order():
+    client = FakeSearchClient(delays={"a": 0.3, "b": 0.2, "c": 0.1})
+    executor = SearchExecutor(client=client, max_concurrency=3, timeout=5)
+    start = time.monotonic()
+    results = executor.search_all(["a", "b", "c", "a"], 2)
+    assert time.monotonic() - start < 0.55
+    assert list(results.keys()) == ["a", "b", "c"]
+    assert [r.url for r in results["b"]] == ["https://b/0", "https://b/1"]
+    assert sorted(client.calls) == ["a", "b", "c"]
+
+
+def test_search_executor_tolerates_partial_failures():
+    client = FakeSearchClient(delays={"slow": 1}, failures={"bad"})
+    executor = SearchExecutor(client=client, max_concurrency=3, timeout=0.2)
+    results = executor.search_all(["good", "bad", "slow"], 1)
+    assert len(results["good"]) == 1
+    assert results["bad"] == []
+    assert results["slow"] == []
+
+
+def test_search_executor_async_matches_sync():
+    client = FakeSearchClient(delays={"a": 0.2, "b": 0.1, "slow": 1})
+    executor = SearchExecutor(client=client, max_concurrency=3, timeout=0.5)
+
+    async def timed_search():
+        start = time.monotonic()
+        results = await executor.asearch_all(["a", "b", "slow"], 2)
+        return time.monotonic() - start, results
+
+    elapsed, results = asyncio.run(timed_search())
+    assert elapsed < 0.8
+    assert list(results.keys()) == ["a", "b", "slow"]
+    assert [r.url for r in results["a"]] == ["https://a/0", "https://a/1"]
+    assert results["slow"] == []
+
+
+def test_search_cache_is_disabled_by_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with patch.object(search_config, "cache", SearchCacheConfig.from_dict({})), \
+            patch.object(search, "TavilySearchClient", FakeSearchClient), \
+            patch.object(search, "JinaSearchClient", FakeSearchClient):
+        client = search.SearchClient()
+        client.search("solid state batteries", 2)
+    assert client.cache_stats is None
+    assert not any(tmp_path.iterdir())
+
+
+def test_search_client_caches_results(tmp_path):
+    backend = FakeSearchClient()
+    cache_config = SearchCacheConfig(enabled=True, path=str(tmp_path / "search.sqlite"))
+    with patch.object(search_config, "cache", cache_config), \
+            patch.object(search, "TavilySearchClient", return_value=backend), \
+            patch.object(search, "JinaSearchClient", return_value=backend):
+        client = search.SearchClient()
+        first = client.search("Solid state  batteries", 2)
+        second = client.search("solid state batteries", 2)
+        client.search("solid state batteries", 3)
+        search.SearchClient(use_cache=False).search("solid state batteries", 2)
+
+    assert [r.url for r in second] == [r.url for r in first]
+    assert second[0] is not first[0]
+    assert backend.calls == ["Solid state  batteries", "solid state batteries", "solid state batteries"]
+    assert (client.cache_stats.hits, client.cache_stats.misses) == (1, 2)
+
@@ -0,0 +1,301 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, Generic, List, Optional, Sequence, TypeVar, Union
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+@dataclass(kw_only=True)
+class TaskResult(Generic[R]):
+    """Outcome of a single task run by map_ordered or amap_ordered"""
+    value: Optional[R] = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def map_ordered(fn: Callable[[T], R],
+                items: Sequence[T],
+                max_workers: int,
+                timeout: Optional[float] = None) -> List[TaskResult[R]]:
+    """
+    Run fn over items on a bounded thread pool and return the outcomes in input order
+
+    Args:
+        fn: Function applied to every item
+        items: Items to process
+        max_workers: Maximum number of items processed at the same time
+        timeout: Per-item time limit in seconds, counted from the moment the item starts running
+
+    Returns:
+        One TaskResult per item, in the same order as items. Exceptions raised by fn and
+        timeouts are reported through TaskResult.error instead of being raised.
+    """
+    results: List[TaskResult[R]] = [TaskResult() for _ in items]
+    if not items:
+        return results
+
+    started: Dict[int, float] = {}
+
+    def _run(idx: int, item: T) -> R:
+        started[idx] = time.monotonic()
+        try:
+            return fn(item)
+        finally:
+            results[idx].elapsed = time.monotonic() - started[idx]
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    # Every item runs in a copy of the caller context, like asyncio.to_thread, so context variables
+    # (e.g. the run metrics collector) are visible in the worker threads
+    futures = {executor.submit(contextvars.copy_context().run, _run, idx, item): idx
+               for idx, item in enumerate(items)}
+    pending = set(futures)
+    try:
+        while pending:
+            wait_time = None
+            if timeout is not None:
+                deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+                wait_time = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+            done, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = futures[future]
+                try:
+                    results[idx].value = future.result()
+                except Exception as e:
+                    results[idx].error = e
+
+            if timeout is None:
+                continue
+            now = time.monotonic()
+            for future in list(pending):
+                idx = futures[future]
+                if idx in started and now - started[idx] >= timeout:
+                    # The worker thread cannot be interrupted, we only stop waiting for it
+                    pending.discard(future)
+                    results[idx].error = TimeoutError(f"task timed out after {timeout}s")
+                    results[idx].elapsed = now - started[idx]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+async def amap_ordered(fn: Callable[[T], Awaitable[R]],
+                       items: Sequence[T],
+                       max_concurrency: int,
+                       timeout: Optional[float] = None) -> List[TaskResult[R]]:
+    """
+    Await fn over items with bounded concurrency and return the outcomes in input order
+
+    Args:
+        fn: Coroutine function applied to every item
+        items: Items to process
+        max_concurrency: Maximum number of items processed at the same time
+        timeout: Per-item time limit in seconds, counted from the moment the item starts running
+
+    Returns:
+        One TaskResult per item, in the same order as items. Exceptions raised by fn and
+        timeouts are reported through TaskResult.error instead of being raised.
+    """
+    results: List[TaskResult[R]] = [TaskResult() for _ in items]
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _run(idx: int, item: T) -> None:
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                results[idx].value = await asyncio.wait_for(fn(item), timeout)
+            except asyncio.TimeoutError:
+                results[idx].error = TimeoutError(f"task timed out after {timeout}s")
+            except Exception as e:
+                results[idx].error = e
+            finally:
+                results[idx].elapsed = time.monotonic() - start
+
+    await asyncio.gather(*(_run(idx, item) for idx, item in enumerate(items)))
+    return results
+
+
+class HybridSemaphore:
+    """
+    Counting semaphore that can be shared by threads ("with") and coroutines ("async with"),
+    even when the coroutines run on different event loops. Waiters are served in FIFO order.
+    """
+    def __init__(self, value: int):
+        self._value = max(1, value)
+        self._lock = threading.Lock()
+        self._waiters: Deque[Union[threading.Event, asyncio.Future]] = deque()
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    def try_acquire(self) -> bool:
+        """Take a permit if one is free right away, without waiting"""
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return True
+            return False
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+            future = loop.create_future()
+            self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+                    raise
+            # The permit was handed over while the waiter was being cancelled
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                try:
+                    waiter.get_loop().call_soon_threadsafe(self._wake, waiter)
+                    return
+                except RuntimeError:
+                    # The event loop of the waiter is closed
+                    continue
+            self._value += 1
+
+    def _wake(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def __enter__(self) -> "HybridSemaphore":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    async def __aenter__(self) -> "HybridSemaphore":
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class RateLimiter:
+    """
+    Token buckets limiting the requests and the tokens sent per minute, shared by threads and
+    coroutines. A call reserves its share up front and waits until the buckets can afford it,
+    so the callers are queued in arrival order instead of being rejected. The buckets hold
+    BURST_SECONDS worth of their rate, a limit of 0 means unlimited.
+    """
+    BURST_SECONDS = 10
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self._request_rate = requests_per_minute / 60
+        self._token_rate = tokens_per_minute / 60
+        self._request_capacity = max(1.0, self._request_rate * self.BURST_SECONDS)
+        self._token_capacity = self._token_rate * self.BURST_SECONDS
+        self._requests = self._request_capacity
+        self._tokens = self._token_capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def limits_tokens(self) -> bool:
+        return self._token_rate > 0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self._request_capacity, self._requests + elapsed * self._request_rate)
+        self._tokens = min(self._token_capacity, self._tokens + elapsed * self._token_rate)
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Take one request and tokens from the buckets, which may go into debt
+
+        Args:
+            tokens: Tokens the call is expected to consume
+
+        Returns:
+            Seconds to wait before the call may be sent
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            delay = max(0.0, self._paused_until - now)
+            if self._request_rate > 0:
+                self._requests -= 1
+                delay = max(delay, -self._requests / self._request_rate)
+            if self._token_rate > 0:
+                self._tokens -= tokens
+                delay = max(delay, -self._tokens / self._token_rate)
+            return delay
+
+    def refund(self, tokens: int = 0) -> None:
+        """Give back a reservation that was not used"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._request_rate > 0:
+                self._requests += 1
+            if self._token_rate > 0:
+                self._tokens += tokens
+
+    def consume(self, tokens: int) -> None:
+        """Charge tokens known only after the call (e.g. the completion) without waiting"""
+        if self._token_rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every call for seconds, e.g. after the server answered 429 Too Many Requests"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Wait until the call may be sent and return the time waited"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.refund(tokens)
+                raise
+        return delay
@@ -0,0 +1,78 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import re
+from typing import List, Tuple
+
+from src.utils.token_util import count_tokens, truncate_tokens
+
+# Fenced blocks (rendered charts) and citation marks carry nothing a later chapter needs
+_fence_re = re.compile(r'^```.*?^```[^\n]*$', re.MULTILINE | re.DOTALL)
+_citation_re = re.compile(r' *\[\^[^\[\]]*\]')
+# A sentence ends with latin punctuation followed by a space, or with CJK punctuation
+_sentence_re = re.compile(r'.+?(?:[.!?](?=\s)|[。！？])')
+_list_marker_re = re.compile(r'^(?:[-*+]|\d+[.)])\s+')
+
+
+def first_sentence(text: str) -> str:
+    """Return the first sentence of a paragraph, the whole paragraph when it has a single one"""
+    match = _sentence_re.match(text)
+    return match.group(0) if match else text
+
+
+def digest_markdown(text: str, max_tokens: int) -> str:
+    """
+    Extractive digest of a markdown report section: its headings and the first sentence of every
+    paragraph, without tables, fenced blocks and citations
+
+    Args:
+        text: Markdown text to digest
+        max_tokens: Maximum number of tokens of the digest, later lines are dropped beyond it
+
+    Returns:
+        Digest with one line per heading or paragraph, in text order
+    """
+    lines: List[str] = []
+    tokens = 0
+    for line in _fence_re.sub('', text).splitlines():
+        line = _citation_re.sub('', line).strip()
+        if not line or line.startswith('|'):
+            continue
+        if not line.startswith('#'):
+            line = first_sentence(_list_marker_re.sub('', line)).strip('* ')
+        line_tokens = count_tokens(line) + 1
+        if tokens + line_tokens > max_tokens:
+            if not lines:
+                lines.append(truncate_tokens(line, max_tokens))
+            break
+        lines.append(line)
+        tokens += line_tokens
+    return '\n'.join(lines)
+
+
+class RollingContext:
+    """
+    Context of the chapter being written: a digest of every finished chapter, made once when the
+    chapter is added, of which the most recent ones are kept up to a token budget. The prompt
+    tokens of a chapter stay bounded however long the report grows.
+    """
+    def __init__(self, token_budget: int, digest_tokens: int):
+        self.token_budget = token_budget
+        self.digest_tokens = digest_tokens
+        self._digests: List[Tuple[str, int]] = []
+
+    def add(self, chapter: str) -> None:
+        """Digest a finished chapter"""
+        digest = digest_markdown(chapter, self.digest_tokens)
+        if digest:
+            self._digests.append((digest, count_tokens(digest) + 2))
+
+    def render(self) -> str:
+        """Digests of the most recent chapters fitting in the token budget, in report order"""
+        kept: List[str] = []
+        tokens = 0
+        for digest, digest_tokens in reversed(self._digests):
+            if tokens + digest_tokens > self.token_budget:
+                break
+            kept.append(digest)
+            tokens += digest_tokens
+        return '\n\n'.join(reversed(kept))
@@ -0,0 +1,131 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(kw_only=True)
+class CacheStats:
+    """Counters of a DiskCache since it was opened"""
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class DiskCache:
+    """
+    Persistent key-value store backed by SQLite. Values are zlib-compressed bytes, entries expire
+    ttl seconds after they were written and the least recently read entries are evicted once the
+    compressed values exceed max_bytes. It can be shared by threads and processes.
+    """
+    def __init__(self, path: Union[str, Path], ttl: Optional[float] = None, max_bytes: Optional[int] = None,
+                 compress_level: int = 6):
+        self._path = Path(path)
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._compress_level = compress_level
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+        if str(path) != ":memory:":
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Read a value
+
+        Args:
+            key: Key of the entry
+
+        Returns:
+            The decompressed value, or None when the key is missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._ttl is not None and now - row[1] > self._ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.stats.hits += 1
+        try:
+            return zlib.decompress(row[0])
+        except zlib.error as e:
+            logger.warning(f"Corrupted cache entry {key} in {self._path}: {e}")
+            self.delete(key)
+            return None
+
+    def set(self, key: str, value: bytes) -> None:
+        """Write a value, replacing the previous one, then evict entries over the size limit"""
+        data = zlib.compress(value, self._compress_level)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now))
+            self.stats.writes += 1
+            self._evict(now)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def size(self) -> int:
+        """Total size of the compressed values in bytes"""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self, now: float) -> None:
+        evicted = 0
+        if self._ttl is not None:
+            evicted += self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self._ttl,)).rowcount
+        if self._max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self._max_bytes:
+                # Least recently read first, until the store fits again
+                freed = 0
+                keys = []
+                for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                    if total - freed <= self._max_bytes:
+                        break
+                    keys.append((key,))
+                    freed += size
+                self._conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+                evicted += len(keys)
+        self.stats.evictions += evicted
@@ -0,0 +1,125 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import re
+import threading
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+T = TypeVar('T')
+
+# Whitespace and punctuation are ignored so that layout differences between mirrors do not matter
+_ignored_re = re.compile(r'[\W_]+')
+_FNV_PRIME = np.uint64(1099511628211)
+
+
+def _mix64(h: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, spreads the shingle hashes over all 64 bits"""
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+def shingle_hashes(text: str, shingle_size: int) -> np.ndarray:
+    """
+    Hash the character shingles of a text, ignoring case, whitespace and punctuation
+
+    Args:
+        text: Text to hash
+        shingle_size: Number of characters of a shingle
+
+    Returns:
+        Array of 64-bit hashes, one per shingle in text order. A text shorter than a shingle
+        yields a single hash, an empty text none.
+    """
+    normalized = _ignored_re.sub('', text.lower())
+    if not normalized:
+        return np.zeros(0, dtype=np.uint64)
+    codes = np.frombuffer(normalized.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    shingle_size = min(shingle_size, len(codes))
+    hashes = np.zeros(len(codes) - shingle_size + 1, dtype=np.uint64)
+    for j in range(shingle_size):
+        hashes = hashes * _FNV_PRIME + codes[j:j + len(hashes)]
+    return _mix64(hashes)
+
+
+def simhash(text: str, shingle_size: int = 5) -> int:
+    """
+    Compute the 64-bit SimHash of a text over its character shingles
+
+    Args:
+        text: Text to fingerprint
+        shingle_size: Number of characters of a shingle
+
+    Returns:
+        Fingerprint whose Hamming distance to the fingerprint of another text grows with
+        the share of shingles the texts do not have in common
+    """
+    hashes = shingle_hashes(text, shingle_size)
+    fingerprint = 0
+    half = len(hashes) / 2
+    for bit in range(64):
+        if np.count_nonzero((hashes >> np.uint64(bit)) & np.uint64(1)) > half:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class NearDuplicateIndex(Generic[T]):
+    """
+    SimHash index finding items whose fingerprints differ by at most max_distance bits.
+    Fingerprints are split into max_distance + 1 bands, two fingerprints within the distance
+    share at least one band, so a lookup only compares the items of a few buckets.
+    """
+    def __init__(self, max_distance: int = 3):
+        self._max_distance = max_distance
+        self._bands = max_distance + 1
+        self._band_bits = 64 // self._bands
+        # Bucket entries are (insertion order, fingerprint, item)
+        self._buckets: Dict[Tuple[int, int], List[Tuple[int, int, T]]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _band_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        keys = []
+        for band in range(self._bands):
+            bits = self._band_bits if band < self._bands - 1 else 64 - self._band_bits * band
+            keys.append((band, (fingerprint >> (band * self._band_bits)) & ((1 << bits) - 1)))
+        return keys
+
+    def __len__(self) -> int:
+        return self._size
+
+    def find(self, fingerprint: int) -> Optional[T]:
+        """Return the earliest added item that is a near-duplicate of the fingerprint, or None"""
+        with self._lock:
+            return self._find(fingerprint)
+
+    def add(self, fingerprint: int, item: T) -> None:
+        """Add an item to the index"""
+        with self._lock:
+            self._add(fingerprint, item)
+
+    def find_or_add(self, fingerprint: int, item: T) -> Optional[T]:
+        """Return the near-duplicate of the fingerprint, the item is added when there is none"""
+        with self._lock:
+            duplicate = self._find(fingerprint)
+            if duplicate is None:
+                self._add(fingerprint, item)
+            return duplicate
+
+    def _find(self, fingerprint: int) -> Optional[T]:
+        best: Optional[Tuple[int, int, T]] = None
+        for key in self._band_keys(fingerprint):
+            for entry in self._buckets.get(key, ()):
+                if (entry[1] ^ fingerprint).bit_count() <= self._max_distance:
+                    if best is None or entry[0] < best[0]:
+                        best = entry
+                    # Entries of a bucket are in insertion order, the first match is the earliest one
+                    break
+        return best[2] if best else None
+
+    def _add(self, fingerprint: int, item: T) -> None:
+        entry = (self._size, fingerprint, item)
+        self._size += 1
+        for key in self._band_keys(fingerprint):
+            self._buckets.setdefault(key, []).append(entry)
@@ -0,0 +1,286 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+
+@dataclass(kw_only=True)
+class NodeRecord:
+    """One run of a graph node"""
+    name: str
+    start: float
+    wall: float
+    ok: bool = True
+
+
+@dataclass(kw_only=True)
+class DepthRecord:
+    """One depth level of a DeepSearch"""
+    chapter: str
+    depth: int
+    start: float
+    wall: float
+    queries: int = 0
+    results: int = 0
+    knowledge: int = 0
+
+
+@dataclass(kw_only=True)
+class LLMRecord:
+    """One LLM call"""
+    llm_type: str
+    # Endpoint of the last attempt, empty for calls served from the response cache
+    endpoint: str = ""
+    stream: bool
+    start: float
+    # Time spent waiting for the rate and concurrency limits before the request was sent
+    queue_wait: float = 0.0
+    # Time from sending the request to the end of the response
+    latency: float
+    # Time from sending the request to the first streamed chunk, None for non-streaming calls
+    ttft: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_tokens: int = 0
+    # Token counts come from the API usage when available, they are estimated otherwise
+    estimated_tokens: bool = True
+    # Attempts made after failures, and whether a duplicate request was sent for a straggler
+    retries: int = 0
+    hedged: bool = False
+    cached: bool = False
+    ok: bool = True
+
+
+@dataclass(kw_only=True)
+class SearchRecord:
+    """One search call"""
+    query: str
+    start: float
+    latency: float
+    results: int = 0
+    cached: bool = False
+    ok: bool = True
+
+
+def _quantiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0, "total": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    array = np.asarray(values, dtype=np.float64)
+    return {"count": len(values), "total": float(array.sum()), "p50": float(np.percentile(array, 50)),
+            "p95": float(np.percentile(array, 95)), "max": float(array.max())}
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@dataclass(kw_only=True)
+class RunMetrics:
+    """Timings and token accounting of a run, filled by the instrumented nodes and calls"""
+    started: float = field(default_factory=time.time)
+    nodes: List[NodeRecord] = field(default_factory=list)
+    depths: List[DepthRecord] = field(default_factory=list)
+    llm_calls: List[LLMRecord] = field(default_factory=list)
+    searches: List[SearchRecord] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, record: Union[NodeRecord, DepthRecord, LLMRecord, SearchRecord]) -> None:
+        target = {NodeRecord: self.nodes, DepthRecord: self.depths,
+                  LLMRecord: self.llm_calls, SearchRecord: self.searches}[type(record)]
+        with self._lock:
+            target.append(record)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Aggregate the records
+
+        Returns:
+            JSON-serializable dictionary with per node, per LLM type and search aggregates,
+            followed by the raw records
+        """
+        with self._lock:
+            nodes, depths = list(self.nodes), list(self.depths)
+            llm_calls, searches = list(self.llm_calls), list(self.searches)
+
+        node_summary = {}
+        for name in dict.fromkeys(r.name for r in nodes):
+            records = [r for r in nodes if r.name == name]
+            node_summary[name] = {**_quantiles([r.wall for r in records]),
+                                  "failures": sum(not r.ok for r in records)}
+
+        llm_summary = {}
+        for llm_type in dict.fromkeys(r.llm_type for r in llm_calls):
+            records = [r for r in llm_calls if r.llm_type == llm_type]
+            llm_summary[llm_type] = {
+                "queue_wait": _quantiles([r.queue_wait for r in records]),
+                "latency": _quantiles([r.latency for r in records]),
+                "ttft": _quantiles([r.ttft for r in records if r.ttft is not None]),
+                "prompt_tokens": sum(r.prompt_tokens for r in records),
+                "completion_tokens": sum(r.completion_tokens for r in records),
+                "reasoning_tokens": sum(r.reasoning_tokens for r in records),
+                "retries": sum(r.retries for r in records),
+                "hedged": sum(r.hedged for r in records),
+                "cached": sum(r.cached for r in records),
+                "failures": sum(not r.ok for r in records),
+            }
+
+        endpoint_summary = {}
+        for endpoint in dict.fromkeys(r.endpoint for r in llm_calls if r.endpoint):
+            records = [r for r in llm_calls if r.endpoint == endpoint]
+            endpoint_summary[endpoint] = {"latency": _quantiles([r.latency for r in records if r.ok]),
+                                          "failures": sum(not r.ok for r in records)}
+
+        return {
+            "started": self.started,
+            "wall": time.time() - self.started,
+            "nodes": node_summary,
+            "llm": llm_summary,
+            "endpoints": endpoint_summary,
+            "search": {**_quantiles([r.latency for r in searches]),
+                       "cached": sum(r.cached for r in searches),
+                       "failures": sum(not r.ok for r in searches)},
+            "records": {
+                "nodes": [asdict(r) for r in nodes],
+                "depths": [asdict(r) for r in depths],
+                "llm_calls": [asdict(r) for r in llm_calls],
+                "searches": [asdict(r) for r in searches],
+            },
+        }
+
+    def to_prometheus(self, prefix: str = "deepresearch") -> str:
+        """Render the aggregates in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines: List[str] = []
+
+        def labels(**values: Any) -> str:
+            return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in values.items()) + "}"
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def timing(name: str, help_text: str, stats: Dict[str, Dict[str, float]], label: str) -> None:
+            header(name, "summary", help_text)
+            for key, values in stats.items():
+                lines.append(f"{prefix}_{name}{labels(**{label: key}, quantile='0.5')} {values['p50']}")
+                lines.append(f"{prefix}_{name}{labels(**{label: key}, quantile='0.95')} {values['p95']}")
+                lines.append(f"{prefix}_{name}_sum{labels(**{label: key})} {values['total']}")
+                lines.append(f"{prefix}_{name}_count{labels(**{label: key})} {values['count']}")
+
+        timing("node_seconds", "Wall time of graph nodes", summary["nodes"], "node")
+        timing("llm_latency_seconds", "Latency of LLM calls",
+               {k: v["latency"] for k, v in summary["llm"].items()}, "llm_type")
+        timing("llm_queue_wait_seconds", "Time LLM calls waited for the rate and concurrency limits",
+               {k: v["queue_wait"] for k, v in summary["llm"].items()}, "llm_type")
+        timing("llm_ttft_seconds", "Time to first token of streamed LLM calls",
+               {k: v["ttft"] for k, v in summary["llm"].items()}, "llm_type")
+        header("llm_tokens_total", "counter", "Tokens of LLM calls")
+        for llm_type, values in summary["llm"].items():
+            for kind in ("prompt", "completion", "reasoning"):
+                lines.append(f"{prefix}_llm_tokens_total{labels(llm_type=llm_type, kind=kind)} {values[kind + '_tokens']}")
+        header("llm_retries_total", "counter", "Attempts of LLM calls made after failures")
+        for llm_type, values in summary["llm"].items():
+            lines.append(f"{prefix}_llm_retries_total{labels(llm_type=llm_type)} {values['retries']}")
+        header("llm_hedged_total", "counter", "LLM calls for which a duplicate request was sent")
+        for llm_type, values in summary["llm"].items():
+            lines.append(f"{prefix}_llm_hedged_total{labels(llm_type=llm_type)} {values['hedged']}")
+        header("llm_failures_total", "counter", "Failed LLM calls")
+        for llm_type, values in summary["llm"].items():
+            lines.append(f"{prefix}_llm_failures_total{labels(llm_type=llm_type)} {values['failures']}")
+        timing("llm_endpoint_latency_seconds", "Latency of successful LLM calls per endpoint",
+               {k: v["latency"] for k, v in summary["endpoints"].items()}, "endpoint")
+        timing("search_latency_seconds", "Latency of search calls", {"all": summary["search"]}, "engine")
+        header("search_failures_total", "counter", "Failed search calls")
+        lines.append(f"{prefix}_search_failures_total {summary['search']['failures']}")
+        header("run_seconds", "gauge", "Wall time of the run so far")
+        lines.append(f"{prefix}_run_seconds {summary['wall']}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path: Union[str, Path], prometheus: bool = False) -> None:
+        """Write the JSON summary, and the Prometheus metrics next to it (.prom) when asked"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        if prometheus:
+            with open(path.with_suffix(".prom"), "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+
+
+def elapsed_since(perf_start: float) -> Tuple[float, float]:
+    """
+    Args:
+        perf_start: time.perf_counter() at the start of the measured span
+
+    Returns:
+        Wall clock start of the span and its duration in seconds
+    """
+    duration = time.perf_counter() - perf_start
+    return time.time() - duration, duration
+
+
+_current: contextvars.ContextVar[Optional[RunMetrics]] = contextvars.ContextVar("run_metrics", default=None)
+
+
+def current_metrics() -> Optional[RunMetrics]:
+    """Return the collector of the running context, None when the run is not instrumented"""
+    return _current.get()
+
+
+def record(record: Union[NodeRecord, DepthRecord, LLMRecord, SearchRecord]) -> None:
+    """Add a record to the collector of the running context, if any"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(record)
+
+
+@contextlib.contextmanager
+def collect(metrics: Optional[RunMetrics] = None) -> Iterator[RunMetrics]:
+    """
+    Collect the metrics of everything run inside the context, including the tasks and threads
+    it starts with a copy of its context (asyncio tasks, asyncio.to_thread, map_ordered)
+    """
+    metrics = metrics or RunMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def timed_node(name: str, node: Callable) -> Callable:
+    """Wrap a graph node so that its runs are recorded, keeping its signature and kind"""
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def _async_node(*args, **kwargs):
+            perf_start, ok = time.perf_counter(), False
+            try:
+                result = await node(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                start, wall = elapsed_since(perf_start)
+                record(NodeRecord(name=name, start=start, wall=wall, ok=ok))
+        return _async_node
+
+    @functools.wraps(node)
+    def _node(*args, **kwargs):
+        perf_start, ok = time.perf_counter(), False
+        try:
+            result = node(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            start, wall = elapsed_since(perf_start)
+            record(NodeRecord(name=name, start=start, wall=wall, ok=ok))
+    return _node
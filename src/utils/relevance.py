@@ -0,0 +1,140 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import operator
+import re
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+
+from src.utils.token_util import count_tokens, split_tokens
+
+# CJK runs are indexed as character unigrams and bigrams, other scripts as lowercased words
+_term_re = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+|[^\W_\u3400-\u9fff\uf900-\ufaff]+')
+_cjk_re = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into index terms, CJK text has no word boundaries and is indexed by character n-grams
+
+    Args:
+        text: Text to tokenize
+
+    Returns:
+        List of terms in text order
+    """
+    terms: List[str] = []
+    for match in _term_re.finditer(text.lower()):
+        term = match.group(0)
+        if _cjk_re.match(term):
+            terms.extend(term)
+            terms.extend(map(operator.add, term, term[1:]))
+        else:
+            terms.append(term)
+    return terms
+
+
+def split_passages(text: str, max_tokens: int) -> List[Tuple[str, int]]:
+    """
+    Split a text into passages of consecutive lines holding at most max_tokens tokens
+
+    Args:
+        text: Text to split
+        max_tokens: Maximum number of tokens of a passage
+
+    Returns:
+        List of (passage, token count) tuples in text order
+    """
+    passages: List[Tuple[str, int]] = []
+    lines: List[str] = []
+    tokens = 0
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        line_tokens = count_tokens(line)
+        if tokens + line_tokens > max_tokens and lines:
+            passages.append(("\n".join(lines), tokens))
+            lines, tokens = [], 0
+        if line_tokens > max_tokens:
+            passages.extend((piece, count_tokens(piece)) for piece in split_tokens(line, max_tokens))
+            continue
+        lines.append(line)
+        tokens += line_tokens
+    if lines:
+        passages.append(("\n".join(lines), tokens))
+    return passages
+
+
+class BM25:
+    """Okapi BM25 ranking over a small in-memory corpus"""
+    def __init__(self, corpus: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self._k1 = k1
+        self._b = b
+        self._term_counts = [Counter(terms) for terms in corpus]
+        self._doc_len = np.array([len(terms) for terms in corpus], dtype=np.float64)
+        self._avg_len = max(float(self._doc_len.mean()), 1.0) if len(corpus) else 1.0
+
+    def score(self, query: List[str]) -> np.ndarray:
+        """
+        Score every document of the corpus against a query
+
+        Args:
+            query: Terms of the query, repeated terms weigh more
+
+        Returns:
+            Array holding one score per document of the corpus
+        """
+        if not self._term_counts or not query:
+            return np.zeros(len(self._term_counts))
+        query_terms = Counter(query)
+        terms = list(query_terms)
+        weights = np.array([query_terms[t] for t in terms], dtype=np.float64)
+        # Term frequency matrix restricted to the query terms: documents x terms
+        tf = np.array([[counts.get(t, 0) for t in terms] for counts in self._term_counts], dtype=np.float64)
+        n = len(self._term_counts)
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        norm = self._k1 * (1.0 - self._b + self._b * self._doc_len / self._avg_len)
+        tf_weight = tf * (self._k1 + 1.0) / (tf + norm[:, None])
+        return tf_weight @ (idf * weights)
+
+
+def select_relevant(query: str, documents: List[str], max_tokens: int, passage_tokens: int = 200) -> List[str]:
+    """
+    Reduce every document longer than max_tokens to its passages most relevant to the query
+
+    Args:
+        query: Text the passages are ranked against
+        documents: Document contents
+        max_tokens: Token budget of every document
+        passage_tokens: Maximum size of a ranked passage
+
+    Returns:
+        One content per document, in input order. Documents within the budget are returned
+        unchanged, the kept passages of the other ones stay in document order. Passages sharing
+        no term with the query are dropped unless no passage of the document matches.
+    """
+    selected = list(documents)
+    long_docs = [i for i, document in enumerate(documents) if count_tokens(document) > max_tokens]
+    if not long_docs:
+        return selected
+
+    passages = {i: split_passages(documents[i], passage_tokens) for i in long_docs}
+    corpus = [tokenize(passage) for i in long_docs for passage, _ in passages[i]]
+    scores = BM25(corpus).score(tokenize(query))
+    offset = 0
+    for i in long_docs:
+        doc_scores = scores[offset:offset + len(passages[i])]
+        offset += len(passages[i])
+        kept: List[int] = []
+        tokens = 0
+        has_match = bool(np.any(doc_scores > 0))
+        # Stable sort keeps the earlier passage first when scores are equal
+        for j in np.argsort(-doc_scores, kind="stable"):
+            if tokens + passages[i][j][1] > max_tokens or (has_match and doc_scores[j] <= 0):
+                continue
+            kept.append(int(j))
+            tokens += passages[i][j][1]
+        selected[i] = "\n\n".join(passages[i][j][0] for j in sorted(kept))
+    return selected
@@ -0,0 +1,60 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+from typing import List
+
+import numpy as np
+
+from src.utils.fingerprint import shingle_hashes
+
+
+def ngram_vectors(texts: List[str], ngram: int = 2, dim: int = 4096) -> np.ndarray:
+    """
+    Embed texts as L2-normalized bags of hashed character n-grams
+
+    Args:
+        texts: Texts to embed
+        ngram: Number of characters of an n-gram
+        dim: Number of hash buckets, i.e. vector dimension
+
+    Returns:
+        Matrix of shape (len(texts), dim), the rows of empty texts are zero
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        buckets = (shingle_hashes(text, ngram) % np.uint64(dim)).astype(np.int64)
+        vectors[i] = np.bincount(buckets, minlength=dim)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def cluster_similar(texts: List[str], threshold: float = 0.8, ngram: int = 2, dim: int = 4096) -> List[List[int]]:
+    """
+    Group near-identical texts by the cosine similarity of their n-gram vectors
+
+    Args:
+        texts: Texts to group
+        threshold: Minimum similarity between a text and the first text of its group
+        ngram: Number of characters of an n-gram
+        dim: Number of hash buckets
+
+    Returns:
+        Groups of text indices. Every text belongs to exactly one group, groups are ordered
+        by their first index and indices inside a group are increasing.
+    """
+    if not texts:
+        return []
+    vectors = ngram_vectors(texts, ngram, dim)
+    similarity = vectors @ vectors.T
+    assigned = np.zeros(len(texts), dtype=bool)
+    groups: List[List[int]] = []
+    for i in range(len(texts)):
+        if assigned[i]:
+            continue
+        # Greedy leader clustering: an unassigned text close enough to the leader joins its group
+        members = np.flatnonzero(~assigned & (similarity[i] >= threshold))
+        # An empty text has a zero vector and is not even similar to itself
+        if not len(members) or members[0] != i:
+            members = np.concatenate(([i], members))
+        assigned[members] = True
+        groups.append([int(j) for j in members])
+    return groups
@@ -0,0 +1,174 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import asyncio
+import inspect
+import time
+
+from .concurrency import RateLimiter, map_ordered
+from .token_util import count_tokens, split_tokens, truncate_tokens
+from .relevance import BM25, select_relevant, tokenize
+from .fingerprint import NearDuplicateIndex, simhash
+from .similarity import cluster_similar
+from .disk_cache import DiskCache
+from .metrics import SearchRecord, collect, current_metrics, record, timed_node
+from .digest import RollingContext, digest_markdown
+
+
+def test_map_ordered_keeps_input_order():
+    def slow_square(x):
+        time.sleep(0.05 * (5 - x))
+        return x * x
+
+    results = map_ordered(slow_square, [1, 2, 3, 4], max_workers=4)
+    assert [r.value for r in results] == [1, 4, 9, 16]
+    assert all(r.ok for r in results)
+
+
+def test_map_ordered_reports_errors_and_timeouts():
+    def work(x):
+        if x == 1:
+            raise ValueError("boom")
+        if x == 2:
+            time.sleep(1)
+        return x
+
+    start = time.monotonic()
+    results = map_ordered(work, [0, 1, 2, 3], max_workers=4, timeout=0.2)
+    assert time.monotonic() - start < 0.9
+    assert results[0].value == 0 and results[3].value == 3
+    assert isinstance(results[1].error, ValueError)
+    assert isinstance(results[2].error, TimeoutError)
+
+
+def test_split_tokens_covers_text_with_overlap():
+    text = "深度研究 deep research, 2025年 " * 50
+    windows = split_tokens(text, 40, overlap=5)
+    assert len(windows) > 1
+    assert all(count_tokens(window) <= 41 for window in windows)
+    assert windows[0].startswith("深度研究") and text.rstrip().endswith(windows[-1].rstrip()[-10:])
+    assert split_tokens("short text", 40) == ["short text"]
+    assert count_tokens(truncate_tokens(text, 30)) <= 31
+
+
+def test_bm25_prefers_passages_about_the_query():
+    corpus = [tokenize(text) for text in ["房价 走势 分析 房价", "天气 晴朗", "price trend of housing", "menu login"]]
+    scores = BM25(corpus).score(tokenize("房价走势 housing price"))
+    assert scores[0] > scores[1] and scores[2] > scores[3]
+    assert scores[1] == 0 and scores[3] == 0
+
+
+def test_select_relevant_keeps_relevant_passages_in_order():
+    noise = "\n".join(f"navigation link {i} home about contact" for i in range(300))
+    page = "\n".join(["首页 登录", "2025年中国房价走势：一线城市房价同比下降", noise, "房价走势预测与政策分析"])
+    short = "short page"
+    selected = select_relevant("中国房价走势分析", [page, short], max_tokens=100, passage_tokens=20)
+    assert selected[1] == short
+    assert count_tokens(selected[0]) <= 110
+    assert selected[0].index("一线城市") < selected[0].index("政策分析")
+    assert "navigation" not in selected[0]
+
+
+def test_near_duplicate_index_finds_mirrors_only():
+    article = " ".join(f"sentence {i} about renewable energy storage and grid prices." for i in range(200))
+    mirror = "Reposted from the original site.\n" + article.replace("  ", " ") + "\nShare this article"
+    other = " ".join(f"paragraph {i} on the history of medieval trade routes." for i in range(200))
+    index = NearDuplicateIndex(max_distance=3)
+    assert index.find_or_add(simhash(article), "article") is None
+    assert index.find_or_add(simhash(other), "other") is None
+    assert index.find(simhash(mirror)) == "article"
+    assert index.find_or_add(simhash(mirror), "mirror") == "article"
+    assert len(index) == 2
+
+
+
+def test_cluster_similar_groups_near_identical_texts():
+    texts = [
+        "Global EV sales grew 35% in 2024, driven by China.",
+        "Battery prices fell sharply in 2023.",
+        "Global EV sales grew by 35% in 2024, driven by China",
+        "",
+        "battery prices fell sharply in 2023",
+    ]
+    assert cluster_similar(texts, threshold=0.8) == [[0, 2], [1, 4], [3]]
+
+
+def test_disk_cache_expires_and_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(tmp_path / "cache.sqlite", ttl=0.2)
+    cache.set("a", b"value")
+    assert cache.get("a") == b"value"
+    time.sleep(0.3)
+    assert cache.get("a") is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+    value = bytes(range(256)) * 40
+    cache = DiskCache(tmp_path / "lru.sqlite", max_bytes=3 * len(value) + 100, compress_level=0)
+    for key in "abc":
+        cache.set(key, value)
+    cache.get("a")
+    cache.set("d", value)
+    assert [cache.get(key) is not None for key in "abcd"] == [True, False, True, True]
+    assert cache.stats.evictions == 1
+
+
+def test_metrics_collect_nodes_and_worker_threads():
+    async def node(state):
+        await asyncio.sleep(0.02)
+        return {}
+
+    def search(query):
+        record(SearchRecord(query=query, start=time.time(), latency=0.01, results=2))
+        return query
+
+    wrapped = timed_node("learning", node)
+    assert inspect.iscoroutinefunction(wrapped) and inspect.signature(wrapped) == inspect.signature(node)
+    with collect() as metrics:
+        asyncio.run(wrapped({}))
+        map_ordered(search, ["a", "b", "c"], max_workers=3)
+    assert current_metrics() is None
+    record(SearchRecord(query="outside", start=0.0, latency=0.0))
+
+    summary = metrics.summary()
+    assert summary["nodes"]["learning"]["count"] == 1 and summary["nodes"]["learning"]["total"] >= 0.02
+    assert summary["search"]["count"] == 3
+    prometheus = metrics.to_prometheus()
+    assert 'deepresearch_node_seconds_count{node="learning"} 1' in prometheus
+    assert "deepresearch_search_latency_seconds_count{engine=\"all\"} 3" in prometheus
+
+
+def test_rate_limiter_queues_calls_over_the_limits():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+    # Bursts of 10 seconds worth of the limits pass at once, the calls beyond them wait in line
+    assert [limiter.reserve() for _ in range(100)] == [0.0] * 100
+    assert 0.09 < limiter.reserve() <= 0.11
+    assert 0.19 < limiter.reserve() <= 0.21
+
+    limiter = RateLimiter(tokens_per_minute=6000)
+    assert limiter.reserve(1000) == 0.0
+    limiter.consume(500)
+    assert 5.9 < limiter.reserve(100) <= 6.0
+    limiter.refund(100)
+    assert 4.9 < limiter.reserve(0) <= 5.0
+
+    limiter = RateLimiter()
+    limiter.pause(0.1)
+    start = time.monotonic()
+    asyncio.run(limiter.aacquire())
+    assert time.monotonic() - start >= 0.09
+
+
+def test_digest_keeps_headings_and_lead_sentences():
+    chapter = ("## Market\n### Size\nThe market grew **30%** in 2024 [^1][^2]. Demand came from Asia.\n\n"
+               "| a | b |\n|---|---|\n\n``` custom_html\n<div id=\"1\"></div>\n```\n"
+               "- 市场规模达到十亿元。增长放缓。\n")
+    assert digest_markdown(chapter, 100) == "## Market\n### Size\nThe market grew **30%** in 2024.\n市场规模达到十亿元。"
+    assert digest_markdown(chapter, 5) == "## Market"
+
+
+def test_rolling_context_keeps_the_latest_digests_within_budget():
+    context = RollingContext(token_budget=40, digest_tokens=20)
+    for i in range(10):
+        context.add(f"## Chapter {i}\n" + f"Finding number {i} is important. " * 50)
+    rendered = context.render()
+    assert count_tokens(rendered) <= 40
+    assert rendered.endswith("## Chapter 9\nFinding number 9 is important.")
+    assert "Chapter 0" not in rendered
@@ -0,0 +1,92 @@
+# Copyright (c) 2025 iFLYTEK CO.,LTD.
+# SPDX-License-Identifier: Apache 2.0 License
+import logging
+import re
+from functools import lru_cache
+from typing import List, Optional
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+
+# Used when the BPE file of tiktoken cannot be loaded (e.g. offline deployments): one token
+# per CJK character, per run of latin letters or digits and per punctuation symbol
+_fallback_token_re = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z0-9]+|[^\sA-Za-z0-9\u3400-\u9fff\uf900-\ufaff]')
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        logger.warning(f"Failed to load tiktoken encoding {ENCODING_NAME}, token counts are estimated: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text
+
+    Args:
+        text: Text to count
+
+    Returns:
+        Number of tokens, estimated when the tiktoken encoding is unavailable
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(_fallback_token_re.findall(text))
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_tokens(text: str, max_tokens: int, overlap: int = 0) -> List[str]:
+    """
+    Split a text into windows of at most max_tokens tokens
+
+    Args:
+        text: Text to split
+        max_tokens: Maximum number of tokens of every window
+        overlap: Number of tokens shared by two consecutive windows
+
+    Returns:
+        List of windows covering the whole text, a text that fits yields a single window
+    """
+    if not text:
+        return []
+    max_tokens = max(1, max_tokens)
+    step = max(1, max_tokens - max(0, overlap))
+    encoding = _get_encoding()
+    if encoding is None:
+        spans = [m.span() for m in _fallback_token_re.finditer(text)]
+        if len(spans) <= max_tokens:
+            return [text]
+        windows = []
+        for start in range(0, len(spans), step):
+            end = min(start + max_tokens, len(spans))
+            # Windows start at a token and extend to the next one, so no character is dropped
+            window_end = spans[end][0] if end < len(spans) else len(text)
+            windows.append(text[spans[start][0] if start else 0:window_end])
+            if end == len(spans):
+                break
+        return windows
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return [text]
+    windows = []
+    for start in range(0, len(tokens), step):
+        window = tokens[start:start + max_tokens]
+        windows.append(encoding.decode_bytes(window).decode("utf-8", errors="ignore"))
+        if start + max_tokens >= len(tokens):
+            break
+    return windows
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to its first max_tokens tokens"""
+    windows = split_tokens(text, max_tokens)
+    return windows[0] if windows else ""